@@ -0,0 +1,5 @@
+from scripts.montecarlo.launcher import main
+
+# write, run or merge the Monte Carlo job array of all keys in
+# scripts/Data/00_montecarlokeys.csv (see scripts/montecarlo/launcher.py)
+main()
@@ -13,6 +13,7 @@ from .runscripts.datapath import datapath
 from .initialization.initialize_n2o import initialize_n2o
 from .initialization.isotope_effects import IsotopeEffects
 from .initialization.bgc import BioGeoChemistry
+from .initialization.bgc_ensemble import BioGeoChemistryEnsemble
 from .initialization.modelparams import modelparams
 from .initialization.tracers import Tracers
 from .initialization.initialize import initialize
@@ -22,11 +23,28 @@ from .model.modelv2 import modelv2
 from .model.modelv3 import modelv3
 from .model.modelv4 import modelv4
 from .model.modelv5 import modelv5
-
-from .optimization.costfxn import costfxn
+from .model.modelv5_batch import modelv5_batch
+from .model.network import Network, Pathway, Transfer, NETWORKS, run_network
+from .model.observe import observe, replay
+from .model.ivp import modelv5_ivp, incubation_times
+from .model.expo import modelv5_expo
+from .model.health import HealthMonitor, HealthError
+from .model.substrates import SubstrateCache
+from .model.sensitivity import modelv5_sensitivity
+
+from .optimization.costfxn import costfxn, timepoint_indices, horizon
 from .optimization.initialguess import x0
 from .optimization.initialguess_modelv1 import x0_v1
 from .optimization.modelv5objective import modelv5objective
+from .optimization.fusedobjective import fusedobjective
+from .optimization.linearfit import linearfit
+from .optimization.gradient import fusedgradient, gradientfit
+from .optimization.residuals import fusedresiduals, residualfit
+from .optimization.transform import LogTransform, rate_scale
+from .optimization.multistart import multistart, fit, check_options
+from .optimization.population import PopulationObjective, populationfit
+from .optimization.speculative import SPECULATIVE, speculative_nelder_mead
+from .optimization.multifidelity import coarsen, multifidelity
 
 from .postprocessing.plotmodeloutput import plot_outputs
 from .postprocessing.plotmodeloutput2 import scatter_plot
@@ -38,3 +56,6 @@ from .runscripts.errors import errors
 
 from .montecarlo.genmontecarlo import genmontecarlo
 from .montecarlo.runmontecarlo import runmontecarlo
+from .montecarlo.sink import ResultSink
+from .montecarlo.streams import iteration_rng, root_seed
+from .montecarlo.workqueue import WorkQueue
@@ -0,0 +1,115 @@
+"""
+File: bgc_ensemble.py
+---------------------
+
+Stack the parameters of several BioGeoChemistry objects into arrays,
+so that many model solutions can be advanced in a single pass.
+"""
+
+import numpy as np
+
+# BioGeoChemistry attributes read by the forward models and by Tracers;
+# the first ten are in the same order as the columns of genmontecarlo()
+FIELDS = [
+    "nh4_14_i",
+    "nh4_15_i",
+    "no2_14_i",
+    "no2_15_i",
+    "no3_14_i",
+    "no3_15_i",
+    "kNH4TONO2",
+    "kNO2TONO3",
+    "kNO3TONO2",
+    "kN2OCONS",
+    "kNO2TONO",
+]
+
+
+class BioGeoChemistryEnsemble:
+    """
+    Ensemble of N BioGeoChemistry parameter sets.
+
+    Inputs:
+    bgcs = list of BioGeoChemistry objects, e.g. the NH4+, NO2- and NO3-
+    experiments for one station and feature, or N randomly perturbed copies
+    of one experiment
+
+    Outputs:
+    BioGeoChemistryEnsemble() = object with the same substrate and rate
+    attributes as BioGeoChemistry, each stored as a numpy array with
+    dimensions (N,), so that it broadcasts across the columns of a
+    (T, N) Tracers object.
+    """
+
+    def __init__(self, bgcs):
+
+        if not isinstance(bgcs, (list, tuple)):
+            bgcs = [bgcs]
+
+        self.members = list(bgcs)
+        self.size = len(self.members)
+        self.key = [bgc.key for bgc in self.members]
+
+        for field in FIELDS:
+            setattr(
+                self,
+                field,
+                np.array(
+                    [getattr(bgc, field) for bgc in self.members], dtype="float64"
+                ),
+            )
+
+    @classmethod
+    def from_samples(cls, bgc, samples):
+        """
+        Build an ensemble from the rows of genmontecarlo(bgc, iters).
+
+        Inputs:
+        bgc = BioGeoChemistry object that the samples were drawn around
+        samples = numpy array with dimensions (N, 10) from genmontecarlo.py
+
+        Outputs:
+        BioGeoChemistryEnsemble with N members
+        """
+
+        samples = np.atleast_2d(samples)
+        ensemble = cls([bgc] * len(samples))
+
+        for j, field in enumerate(FIELDS[: samples.shape[1]]):
+            setattr(ensemble, field, np.array(samples[:, j], dtype="float64"))
+
+        return ensemble
+
+    def broadcast(self, N):
+        """
+        Return an ensemble with N members; only valid if size is 1 or N.
+        """
+
+        if self.size == N:
+            return self
+        if self.size != 1:
+            raise ValueError(f"cannot broadcast ensemble of {self.size} to {N}")
+
+        ensemble = BioGeoChemistryEnsemble(self.members * N)
+        for field in FIELDS:
+            setattr(ensemble, field, np.repeat(getattr(self, field), N))
+
+        return ensemble
+
+    def tile(self, reps):
+        """
+        Return an ensemble that repeats all members reps times, e.g. to run
+        the same experiments under several parameter sets side by side.
+        """
+
+        ensemble = BioGeoChemistryEnsemble(self.members * reps)
+        for field in FIELDS:
+            setattr(ensemble, field, np.tile(getattr(self, field), reps))
+
+        return ensemble
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"BioGeoChemistryEnsemble of {self.size} initialized!"
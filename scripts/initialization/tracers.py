@@ -9,86 +9,151 @@ import numpy as np
 
 from .initialize_n2o import initialize_n2o
 
+# state variables of the model versions; also the order in which they are
+# laid out in Tracers.block
+SPECIES = (
+    "n2o_44",
+    "n2o_45a",
+    "n2o_45b",
+    "n2o_46",
+    "nh4_14",
+    "nh4_15",
+    "nh2oh_14",
+    "nh2oh_15",
+    "no_14",
+    "no_15",
+    "no2_14",
+    "no2_15",
+    "no3_14",
+    "no3_15",
+    "n2_28",
+    "n2_29",
+    "n2_30",
+    "afnh4",
+    "afno2",
+    "afno3",
+    "afnh2oh",
+    "afno",
+)
+
 
 class Tracers:
-    def __init__(self, T, bgc, trainingdata):
+
+    # a fixed set of attributes keeps the object small and makes a misspelled
+    # state variable an error instead of a new array
+    __slots__ = ("T", "N", "species", "block") + SPECIES
+
+    def __init__(self, T, bgc, trainingdata, N=1, species=None):
 
         ### INITIALIZE STATE VARIABLES ###
 
         # T = 1000
-
-        N2O44_init, N2O45a_init, N2O45b_init, N2O46_init = initialize_n2o(
-            trainingdata=trainingdata
-        )
+        # N = number of model solutions advanced side by side (one column each);
+        # bgc may then be a BioGeoChemistryEnsemble and trainingdata a list of
+        # one gridded DataFrame per column
+        # species = state variables to allocate: None for all of SPECIES, a
+        # model version such as "modelv5" for the ones that model uses, or a
+        # list of names
+
+        if species is None:
+            species = SPECIES
+        elif isinstance(species, str):
+            from ..model.network import NETWORKS
+
+            species = NETWORKS[species].species
+        unknown = set(species) - set(SPECIES)
+        if unknown:
+            raise ValueError(f"unknown state variables: {sorted(unknown)}")
+
+        self.T = T
+        self.N = N
+        self.species = tuple(s for s in SPECIES if s in species)
+
+        # all state variables share one contiguous block, so that the state
+        # at one timepoint is a single (n_species, N) slab; each attribute is
+        # a (T, N) view into it
+        # specify dtype to prevent overflow errors
+        self.block = np.zeros(shape=(T, len(self.species), N), dtype="float64")
+        for k, name in enumerate(self.species):
+            setattr(self, name, self.block[:, k, :])
+
+        self.reset(bgc, trainingdata)
+
+    def reset(self, bgc, trainingdata):
+        """
+        Re-initialize row 0 from new parameters, reusing the allocated arrays.
+
+        Inputs:
+        bgc = BioGeoChemistry object (or BioGeoChemistryEnsemble)
+        trainingdata = gridded DataFrame, or a list of N of them
+
+        Outputs:
+        self, with initial values in row 0; later rows are left as they are,
+        since the model versions overwrite them
+        """
+
+        if isinstance(trainingdata, (list, tuple)):
+            N2O44_init, N2O45a_init, N2O45b_init, N2O46_init = np.array(
+                [initialize_n2o(trainingdata=data) for data in trainingdata]
+            ).T
+        else:
+            N2O44_init, N2O45a_init, N2O45b_init, N2O46_init = initialize_n2o(
+                trainingdata=trainingdata
+            )
 
         # define atom fraction for natural abundance 15R/14R
         na = 0.0036765 / (1 + 0.0036765)  # [De Bièvre et al., 1996]
 
-        # initialize arrays of state variables
-        # specify dtype to prevent overflow errors
-        self.n2o_44 = np.zeros(shape=(T, 1), dtype="float64")
-        self.n2o_45a = np.zeros(shape=(T, 1), dtype="float64")
-        self.n2o_45b = np.zeros(shape=(T, 1), dtype="float64")
-        self.n2o_46 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.nh4_14 = np.zeros(shape=(T, 1), dtype="float64")
-        self.nh4_15 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.nh2oh_14 = np.zeros(shape=(T, 1), dtype="float64")
-        self.nh2oh_15 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.no_14 = np.zeros(shape=(T, 1), dtype="float64")
-        self.no_15 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.no2_14 = np.zeros(shape=(T, 1), dtype="float64")
-        self.no2_15 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.no3_14 = np.zeros(shape=(T, 1), dtype="float64")
-        self.no3_15 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.n2_28 = np.zeros(shape=(T, 1), dtype="float64")
-        self.n2_29 = np.zeros(shape=(T, 1), dtype="float64")
-        self.n2_30 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.afnh4 = np.zeros(shape=(T, 1), dtype="float64")
-        self.afno2 = np.zeros(shape=(T, 1), dtype="float64")
-        self.afno3 = np.zeros(shape=(T, 1), dtype="float64")
-
-        self.afnh2oh = np.zeros(shape=(T, 1), dtype="float64")
-        self.afno = np.zeros(shape=(T, 1), dtype="float64")
-
         # initial values of state variables
-
-        self.n2o_44[0, :] = N2O44_init
-        self.n2o_45a[0, :] = N2O45a_init
-        self.n2o_45b[0, :] = N2O45b_init
-        self.n2o_46[0, :] = N2O46_init
-
-        self.nh4_14[0, :] = bgc.nh4_14_i
-        self.nh4_15[0, :] = bgc.nh4_15_i
-
-        self.nh2oh_14[0, :] = 10 * (1 - na)  # arbitrary starting concentration of 10 nM
-        self.nh2oh_15[0, :] = 10 * na
-
-        self.no_14[0, :] = 10 * (1 - na)  # arbitrary starting concentration of 10 nM
-        self.no_15[0, :] = 10 * na
-
-        self.no2_14[0, :] = bgc.no2_14_i
-        self.no2_15[0, :] = bgc.no2_15_i
-
-        self.no3_14[0, :] = bgc.no3_14_i
-        self.no3_15[0, :] = bgc.no3_15_i
-
-        self.n2_28[0, :] = 0
-        self.n2_29[0, :] = 0
-        self.n2_30[0, :] = 0
-
-        self.afnh4[0, :] = bgc.nh4_15_i / (bgc.nh4_15_i + bgc.nh4_14_i)
-        self.afno2[0, :] = bgc.no2_15_i / (bgc.no2_15_i + bgc.no2_14_i)
-        self.afno3[0, :] = bgc.no3_15_i / (bgc.no3_15_i + bgc.no3_14_i)
-
-        self.afnh2oh[0, :] = na
-        self.afno[0, :] = na
+        initial = {
+            "n2o_44": N2O44_init,
+            "n2o_45a": N2O45a_init,
+            "n2o_45b": N2O45b_init,
+            "n2o_46": N2O46_init,
+            "nh4_14": bgc.nh4_14_i,
+            "nh4_15": bgc.nh4_15_i,
+            "nh2oh_14": 10 * (1 - na),  # arbitrary starting concentration of 10 nM
+            "nh2oh_15": 10 * na,
+            "no_14": 10 * (1 - na),  # arbitrary starting concentration of 10 nM
+            "no_15": 10 * na,
+            "no2_14": bgc.no2_14_i,
+            "no2_15": bgc.no2_15_i,
+            "no3_14": bgc.no3_14_i,
+            "no3_15": bgc.no3_15_i,
+            "n2_28": 0,
+            "n2_29": 0,
+            "n2_30": 0,
+            "afnh4": bgc.nh4_15_i / (bgc.nh4_15_i + bgc.nh4_14_i),
+            "afno2": bgc.no2_15_i / (bgc.no2_15_i + bgc.no2_14_i),
+            "afno3": bgc.no3_15_i / (bgc.no3_15_i + bgc.no3_14_i),
+            "afnh2oh": na,
+            "afno": na,
+        }
+
+        for k, name in enumerate(self.species):
+            self.block[0, k, :] = initial[name]
+
+        return self
+
+    def __getstate__(self):
+        # pickle the block once and rebuild the views from it, so that the
+        # attributes still share memory with the block after unpickling
+        return self.T, self.N, self.species, self.block
+
+    def __setstate__(self, state):
+        self.T, self.N, self.species, self.block = state
+        for k, name in enumerate(self.species):
+            setattr(self, name, self.block[:, k, :])
+
+    def __getattr__(self, name):
+        # only called for slots that were never set, i.e. species that were
+        # not allocated
+        if name in SPECIES:
+            raise AttributeError(
+                f"{name} was not allocated; pass species=None to Tracers "
+                "to allocate all state variables"
+            )
+        raise AttributeError(name)
 
     def __repr__(self):
         return "state variable arrays initialized!"
@@ -0,0 +1,204 @@
+"""
+File: expo.py
+-------------
+
+Large-step, positivity-preserving backend for modelv5. Each step is split
+(Strang splitting) into the first-order linear part of the model, which is
+advanced exactly with matrix exponentials, and the quadratic N2O production
+fluxes, which are advanced with their loss rates frozen at the start of the
+step. Both parts keep concentrations non-negative and conserve nitrogen, so
+steps of ~0.01-0.05 d can replace 1,000 Euler steps of 0.001 d. The
+transfers and pathways of each part are taken from the modelv5 reaction
+network (see network.py).
+"""
+
+import numpy as np
+from scipy.linalg import expm
+
+from .ivp import STATE
+from .network import NETWORKS
+
+
+def substrate_generators(bgc, isos):
+    """
+    Linear substrate exchange terms of modelv5 as matrices, from the
+    transfers of its reaction network (see network.py).
+
+    Inputs:
+    bgc = BioGeoChemistry or BioGeoChemistryEnsemble object
+    isos = IsotopeEffects object
+
+    Outputs:
+    L14, L15 = numpy arrays with dimensions (N, 3, 3) such that
+    d/dt [NH4+, NO2-, NO3-] = L @ [NH4+, NO2-, NO3-] for 14N and 15N
+    """
+
+    return NETWORKS["modelv5"].generators(bgc, isos)
+
+
+def substrate_operators(bgc, isos, h):
+    """
+    Matrix exponentials of the linear substrate exchange terms over a step h.
+
+    Inputs:
+    bgc = BioGeoChemistry or BioGeoChemistryEnsemble object
+    isos = IsotopeEffects object
+    h = step length (d)
+
+    Outputs:
+    E14, E15 = numpy arrays with dimensions (N, 3, 3) that advance the
+    [NH4+, NO2-, NO3-] vectors of 14N and 15N over h
+    """
+
+    L14, L15 = substrate_generators(bgc, isos)
+
+    return expm(h * L14), expm(h * L15)
+
+
+def linear_step(y, E14, E15, kcons, h):
+    """
+    Advance substrate exchange and N2O consumption exactly over h, in place.
+
+    Inputs:
+    y = dictionary of state arrays with dimensions (N,), keyed as STATE
+    E14, E15 = outputs of substrate_operators for the same h
+    kcons = N2O consumption rate constants for [44, 45a, 45b, 46]
+    h = step length (d)
+    """
+
+    for E, names in (
+        (E14, ("nh4_14", "no2_14", "no3_14")),
+        (E15, ("nh4_15", "no2_15", "no3_15")),
+    ):
+        v = np.einsum("nij,jn->in", E, np.array([y[name] for name in names]))
+        for name, values in zip(names, v):
+            y[name] = values
+
+    consumed = {}
+    for name, k in zip(("n2o_44", "n2o_45a", "n2o_45b", "n2o_46"), kcons):
+        consumed[name] = -y[name] * np.expm1(-h * k)
+        y[name] = y[name] - consumed[name]
+
+    y["n2_28"] = y["n2_28"] + consumed["n2o_44"]
+    y["n2_29"] = y["n2_29"] + consumed["n2o_45a"] + consumed["n2o_45b"]
+    y["n2_30"] = y["n2_30"] + consumed["n2o_46"]
+
+
+def flux_step(y, x, h):
+    """
+    Advance the quadratic N2O production fluxes over h, in place.
+
+    Loss rates and atom fractions are frozen at the start of the step, so each
+    substrate decays exponentially; the nitrogen consumed by each pathway of
+    the modelv5 reaction network is then converted into N2O with the same
+    stoichiometry as in modelv5.
+
+    Inputs:
+    y = dictionary of state arrays with dimensions (N,), keyed as STATE
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    h = step length (d)
+    """
+
+    network = NETWORKS["modelv5"]
+
+    pools = {pool: y[f"{pool}_14"] + y[f"{pool}_15"] for pool in network.pools}
+    af = {pool: y[f"{pool}_15"] / pools[pool] for pool in network.pools}
+
+    # first-order loss rates (1/d) of each substrate to each pathway that
+    # draws on it: J = x[k] * [a] * [b] takes x[k] * [b] of every unit of a
+    rates = {}
+    for p in network.pathways:
+        a, b = p.pools
+        for pool in p.substrates:
+            rates[p.name, pool] = x[p.k] * pools[b if pool == a else a]
+    loss = {
+        pool: sum(
+            (r for (_, q), r in rates.items() if q == pool), np.zeros_like(pools[pool])
+        )
+        for pool in network.pools
+    }
+
+    # nitrogen consumed from each substrate over h (nM N)
+    consumed = {pool: -pools[pool] * np.expm1(-h * loss[pool]) for pool in pools}
+
+    for pool in network.pools:
+        for isotope in ("14", "15"):
+            name = f"{pool}_{isotope}"
+            y[name] = y[name] * np.exp(-h * loss[pool])
+
+    # split consumed nitrogen between pathways; 0/0 means nothing was consumed
+    def share(k, loss):
+        return np.divide(k, loss, out=np.zeros_like(loss * k), where=loss > 0)
+
+    for p in network.pathways:
+        # a pathway with two substrates (Jhybrid2 in modelv5) draws J from both
+        J = sum(
+            consumed[pool] * share(rates[p.name, pool], loss[pool])
+            for pool in p.substrates
+        ) / len(p.substrates)
+        for name, probability in zip(
+            ("n2o_46", "n2o_45a", "n2o_45b", "n2o_44"), p.isotopocules(af, x)
+        ):
+            y[name] = y[name] + J * probability / 2
+
+
+def modelv5_expo(x, bgc, isos, tracers, t_eval, h=0.05):
+    """
+    Integrate modelv5 with split exponential steps and return the state at t_eval.
+
+    Inputs:
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgc = BioGeoChemistry or BioGeoChemistryEnsemble object
+    isos = IsotopeEffects object
+    tracers = Tracers object holding the initial state in row 0
+    t_eval = increasing times (d) at which to return the state, e.g.
+    incubation_times(trainingdata) or dt * np.arange(T)
+    h = largest step length (d); each interval between consecutive times in
+    t_eval is split into equal steps no longer than h
+
+    Outputs:
+    states = dictionary of numpy arrays with dimensions (len(t_eval), N) for
+    each name in STATE and for the atom fractions afnh4, afno2 and afno3
+    """
+
+    t_eval = np.asarray(t_eval, dtype="float64")
+
+    y = {name: getattr(tracers, name)[0].copy() for name in STATE}
+    states = {name: np.zeros((len(t_eval), len(y[name]))) for name in STATE}
+
+    kcons = [
+        bgc.kN2OCONS,
+        bgc.kN2OCONS / isos.alpha15N2OatoN2,
+        bgc.kN2OCONS / isos.alpha15N2ObtoN2,
+        bgc.kN2OCONS / isos.alpha46N2OtoN2,
+    ]
+
+    # half-step operators, keyed by step length, so that they are only
+    # computed once for each distinct step
+    operators = {}
+
+    t = 0.0
+    for k, tk in enumerate(t_eval):
+
+        nsteps = int(np.ceil((tk - t) / h - 1e-9)) if tk > t else 0
+        step = round((tk - t) / nsteps, 12) if nsteps else 0.0
+
+        if nsteps and step not in operators:
+            operators[step] = substrate_operators(bgc, isos, step / 2)
+
+        ### TIME STEPPING ###
+        for _ in range(nsteps):
+            E14, E15 = operators[step]
+            linear_step(y, E14, E15, kcons, step / 2)
+            flux_step(y, x, step)
+            linear_step(y, E14, E15, kcons, step / 2)
+
+        t = tk
+        for name in STATE:
+            states[name][k] = y[name]
+
+    states["afnh4"] = states["nh4_15"] / (states["nh4_14"] + states["nh4_15"])
+    states["afno2"] = states["no2_15"] / (states["no2_14"] + states["no2_15"])
+    states["afno3"] = states["no3_15"] / (states["no3_14"] + states["no3_15"])
+
+    return states
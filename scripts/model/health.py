@@ -0,0 +1,185 @@
+"""
+File: health.py
+---------------
+
+Opt-in numerical health monitor for observation-only runs. Every few time
+steps the current state is checked for negative concentrations, non-finite
+values (e.g. atom fractions of pools that were driven to zero) and growth of
+total nitrogen; a run that fails a check is stopped and the objective
+function returns a penalty cost instead of finishing a doomed run. Failed
+integrations of the "ivp" backend take the same path, with or without a
+monitor.
+"""
+
+import numpy as np
+
+from .ivp import STATE
+
+# failure modes, in the order of the status codes returned by the jit kernel,
+# and failed solve_ivp integrations
+REASONS = ("negative", "nonfinite", "mass", "solver")
+
+# cost of a stopped run if no HealthMonitor is given
+PENALTY = 1e6
+
+
+class HealthError(RuntimeError):
+    """
+    Raised by observe() when a run fails a health check, and by modelv5_ivp
+    when solve_ivp fails.
+
+    Attributes:
+    reason = one of REASONS
+    step = time step at which the run was stopped, or None
+    """
+
+    def __init__(self, reason, step):
+        where = "" if step is None else f" at step {step}"
+        super().__init__(f"model state failed the {reason!r} check{where}")
+        self.reason = reason
+        self.step = step
+
+
+def nitrogen_atoms(species):
+    """
+    Number of N atoms in each state variable, for the nitrogen mass balance.
+
+    Inputs:
+    species = names of Tracers arrays
+
+    Outputs:
+    atoms = numpy array with dimensions (len(species),): 2 for N2O and N2,
+    0 for atom fractions, and 1 for the other (substrate) pools
+    """
+
+    return np.array(
+        [
+            0.0 if s.startswith("af") else 2.0 if s.startswith(("n2o", "n2_")) else 1.0
+            for s in species
+        ]
+    )
+
+
+def check_states(monitor, states, tracers):
+    """
+    Check the snapshots returned by the "ivp" and "expo" backends of modelv5,
+    which do not expose their intermediate steps.
+
+    Inputs:
+    monitor = HealthMonitor object
+    states = dictionary of state arrays returned by modelv5_ivp or modelv5_expo
+    tracers = Tracers object holding the initial state in row 0
+    """
+
+    atoms = nitrogen_atoms(STATE)
+    y0 = np.array([getattr(tracers, name)[0] for name in STATE])
+    snapshots = np.stack([states[name] for name in STATE], axis=1)
+
+    monitor.record(monitor.inspect(snapshots, atoms, atoms @ y0))
+
+
+def integrate(integrator, monitor, x, bgc, isos, tracers, t_eval):
+    """
+    Run the "ivp" or "expo" backend of modelv5 and check its snapshots.
+
+    Inputs:
+    integrator = modelv5_ivp or modelv5_expo
+    monitor = optional HealthMonitor object, which also counts failed
+    integrations
+    x, bgc, isos, tracers, t_eval = passed on to the integrator
+
+    Outputs:
+    states = dictionary of state arrays returned by the integrator; raises
+    HealthError if the integration failed or the state failed a check
+    """
+
+    try:
+        states = integrator(x, bgc, isos, tracers, t_eval)
+    except HealthError as error:
+        if monitor is not None:
+            monitor.record(error.reason)
+        raise
+
+    if monitor is not None:
+        check_states(monitor, states, tracers)
+
+    return states
+
+
+class HealthMonitor:
+    """
+    Invariant checks and counters for observe() and fusedobjective().
+
+    The model versions remove nitrogen through the hybrid pathways but never
+    add any, so the mass balance check only fails if total nitrogen (the sum
+    that postprocess reports as check_mass_conservation, counting N atoms)
+    grows beyond its initial value.
+
+    Inputs:
+    every = number of time steps between checks
+    atol = concentrations below -atol (nM) count as negative
+    rtol = relative growth of total nitrogen that counts as a mass balance error
+    penalty = cost returned by fusedobjective for a run that was stopped
+    """
+
+    def __init__(self, every=25, atol=1e-12, rtol=1e-6, penalty=PENALTY):
+        self.every = int(every)
+        self.atol = atol
+        self.rtol = rtol
+        self.penalty = penalty
+
+        ### COUNTERS ###
+        self.evaluations = 0  # runs checked
+        self.aborted = 0  # runs stopped early
+        self.reasons = dict.fromkeys(REASONS, 0)
+        self.steps_skipped = 0  # time steps not taken because of early stops
+
+    def inspect(self, state, atoms, total0):
+        """
+        Check one or more snapshots of the state.
+
+        Inputs:
+        state = numpy array with dimensions (n_species, N), or
+        (n_snapshots, n_species, N)
+        atoms = output of nitrogen_atoms for the species in state
+        total0 = initial total nitrogen with dimensions (N,)
+
+        Outputs:
+        reason = the first failed check in REASONS, or None
+        """
+
+        concentrations = state[..., atoms > 0, :]
+        if (concentrations < -self.atol).any():
+            return "negative"
+        if not np.isfinite(state).all():
+            return "nonfinite"
+        total = np.einsum("s,...sn->...n", atoms, state)
+        if (total > total0 * (1 + self.rtol)).any():
+            return "mass"
+        return None
+
+    def record(self, reason=None, step=None, last=None):
+        """
+        Count one checked run, and raise HealthError if it failed.
+
+        Inputs:
+        reason = failed check, or None if the run was healthy
+        step = time step at which the run was stopped
+        last = last time step the run would otherwise have reached
+        """
+
+        self.evaluations += 1
+        if reason is None:
+            return
+        self.aborted += 1
+        self.reasons[reason] += 1
+        if step is not None and last is not None:
+            self.steps_skipped += max(last - step, 0)
+        raise HealthError(reason, step)
+
+    def __repr__(self):
+        return (
+            f"{self.aborted}/{self.evaluations} evaluations stopped early "
+            f"({', '.join(f'{r}: {n}' for r, n in self.reasons.items())}; "
+            f"{self.steps_skipped} steps skipped)"
+        )
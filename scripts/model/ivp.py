@@ -0,0 +1,126 @@
+"""
+File: ivp.py
+------------
+
+Adaptive-step backend for modelv5. The right-hand side of the modelv5
+equations is generated from its reaction network (see network.py) and
+integrated with scipy.integrate.solve_ivp, which chooses its own
+error-controlled steps and evaluates the solution only at the requested
+times, instead of taking T fixed Euler steps of length dt.
+"""
+
+import numpy as np
+from scipy.integrate import solve_ivp
+
+from .network import ALPHAS, RATES, NETWORKS
+
+# state variables integrated by solve_ivp, in the order of the state vector;
+# atom fractions are diagnosed from the 14N and 15N species
+STATE = (
+    "nh4_14",
+    "nh4_15",
+    "no2_14",
+    "no2_15",
+    "no3_14",
+    "no3_15",
+    "n2o_44",
+    "n2o_45a",
+    "n2o_45b",
+    "n2o_46",
+    "n2_28",
+    "n2_29",
+    "n2_30",
+)
+
+
+def incubation_times(trainingdata):
+    """
+    Incubation times of the gridded data, in days since the first timepoint.
+
+    Inputs:
+    trainingdata = Pandas Dataframe output from read_data.grid_data
+
+    Outputs:
+    times = numpy array of 2-3 times (d), starting at 0
+    """
+
+    hrs = trainingdata["Incubation_time_hrs"].to_numpy(dtype="float64")
+
+    return (hrs - hrs[0]) / 24
+
+
+def modelv5_rhs(t, y, x, bgc, isos, N):
+    """
+    Time derivatives of the modelv5 state variables.
+
+    Inputs:
+    t = time (d); unused, the equations are autonomous
+    y = state vector with dimensions (13 * N,), ordered as STATE
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgc = BioGeoChemistry or BioGeoChemistryEnsemble object
+    isos = IsotopeEffects object
+    N = number of model solutions in the state vector
+
+    Outputs:
+    dydt = numpy array with dimensions (13 * N,)
+    """
+
+    K = [getattr(bgc, k) for k in RATES]
+    A = [getattr(isos, a) for a in ALPHAS]
+    y = dict(zip(STATE, y.reshape(len(STATE), N)))
+
+    dydt = NETWORKS["modelv5"].derivatives()(x, K, A, y)
+
+    return np.concatenate([dydt[s] for s in STATE])
+
+
+def modelv5_ivp(x, bgc, isos, tracers, t_eval, method="LSODA", rtol=1e-8, atol=1e-8):
+    """
+    Integrate modelv5 with adaptive steps and return the state at t_eval.
+
+    Inputs:
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgc = BioGeoChemistry or BioGeoChemistryEnsemble object
+    isos = IsotopeEffects object
+    tracers = Tracers object holding the initial state in row 0
+    t_eval = increasing times (d) at which to return the state, e.g.
+    incubation_times(trainingdata) or dt * np.arange(T)
+    method, rtol, atol = passed on to scipy.integrate.solve_ivp
+
+    Outputs:
+    states = dictionary of numpy arrays with dimensions (len(t_eval), N) for
+    each name in STATE and for the atom fractions afnh4, afno2 and afno3;
+    raises HealthError (see health.py) if solve_ivp fails
+    """
+
+    t_eval = np.asarray(t_eval, dtype="float64")
+    N = tracers.n2o_44.shape[1]
+
+    y0 = np.concatenate([getattr(tracers, s)[0] for s in STATE])
+
+    solution = solve_ivp(
+        modelv5_rhs,
+        (0, t_eval[-1]),
+        y0,
+        method=method,
+        t_eval=t_eval,
+        args=(x, bgc, isos, N),
+        rtol=rtol,
+        atol=atol,
+    )
+
+    if not solution.success:
+        # imported here, since health.py imports STATE from this module
+        from .health import HealthError
+
+        raise HealthError("solver", None)
+
+    # solution.y has dimensions (13 * N, len(t_eval))
+    y = solution.y.reshape(len(STATE), N, len(t_eval)).transpose(0, 2, 1)
+    states = dict(zip(STATE, y))
+
+    states["afnh4"] = states["nh4_15"] / (states["nh4_14"] + states["nh4_15"])
+    states["afno2"] = states["no2_15"] / (states["no2_14"] + states["no2_15"])
+    states["afno3"] = states["no3_15"] / (states["no3_14"] + states["no3_15"])
+
+    return states
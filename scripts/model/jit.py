@@ -0,0 +1,208 @@
+"""
+File: jit.py
+------------
+
+Optional compiled backend for modelv1-modelv5. The kernel of each model
+version is generated from its reaction network (see network.py) and compiled
+with numba, if numba is installed; otherwise the model versions fall back to
+their numpy time loops.
+"""
+
+import warnings
+
+import numpy as np
+
+from .network import ALPHAS, RATES, NETWORKS, columns, run_network
+from .health import REASONS, nitrogen_atoms
+
+try:
+    from numba import njit
+except ImportError:  # numba is an optional dependency
+    njit = None
+
+
+def use_jit(backend):
+    """
+    Decide whether a model version should run on the compiled kernels.
+
+    Inputs:
+    backend = "numpy" (default time loop) or "jit" (compiled kernels)
+
+    Outputs:
+    True if backend is "jit" and numba is available; if numba is missing,
+    warn and return False so that the numpy time loop is used instead.
+    """
+
+    if backend == "numpy":
+        return False
+    if backend != "jit":
+        raise ValueError(f"unknown backend {backend!r}; use 'numpy' or 'jit'")
+    if njit is None:
+        warnings.warn("numba is not installed; falling back to the numpy backend")
+        return False
+    return True
+
+
+def run_jit(model, x, bgc, isos, tracers, modelparams):
+    """
+    Run the compiled kernel of one model version in place on a Tracers object.
+
+    Inputs:
+    model = "modelv1", "modelv2", "modelv3", "modelv4", or "modelv5"
+    x, bgc, isos, tracers, modelparams = same as for the model version; x and
+    the bgc rate constants may be scalars or arrays with dimensions (N,)
+
+    Outputs:
+    tracers = the Tracers object, with all T timepoints filled in
+    """
+
+    return run_network(NETWORKS[model], x, bgc, isos, tracers, modelparams, jit=True)
+
+
+def run_jit_observe(
+    model, x, bgc, isos, tracers, modelparams, rows, species, obs, monitor=None
+):
+    """
+    Observation-only counterpart of run_jit, used by observe.py.
+
+    Inputs:
+    model, x, bgc, isos, modelparams = same as for run_jit
+    tracers = Tracers object with the initial state in row 0; only rows 0
+    and 1 are used, as a rolling state
+    rows = sorted, distinct integer timepoints at which to record the state
+    species = names of the Tracers arrays to record
+    obs = numpy array with dimensions (len(species), len(rows), N), filled in place
+    monitor = optional HealthMonitor (health.py); the kernel checks the state
+    every monitor.every steps and stops early if a check fails
+
+    Outputs:
+    obs, filled in up to the last recorded timepoint before any early stop
+    """
+
+    (dt, T, times) = modelparams
+    N = tracers.n2o_44.shape[1]
+
+    X = np.array([columns(xi, N) for xi in x])
+    K = np.array([columns(getattr(bgc, k), N) for k in RATES])
+    A = np.array([getattr(isos, a) for a in ALPHAS], dtype="float64")
+    network = NETWORKS[model]
+    missing = [s for s in species if s not in network.species]
+    if missing:
+        raise ValueError(f"{model} does not have the state variables {missing}")
+
+    S = tuple(getattr(tracers, s) for s in network.species)
+    which = np.array([network.species.index(s) for s in species], dtype="int64")
+    rows = np.asarray(rows, dtype="int64")
+
+    if monitor is None:
+        every, atol, rtol = 0, 0.0, 0.0
+    else:
+        every, atol, rtol = monitor.every, monitor.atol, monitor.rtol
+    atoms = nitrogen_atoms(network.species)
+
+    kernel = network.compile(jit=True)
+    status, step = _observe_kernel(
+        kernel,
+        float(dt),
+        int(T),
+        X,
+        K,
+        A,
+        S,
+        rows,
+        which,
+        obs,
+        every,
+        atoms,
+        atol,
+        rtol,
+    )
+
+    if monitor is not None:
+        reason = REASONS[status - 1] if status else None
+        monitor.record(reason, step, int(T) - 1)
+
+    return obs
+
+
+def _binomial(af1, af2):
+    # scalar version of functions/binomial.py
+    p1 = af1 * af2
+    p2 = af1 * (1 - af2)
+    p3 = (1 - af1) * af2
+    p4 = (1 - af1) * (1 - af2)
+    return p1, p2, p3, p4
+
+
+def _binomial_stoichiometry(afNO, afNH2OH):
+    # scalar version of functions/binomial_stoichiometry.py
+    p46 = 1.0 / 3 * afNO**2 + 2.0 / 3 * afNO * afNH2OH
+    p45a = 2.0 / 3 * afNO * (1 - afNH2OH) + 1.0 / 3 * afNO * (1 - afNO)
+    p45b = 2.0 / 3 * (1 - afNO) * afNH2OH + 1.0 / 3 * afNO * (1 - afNO)
+    p44 = 1.0 / 3 * ((1 - afNO) ** 2) + 2.0 / 3 * (1 - afNO) * (1 - afNH2OH)
+    return p46, p45a, p45b, p44
+
+
+def _health(S, atoms, total0, atol, rtol):
+    # status code of the state in row 0: 0 if healthy, otherwise 1 + the
+    # index of the failed check in health.REASONS
+    N = total0.shape[0]
+    for s in range(len(S)):
+        for j in range(N):
+            if atoms[s] > 0 and S[s][0, j] < -atol:
+                return 1
+    for s in range(len(S)):
+        for j in range(N):
+            if not np.isfinite(S[s][0, j]):
+                return 2
+    for j in range(N):
+        total = 0.0
+        for s in range(len(S)):
+            total += atoms[s] * S[s][0, j]
+        if total > total0[j] * (1 + rtol):
+            return 3
+    return 0
+
+
+def _observe_kernel(
+    kernel, dt, T, X, K, A, S, rows, which, obs, every, atoms, atol, rtol
+):
+
+    N = X.shape[1]
+    total0 = np.zeros(N)
+    for j in range(N):
+        for s in range(len(S)):
+            total0[j] += atoms[s] * S[s][0, j]
+
+    k = 0
+    for iT in range(T):
+
+        if every > 0 and iT > 0 and (iT % every == 0 or iT == T - 1):
+            status = _health(S, atoms, total0, atol, rtol)
+            if status:
+                return status, iT
+
+        if k < rows.shape[0] and rows[k] == iT:
+            for s in range(which.shape[0]):
+                obs[s, k, :] = S[which[s]][0, :]
+            k += 1
+
+        if iT == T - 1:
+            break
+
+        # one step from row 0 into row 1, then roll the state back into row 0
+        kernel(dt, 2, X, K, A, S)
+        for s in range(len(S)):
+            S[s][0, :] = S[s][1, :]
+
+    return 0, T - 1
+
+
+### COMPILE ###
+
+if njit is not None:
+    _binomial = njit(cache=True)(_binomial)
+    _binomial_stoichiometry = njit(cache=True)(_binomial_stoichiometry)
+    _health = njit(cache=True)(_health)
+    # takes a compiled kernel as an argument, which numba cannot cache
+    _observe_kernel = njit(_observe_kernel)
@@ -0,0 +1,62 @@
+"""
+File: modelv5_batch.py
+----------------------
+
+Run modelv5 for an ensemble of N solutions in one pass. Each column of the
+state arrays holds one solution, so the Python-level time loop is paid once
+per ensemble instead of once per solution.
+"""
+
+import numpy as np
+
+from ..initialization.bgc_ensemble import BioGeoChemistryEnsemble
+from ..initialization.tracers import Tracers
+from .modelv5 import modelv5
+
+
+def modelv5_batch(X, bgc_ensemble, isos, params, trainingdata, backend="numpy"):
+    """
+    Advance N modelv5 solutions at once.
+
+    Inputs:
+    X = array-like with dimensions (N, 5) or (5,): one row of
+    [knitrification, kdenitno2, kdenitno3, khybrid2, f] per solution
+    bgc_ensemble = BioGeoChemistryEnsemble, or a BioGeoChemistry object or list
+    of them, with 1 or N members
+    isos = IsotopeEffects object
+    params = model params from modelparams.py
+    trainingdata = gridded DataFrame from read_data.grid_data, or a list of 1
+    or N of them, used to initialize N2O isotopocules
+    backend = "numpy" or "jit", passed on to modelv5
+
+    A single row of X, a single ensemble member, or a single DataFrame is
+    broadcast across all N solutions.
+
+    Outputs:
+    tracers = Tracers object whose state arrays have dimensions (T, N)
+    """
+
+    (dt, T, times) = params
+
+    X = np.atleast_2d(np.asarray(X, dtype="float64"))
+    if not isinstance(bgc_ensemble, BioGeoChemistryEnsemble):
+        bgc_ensemble = BioGeoChemistryEnsemble(bgc_ensemble)
+    if not isinstance(trainingdata, (list, tuple)):
+        trainingdata = [trainingdata]
+
+    N = max(len(X), bgc_ensemble.size, len(trainingdata))
+
+    if len(X) not in (1, N):
+        raise ValueError(f"X has {len(X)} rows; expected 1 or {N}")
+    if len(trainingdata) not in (1, N):
+        raise ValueError(f"got {len(trainingdata)} datasets; expected 1 or {N}")
+
+    bgc_ensemble = bgc_ensemble.broadcast(N)
+    if len(trainingdata) == 1:
+        trainingdata = trainingdata * N
+
+    tracers = Tracers(T, bgc_ensemble, list(trainingdata), N=N)
+
+    # each row of X.T is one parameter with dimensions (N,) or (1,),
+    # which broadcasts against the (N,) rows of the state arrays
+    return modelv5(X.T, bgc_ensemble, isos, tracers, params, backend=backend)
@@ -0,0 +1,594 @@
+"""
+File: network.py
+----------------
+
+Declarative reaction networks for modelv1-modelv5. Each model version is
+described by its nitrogen pools, the first-order transfers between them,
+and its N2O production pathways; compile() turns a description into the
+source code of one forward-Euler time loop, which runs either as vectorized
+numpy (one row of the state arrays at a time), as the "numpy" backend of
+every model version, or, compiled with numba, as the "jit" backend.
+derivatives() generates the right-hand side of the same equations for the
+modelv5 integrators and sensitivities, and generators() and
+Pathway.isotopocules() expose the transfers and N2O production of a network
+to the split-step and substrate-cache backends, so that the equations of
+each model version are written down only once.
+"""
+
+import hashlib
+import importlib.util
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from .. import binomial
+from .. import binomial_stoichiometry
+from ..initialization.tracers import SPECIES
+
+# order in which the IsotopeEffects are handed to the kernels
+ALPHAS = (
+    "alpha15NH4TONO2AOA",
+    "alpha15NH4TONO2AOB",
+    "alpha15NO2TONO3",
+    "alpha15NO3TONO2",
+    "alpha15NO2TONO",
+    "alpha15N2OatoN2",
+    "alpha15N2ObtoN2",
+    "alpha46N2OtoN2",
+)
+
+# order in which the BioGeoChemistry rate constants are handed to the kernels
+RATES = ("kNH4TONO2", "kNO2TONO3", "kNO3TONO2", "kN2OCONS")
+
+
+class Transfer:
+    """
+    First-order transfer of nitrogen from one pool to another.
+
+    Inputs:
+    source, sink = pool names, e.g. "nh4" and "no2"
+    rate = name of a BioGeoChemistry rate constant in RATES, or a number
+    alpha = name of the IsotopeEffects alpha that divides the rate constant
+    for 15N
+    """
+
+    def __init__(self, source, sink, rate, alpha):
+        self.source = source
+        self.sink = sink
+        self.rate = rate
+        self.alpha = alpha
+
+
+class Pathway:
+    """
+    Second-order N2O production pathway, J = x[k] * [alpha pool] * [beta pool].
+    Each distinct substrate pool loses J nmol N/L/day and J/2 nmol N2O/L/day
+    are produced.
+
+    Inputs:
+    name = label used in the generated code, e.g. "nitrification"
+    k = index of the rate constant in the model version's x
+    pools = (pool feeding the alpha N, pool feeding the beta N)
+    probabilities = "binomial" or "stoichiometry" (binomial_stoichiometry.py)
+    split = how the 45N2O probabilities p2 and p3 are assigned to 45N2Oa and
+    45N2Ob: "site" (p2 to 45a, p3 to 45b), "pooled" ((p2 + p3) * f to 45a),
+    or "mixed" (f * p2 + (1 - f) * p3 to 45a)
+    f = for "pooled" and "mixed": a number, "random" (drawn once per time
+    step as 0.02 * randn + 0.5), or ("x", i) for x[i]
+    """
+
+    def __init__(self, name, k, pools, probabilities="binomial", split="site", f=None):
+        self.name = name
+        self.k = k
+        self.pools = tuple(pools)
+        self.probabilities = probabilities
+        self.split = split
+        self.f = f
+
+    @property
+    def substrates(self):
+        # distinct pools that lose nitrogen to this pathway
+        return tuple(dict.fromkeys(self.pools))
+
+    def isotopocules(self, af, x):
+        """
+        Probabilities of the isotopocules of the N2O from this pathway, as in
+        the generated code (see Network.source).
+
+        Inputs:
+        af = dictionary of the atom fraction of each pool, e.g. {"nh4": ...}
+        x = model parameters of the model version
+
+        Outputs:
+        p46, p45a, p45b, p44 = probabilities, with the dimensions of af
+        """
+
+        function = (
+            binomial if self.probabilities == "binomial" else binomial_stoichiometry
+        )
+        q1, q2, q3, q4 = function(af[self.pools[0]], af[self.pools[1]])
+
+        if self.split == "site":
+            return q1, q2, q3, q4
+        if self.f == "random":
+            raise ValueError(f"{self.name} draws f at random in every time step")
+        f = x[self.f[1]] if isinstance(self.f, tuple) else self.f
+        if self.split == "pooled":
+            return q1, (q2 + q3) * f, (q2 + q3) * (1 - f), q4
+        return q1, f * q2 + (1 - f) * q3, (1 - f) * q2 + f * q3, q4
+
+
+class Network:
+    """
+    Reaction network of one model version.
+
+    Inputs:
+    name = model version, e.g. "modelv5"
+    pools = nitrogen pools with 14N, 15N and atom fraction state variables
+    transfers = list of Transfer objects
+    pathways = list of Pathway objects
+    """
+
+    def __init__(self, name, pools, transfers, pathways):
+        self.name = name
+        self.pools = tuple(pools)
+        self.transfers = list(transfers)
+        self.pathways = list(pathways)
+        self._compiled = {}
+
+    @property
+    def species(self):
+        # Tracers arrays read or written by this network, in SPECIES order;
+        # also the order in which they are handed to its kernel
+        used = {"n2o_44", "n2o_45a", "n2o_45b", "n2o_46", "n2_28", "n2_29", "n2_30"}
+        for pool in self.pools:
+            used |= {f"{pool}_14", f"{pool}_15", f"af{pool}"}
+        return tuple(s for s in SPECIES if s in used)
+
+    @property
+    def state(self):
+        # state variables with a time derivative, in SPECIES order; the atom
+        # fractions are diagnosed from the 14N and 15N species
+        return tuple(s for s in self.species if not s.startswith("af"))
+
+    def _equations(self, now, col):
+        # shared by the time loop and the right-hand side: lines that compute
+        # the fluxes and isotopocule probabilities, and the expression of the
+        # time derivative of each state variable in self.state
+
+        def rate(transfer, isotope):
+            r = transfer.rate
+            r = f"K[{RATES.index(r)}{col}" if isinstance(r, str) else repr(r)
+            if isotope == "15":
+                r += f" / A[{ALPHAS.index(transfer.alpha)}]"
+            return r
+
+        def total(terms):
+            # sum of signed terms, without a leading unary plus
+            return " ".join(terms).removeprefix("+ ")
+
+        body = []
+        emit = body.append
+        derivatives = {}
+
+        # rate constants and fluxes
+        for p in self.pathways:
+            emit(f"{p.name} = X[{p.k}{col}")
+        for pool in self.pools:
+            emit(f"{pool} = {pool}_14{now} + {pool}_15{now}")
+        for p in self.pathways:
+            a, b = p.pools
+            flux = f"{p.name} * ({a} ** 2)" if a == b else f"{p.name} * {a} * {b}"
+            emit(f"J{p.name} = {flux}")
+
+        # substrate pools: transfers in, transfers out, then N2O production
+        for pool in self.pools:
+            for isotope in ("14", "15"):
+                af = f"af{pool}{now}"
+                terms = [
+                    f"+ {rate(t, isotope)} * {t.source}_{isotope}{now}"
+                    for t in self.transfers
+                    if t.sink == pool
+                ]
+                terms += [
+                    f"- {rate(t, isotope)} * {pool}_{isotope}{now}"
+                    for t in self.transfers
+                    if t.source == pool
+                ]
+                terms += [
+                    f"- J{p.name} * " + (f"(1 - {af})" if isotope == "14" else af)
+                    for p in self.pathways
+                    if pool in p.substrates
+                ]
+                derivatives[f"{pool}_{isotope}"] = total(terms)
+
+        # isotopomer probabilities, computed once for each pair of atom fractions
+        probabilities = {}
+        for p in self.pathways:
+            a, b = p.pools
+            key = (p.probabilities, a, b)
+            if key not in probabilities:
+                probabilities[key] = f"p{len(probabilities)}"
+                function = "binomial" if p.probabilities == "binomial" else "stoich"
+                name = probabilities[key]
+                emit(
+                    f"{name}_1, {name}_2, {name}_3, {name}_4 = "
+                    f"{function}(af{a}{now}, af{b}{now})"
+                )
+
+        # production of each isotopocule; mixed-substrate pathways are summed first
+        order = [p for p in self.pathways if len(p.substrates) > 1]
+        order += [p for p in self.pathways if len(p.substrates) == 1]
+        production = {"46": [], "45a": [], "45b": [], "44": []}
+        for p in order:
+            q = probabilities[(p.probabilities, *p.pools)]
+            if p.f is None:
+                f = None
+            elif p.f == "random":
+                f = "f"
+            elif isinstance(p.f, tuple):
+                f = f"X[{p.f[1]}{col}"
+            else:
+                f = repr(p.f)
+
+            if p.split == "site":
+                p45a, p45b = f"{q}_2", f"{q}_3"
+            elif p.split == "pooled":
+                p45a = f"(({q}_2 + {q}_3) * {f})"
+                p45b = f"(({q}_2 + {q}_3) * (1 - {f}))"
+            else:  # "mixed"
+                p45a = f"({f} * {q}_2 + (1 - {f}) * {q}_3)"
+                p45b = f"((1 - {f}) * {q}_2 + {f} * {q}_3)"
+
+            emit(f"total_{p.name} = J{p.name} / 2")
+            for iso, prob in zip(
+                ("46", "45a", "45b", "44"), (f"{q}_1", p45a, p45b, f"{q}_4")
+            ):
+                production[iso].append(f"+ total_{p.name} * {prob}")
+
+        # N2O consumption to N2
+        kcons = f"K[{RATES.index('kN2OCONS')}{col}"
+        consumption = {
+            "46": f"{kcons} / A[{ALPHAS.index('alpha46N2OtoN2')}] * n2o_46{now}",
+            "45a": f"{kcons} / A[{ALPHAS.index('alpha15N2OatoN2')}] * n2o_45a{now}",
+            "45b": f"{kcons} / A[{ALPHAS.index('alpha15N2ObtoN2')}] * n2o_45b{now}",
+            "44": f"{kcons} * n2o_44{now}",
+        }
+        for iso in ("44", "45a", "45b", "46"):
+            derivatives[f"n2o_{iso}"] = total(
+                production[iso] + [f"- {consumption[iso]}"]
+            )
+        derivatives["n2_28"] = consumption["44"]
+        derivatives["n2_29"] = f"{consumption['45a']} + {consumption['45b']}"
+        derivatives["n2_30"] = consumption["46"]
+
+        return body, derivatives
+
+    def source(self, jit=False):
+        """
+        Generate the source code of the time loop of this network.
+
+        The generated function has the signature kernel(dt, T, X, K, A, S),
+        with X = model parameters with dimensions (len(x), N), K = rate
+        constants in RATES order with dimensions (4, N), A = alphas in ALPHAS
+        order, and S = tuple of (T, N) state arrays in the order of
+        self.species. With
+        jit=True, the loop body runs once per column j; otherwise it operates
+        on whole rows of the state arrays, and X, K and A may be sequences of
+        scalars or (N,) arrays.
+        """
+
+        if jit:
+            now, new, col = "[iT, j]", "[iT + 1, j]", ", j]"
+        else:
+            now, new, col = "[iT]", "[iT + 1]", "]"
+
+        body, derivatives = self._equations(now, col)
+
+        # forward-Euler updates: substrate pools, their atom fractions, then
+        # N2O and N2 (all of which only read the state at iT)
+        for pool in self.pools:
+            for isotope in ("14", "15"):
+                s = f"{pool}_{isotope}"
+                body.append(f"{s}{new} = {s}{now} + dt * ({derivatives[s]})")
+        for pool in self.pools:
+            body.append(
+                f"af{pool}{new} = {pool}_15{new} / ({pool}_14{new} + {pool}_15{new})"
+            )
+        for s in ("n2o_46", "n2o_45a", "n2o_45b", "n2o_44", "n2_28", "n2_29", "n2_30"):
+            body.append(f"{s}{new} = {s}{now} + dt * ({derivatives[s]})")
+
+        # assemble the time loop
+        lines = [f"def {self.name}_kernel(dt, T, X, K, A, S):"]
+        lines += [f"    {s} = S[{i}]" for i, s in enumerate(self.species)]
+        if jit:
+            lines += ["    N = X.shape[1]"]
+        lines += ["    for iT in range(T - 1):"]
+        indent = "        "
+        if any(p.f == "random" for p in self.pathways):
+            lines += [indent + "f = 0.02 * np.random.randn() + 0.5"]
+        if jit:
+            lines += [indent + "for j in range(N):"]
+            indent += "    "
+        lines += [indent + line for line in body]
+
+        return "\n".join(lines) + "\n"
+
+    def rhs_source(self):
+        """
+        Generate the source code of the right-hand side of this network.
+
+        The generated function has the signature rhs(X, K, A, Y), with X, K
+        and A as for source(), indexed by entry only, and Y = dictionary of
+        the current value of each state variable in self.state. It returns a
+        dictionary of their time derivatives. It uses only arithmetic, so the
+        values may be numpy arrays with dimensions (N,) or any objects that
+        implement it, e.g. the dual numbers of sensitivity.py.
+        """
+
+        body, derivatives = self._equations("", "]")
+
+        lines = [f"def {self.name}_rhs(X, K, A, Y):"]
+        lines += [f"    {s} = Y[{s!r}]" for s in self.state]
+        lines += [
+            f"    af{pool} = {pool}_15 / ({pool}_14 + {pool}_15)" for pool in self.pools
+        ]
+        if any(p.f == "random" for p in self.pathways):
+            lines += ["    f = 0.02 * np.random.randn() + 0.5"]
+        lines += ["    " + line for line in body]
+        lines += ["    return {"]
+        lines += [f"        {s!r}: {derivatives[s]}," for s in self.state]
+        lines += ["    }"]
+
+        return "\n".join(lines) + "\n"
+
+    def compile(self, jit=False):
+        """
+        Compile the time loop of this network once and return it.
+
+        Inputs:
+        jit = if True, compile with numba; otherwise return the numpy version
+
+        Outputs:
+        kernel = function kernel(dt, T, X, K, A, S), see source()
+        """
+
+        if jit not in self._compiled:
+            if jit:
+                from numba import njit
+
+                from .jit import _binomial, _binomial_stoichiometry
+
+                namespace = {
+                    "np": np,
+                    "binomial": _binomial,
+                    "stoich": _binomial_stoichiometry,
+                }
+                kernel, cached = _load(self.name, self.source(jit), namespace)
+                self._compiled[jit] = njit(cache=cached)(kernel)
+            else:
+                self._compiled[jit] = _exec(self.name, "kernel", self.source(jit))
+
+        return self._compiled[jit]
+
+    def derivatives(self):
+        """
+        Compile the right-hand side of this network once and return it.
+
+        Outputs:
+        rhs = function rhs(X, K, A, Y), see rhs_source()
+        """
+
+        if "rhs" not in self._compiled:
+            self._compiled["rhs"] = _exec(self.name, "rhs", self.rhs_source())
+
+        return self._compiled["rhs"]
+
+    def generators(self, bgc, isos):
+        """
+        First-order transfers between the pools of this network as matrices.
+
+        Inputs:
+        bgc = BioGeoChemistry or BioGeoChemistryEnsemble object
+        isos = IsotopeEffects object
+
+        Outputs:
+        L14, L15 = numpy arrays with dimensions (N, len(self.pools),
+        len(self.pools)) such that d/dt pools = L @ pools for 14N and 15N,
+        with the pools in the order of self.pools
+        """
+
+        rates = [
+            getattr(bgc, t.rate) if isinstance(t.rate, str) else t.rate
+            for t in self.transfers
+        ]
+        rates = np.broadcast_arrays(*np.atleast_1d(*rates))
+        N, P = len(rates[0]), len(self.pools)
+
+        L14, L15 = np.zeros((N, P, P)), np.zeros((N, P, P))
+        for t, k in zip(self.transfers, rates):
+            source, sink = self.pools.index(t.source), self.pools.index(t.sink)
+            for L, r in ((L14, k), (L15, k / getattr(isos, t.alpha))):
+                L[:, sink, source] += r
+                L[:, source, source] -= r
+
+        return L14, L15
+
+
+def _exec(name, kind, source):
+    # run generated numpy source and return its function, e.g. modelv5_rhs
+    namespace = {"np": np, "binomial": binomial, "stoich": binomial_stoichiometry}
+    exec(compile(source, f"<{name} network>", "exec"), namespace)
+    return namespace[f"{name}_{kind}"]
+
+
+def _cache_dir():
+    # generated kernels live outside the package, so that read-only installs
+    # work and the source tree is left alone: in NUMBA_CACHE_DIR if set,
+    # otherwise in the temporary directory of the user
+    root = os.environ.get("NUMBA_CACHE_DIR") or tempfile.gettempdir()
+    return os.path.join(root, "isotopomer-soup-networks")
+
+
+def _load(name, source, namespace):
+    # numba can only cache functions that live in a file, so the generated
+    # source is written to a cache directory, named by a hash of the source,
+    # and imported from there; if that directory is not writable, fall back
+    # to an uncached exec
+    digest = hashlib.sha1(source.encode()).hexdigest()[:16]
+    module_name = f"{name}_network_{digest}"
+    folder = _cache_dir()
+    path = os.path.join(folder, f"{module_name}.py")
+
+    try:
+        os.makedirs(folder, exist_ok=True)
+        if not os.path.exists(path):
+            # write atomically, as parallel workers may compile at the same time
+            fd, tmp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(fd, "w") as file:
+                file.write(source)
+            os.replace(tmp, path)
+    except OSError:
+        exec(compile(source, f"<{name} network>", "exec"), namespace)
+        return namespace[f"{name}_kernel"], False
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    module.__dict__.update(namespace)
+    # numba's cache looks the module up by name; the name includes the hash
+    # of the source, so it cannot clash with another module or kernel
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return getattr(module, f"{name}_kernel"), True
+
+
+def columns(value, N):
+    """
+    Broadcast a scalar or (N,) array to a contiguous float array of length N.
+    """
+
+    return np.ascontiguousarray(
+        np.broadcast_to(np.asarray(value, dtype="float64"), (N,))
+    )
+
+
+def run_network(network, x, bgc, isos, tracers, modelparams, jit=False):
+    """
+    Run the compiled time loop of a reaction network in place on a Tracers object.
+
+    Inputs:
+    network = Network object, e.g. NETWORKS["modelv5"] or a custom network
+    x = model parameters, as for the model version; each may be a scalar or
+    an array with dimensions (N,)
+    bgc, isos, tracers, modelparams = same as for the model versions
+    jit = if True, run the numba-compiled loop
+
+    Outputs:
+    tracers = the Tracers object, with all T timepoints filled in
+    """
+
+    (dt, T, times) = modelparams
+    N = tracers.n2o_44.shape[1]
+
+    if jit:
+        X = np.array([columns(xi, N) for xi in x])
+        K = np.array([columns(getattr(bgc, k), N) for k in RATES])
+        A = np.array([getattr(isos, a) for a in ALPHAS], dtype="float64")
+    else:
+        # the numpy loop broadcasts scalars itself, and is called once per
+        # time step by observe(), so skip the conversions
+        X = list(x)
+        K = [getattr(bgc, k) for k in RATES]
+        A = [getattr(isos, a) for a in ALPHAS]
+    S = tuple(getattr(tracers, s) for s in network.species)
+
+    network.compile(jit)(float(dt), int(T), X, K, A, S)
+
+    return tracers
+
+
+### MODEL VERSIONS ###
+
+# no intermediates: NH4+ -> NO2- <-> NO3-
+NO_INTERMEDIATES = [
+    Transfer("nh4", "no2", "kNH4TONO2", "alpha15NH4TONO2AOA"),
+    Transfer("no3", "no2", "kNO3TONO2", "alpha15NO3TONO2"),
+    Transfer("no2", "no3", "kNO2TONO3", "alpha15NO2TONO3"),
+]
+
+# intermediates NH2OH and NO: NH4+ -> NH2OH -> NO -> NO2- <-> NO3-, NO2- -> NO;
+# kAOA = kAOB = kNH4TONO2, and kNO2TONO is hard-coded in the model versions
+INTERMEDIATES = [
+    Transfer("nh4", "no2", "kNH4TONO2", "alpha15NH4TONO2AOB"),
+    Transfer("nh4", "nh2oh", "kNH4TONO2", "alpha15NH4TONO2AOA"),
+    Transfer("nh2oh", "no", "kNH4TONO2", "alpha15NH4TONO2AOA"),
+    Transfer("no", "no2", "kNH4TONO2", "alpha15NH4TONO2AOA"),
+    Transfer("no3", "no2", "kNO3TONO2", "alpha15NO3TONO2"),
+    Transfer("no2", "no3", "kNO2TONO3", "alpha15NO2TONO3"),
+    Transfer("no2", "no", 0.017, "alpha15NO2TONO"),
+]
+
+NETWORKS = {
+    "modelv1": Network(
+        "modelv1",
+        ["nh4", "no2", "no3"],
+        NO_INTERMEDIATES,
+        [
+            Pathway("knitrification", 0, ("nh4", "nh4")),
+            Pathway("kdenitno2", 1, ("no2", "no2")),
+            Pathway("kdenitno3", 2, ("no3", "no3")),
+            Pathway("khybrid1", 3, ("no2", "nh4")),
+            Pathway("khybrid2", 4, ("no2", "nh4"), split="pooled", f="random"),
+        ],
+    ),
+    "modelv2": Network(
+        "modelv2",
+        ["nh4", "nh2oh", "no", "no2", "no3"],
+        INTERMEDIATES,
+        [
+            Pathway("knitrification", 0, ("nh4", "nh4")),
+            Pathway("kdenitno2", 1, ("no2", "no2")),
+            Pathway("kdenitno3", 2, ("no3", "no3")),
+            Pathway("khybrid1", 3, ("no", "nh2oh"), "stoichiometry"),
+            Pathway("khybrid2", 4, ("no", "nh2oh"), "stoichiometry", "pooled", 0.5),
+        ],
+    ),
+    "modelv3": Network(
+        "modelv3",
+        ["nh4", "nh2oh", "no", "no2", "no3"],
+        INTERMEDIATES,
+        [
+            Pathway("knitrification", 0, ("nh4", "nh4")),
+            Pathway("kdenitno", 1, ("no", "no")),
+            Pathway("kdenitno3", 2, ("no3", "no3")),
+            Pathway("khybrid1", 3, ("no", "nh2oh"), "stoichiometry"),
+            Pathway("khybrid2", 4, ("no", "nh2oh"), "stoichiometry", "pooled", 0.5),
+        ],
+    ),
+    "modelv4": Network(
+        "modelv4",
+        ["nh4", "nh2oh", "no", "no2", "no3"],
+        INTERMEDIATES,
+        [
+            Pathway("knitrification", 0, ("nh4", "nh4")),
+            Pathway("kdenitno2", 1, ("no2", "no2")),
+            Pathway("kdenitno3", 2, ("no3", "no3")),
+            Pathway("khybrid1", 3, ("no2", "nh2oh")),
+            Pathway("khybrid2", 4, ("no2", "nh2oh"), split="pooled", f="random"),
+        ],
+    ),
+    "modelv5": Network(
+        "modelv5",
+        ["nh4", "no2", "no3"],
+        NO_INTERMEDIATES,
+        [
+            Pathway("knitrification", 0, ("nh4", "nh4")),
+            Pathway("kdenitno2", 1, ("no2", "no2")),
+            Pathway("kdenitno3", 2, ("no3", "no3")),
+            Pathway("khybrid2", 3, ("no2", "nh4"), split="mixed", f=("x", 4)),
+        ],
+    ),
+}
@@ -0,0 +1,165 @@
+"""
+File: observe.py
+----------------
+
+Observation-only forward runs. Instead of storing all T timepoints of every
+state variable, the model is stepped on a two-row rolling state and only the
+requested species are recorded at the requested timepoints (e.g. the
+adjusted_timepoints that costfxn reads). replay() rebuilds the full
+trajectories of a final solution for postprocess and plotting.
+"""
+
+import numpy as np
+
+from ..initialization.tracers import Tracers
+from .jit import use_jit, run_jit_observe
+from .modelv5 import INTEGRATORS
+from .network import NETWORKS
+from .health import nitrogen_atoms, integrate
+
+# isotopocules compared against the incubation data, in costfxn order
+N2O = ("n2o_44", "n2o_45a", "n2o_45b", "n2o_46")
+
+
+def observe(
+    model,
+    x,
+    bgc,
+    isos,
+    tracers,
+    modelparams,
+    indices,
+    species=N2O,
+    backend="numpy",
+    monitor=None,
+):
+    """
+    Run a model version and keep only snapshots at a set of timepoints.
+
+    Inputs:
+    model = modelv1, modelv2, modelv3, modelv4, or modelv5
+    x, bgc, isos, modelparams = same as for the model version
+    tracers = Tracers object holding the initial state in row 0; only its
+    first two rows are used, so it can be allocated with T=2, and only the
+    species the model uses, e.g. species="modelv5". Row 0 is restored on
+    return, so the same object can be reused between calls.
+    indices = integer timepoints (0 <= index < T) at which to record the state
+    species = names of the Tracers arrays to record; default is the four
+    N2O isotopocules in the order costfxn expects
+    backend = "numpy" or "jit", as for the model version, or "ivp" or "expo"
+    for modelv5, which then only evaluate the state at the recorded timepoints
+    monitor = optional HealthMonitor (health.py) that checks the state every
+    monitor.every steps and raises HealthError as soon as a check fails; the
+    "ivp" and "expo" backends are checked at the recorded timepoints only
+
+    Outputs:
+    obs = numpy array with dimensions (len(species), len(indices), N);
+    obs[k, i] is species[k] at timepoint indices[i]
+    """
+
+    (dt, T, times) = modelparams
+
+    indices = np.asarray(indices, dtype="int64")
+    if indices.size and (indices.min() < 0 or indices.max() >= T):
+        raise ValueError(f"indices must lie between 0 and {T - 1}")
+
+    # record each distinct timepoint once, then expand to the requested order
+    rows, inverse = np.unique(indices, return_inverse=True)
+    N = tracers.n2o_44.shape[1]
+    obs = np.zeros((len(species), len(rows), N), dtype="float64")
+
+    # no need to step past the last recorded timepoint
+    last = int(rows[-1]) if rows.size else 0
+
+    initial = tracers.block[0].copy()
+
+    try:
+        if backend in INTEGRATORS:
+            if model.__name__ != "modelv5":
+                raise ValueError(f"backend {backend!r} is only available for modelv5")
+            states = integrate(
+                INTEGRATORS[backend], monitor, x, bgc, isos, tracers, dt * rows
+            )
+            for s, name in enumerate(species):
+                obs[s] = states[name]
+
+        elif use_jit(backend):
+            run_jit_observe(
+                model.__name__,
+                x,
+                bgc,
+                isos,
+                tracers,
+                (dt, last + 1, times),
+                rows,
+                species,
+                obs,
+                monitor=monitor,
+            )
+
+        else:
+            step = (dt, 2, times)  # one time step from row 0 into row 1
+            k = 0
+
+            if monitor is not None:
+                # only the state variables of this model version carry nitrogen
+                used = NETWORKS[model.__name__].species
+                atoms = nitrogen_atoms(tracers.species)
+                atoms *= [name in used for name in tracers.species]
+                total0 = atoms @ tracers.block[0]
+
+            ### TIME STEPPING ###
+            for iT in range(last + 1):
+
+                if (
+                    monitor is not None
+                    and iT > 0
+                    and (iT % monitor.every == 0 or iT == last)
+                ):
+                    reason = monitor.inspect(tracers.block[0], atoms, total0)
+                    if reason is not None:
+                        monitor.record(reason, iT, last)
+
+                if k < len(rows) and rows[k] == iT:
+                    for s, name in enumerate(species):
+                        obs[s, k] = getattr(tracers, name)[0]
+                    k += 1
+
+                if iT == last:
+                    break
+
+                model(x, bgc, isos, tracers, step)
+
+                # roll the state: the new timepoint becomes the current one; all
+                # state variables share tracers.block, so this is a single copy
+                tracers.block[0] = tracers.block[1]
+
+            if monitor is not None:
+                monitor.record()
+
+    finally:
+        tracers.block[0] = initial
+
+    return obs[:, inverse]
+
+
+def replay(model, x, bgc, isos, trainingdata, modelparams, N=1, backend="numpy"):
+    """
+    Rebuild full trajectories of a solution, e.g. the best fit from an
+    observation-only optimization, for postprocess and plotting.
+
+    Inputs:
+    model = modelv1, modelv2, modelv3, modelv4, or modelv5
+    x, bgc, isos, modelparams = same as for the model version
+    trainingdata, N = same as for Tracers
+    backend = "numpy" or "jit", as for the model version
+
+    Outputs:
+    tracers = Tracers object with all T timepoints filled in
+    """
+
+    (dt, T, times) = modelparams
+
+    tracers = Tracers(T, bgc, trainingdata, N=N)
+
+    return model(x, bgc, isos, tracers, modelparams, backend=backend)
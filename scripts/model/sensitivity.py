@@ -0,0 +1,179 @@
+"""
+File: sensitivity.py
+--------------------
+
+Tangent-linear (forward sensitivity) runs of modelv5. Alongside the state,
+each time step carries the derivative of every state variable with respect
+to the five entries of x, so that one run returns the N2O isotopocules at
+the data timepoints together with their exact derivatives under the
+forward-Euler scheme. costfxn residuals and their Jacobian follow directly
+(see optimization/gradient.py), which lets gradient-based optimizers replace
+finite differences.
+"""
+
+import numpy as np
+
+from .network import ALPHAS, RATES, NETWORKS, columns
+from .observe import N2O
+
+# parameters that sensitivities are taken with respect to, in the order of x
+PARAMETERS = ("knitrification", "kdenitno2", "kdenitno3", "khybrid2", "f")
+
+
+class Dual:
+    """
+    Forward-mode dual numbers for a batch of model solutions.
+
+    Inputs:
+    data = numpy array with dimensions (1 + P, N): row 0 holds the values of
+    N model solutions and rows 1..P their derivatives with respect to P
+    parameters
+
+    Arithmetic with numbers or numpy arrays that broadcast against (N,)
+    treats those as constants, so the generated modelv5 right-hand side (and
+    binomial) can be evaluated on Dual objects unchanged.
+    """
+
+    __slots__ = ("data",)
+
+    # make numpy arrays defer to the reflected operators below instead of
+    # broadcasting over Dual objects
+    __array_ufunc__ = None
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def constant(cls, value, P, N):
+        data = np.zeros((1 + P, N))
+        data[0] = value
+        return cls(data)
+
+    @property
+    def value(self):
+        return self.data[0]
+
+    @property
+    def tangent(self):
+        return self.data[1:]
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.data + other.data)
+        data = self.data.copy()
+        data[0] += other
+        return Dual(data)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Dual(-self.data)
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            # (a b)' = a b' + a' b
+            data = self.data[0] * other.data
+            data[1:] += self.data[1:] * other.data[0]
+            return Dual(data)
+        return Dual(self.data * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            # (a / b)' = a' / b - (a / b) b' / b
+            data = self.data / other.data[0]
+            data[1:] -= data[0] * other.data[1:] / other.data[0]
+            return Dual(data)
+        return Dual(self.data / other)
+
+    def __pow__(self, n):
+        # integer powers only, which is all the rate laws need
+        data = self.data * (n * self.data[0] ** (n - 1))
+        data[0] = self.data[0] ** n
+        return Dual(data)
+
+
+def modelv5_sensitivity(x, bgc, isos, tracers, modelparams, indices):
+    """
+    Run modelv5 with forward sensitivities and keep the N2O isotopocules and
+    their derivatives with respect to x at a set of timepoints.
+
+    The state and its tangents are stepped with the same forward-Euler
+    equations as modelv5, generated from its reaction network (see
+    network.py), so the derivatives are exact for the discretized model (no
+    finite-difference step to tune).
+
+    Inputs:
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]; each entry may
+    also be an array with one value per column, as for modelv5
+    bgc, isos, modelparams = same as for modelv5
+    tracers = Tracers object holding the initial state in row 0; it is only
+    read, so it can be allocated with T=2
+    indices = integer timepoints (0 <= index < T) at which to record N2O
+
+    Outputs:
+    obs = numpy array with dimensions (4, len(indices), N), with the N2O
+    isotopocules in costfxn order, as returned by observe()
+    sens = numpy array with dimensions (5, 4, len(indices), N); sens[p] is
+    the derivative of obs with respect to x[p]
+    """
+
+    (dt, T, times) = modelparams
+
+    indices = np.asarray(indices, dtype="int64")
+    if indices.size and (indices.min() < 0 or indices.max() >= T):
+        raise ValueError(f"indices must lie between 0 and {T - 1}")
+
+    N = tracers.n2o_44.shape[1]
+    P = len(PARAMETERS)
+
+    ### SEED THE PARAMETERS ###
+    # each entry of x is a dual number with a unit derivative with respect
+    # to itself
+    params = []
+    for p, value in enumerate(x):
+        param = Dual.constant(value, P, N)
+        param.data[1 + p] = 1.0
+        params.append(param)
+
+    ### INITIAL STATE ###
+    # the initial values do not depend on x
+    network = NETWORKS["modelv5"]
+    state = {
+        name: Dual.constant(getattr(tracers, name)[0], P, N) for name in network.state
+    }
+
+    # right-hand side of modelv5 generated from its reaction network, which
+    # evaluates unchanged on Dual objects
+    rhs = network.derivatives()
+    K = [columns(getattr(bgc, k), N) for k in RATES]
+    A = [getattr(isos, a) for a in ALPHAS]
+
+    obs = np.zeros((len(N2O), len(indices), N))
+    sens = np.zeros((P, len(N2O), len(indices), N))
+
+    # no need to step past the last recorded timepoint
+    last = int(indices.max()) if indices.size else 0
+
+    ### TIME STEPPING ###
+    for iT in range(last + 1):
+
+        for i in np.flatnonzero(indices == iT):
+            for s, name in enumerate(N2O):
+                obs[s, i] = state[name].value
+                sens[:, s, i] = state[name].tangent
+
+        if iT == last:
+            break
+
+        derivatives = rhs(params, K, A, state)
+        state = {name: state[name] + dt * derivatives[name] for name in state}
+
+    return obs, sens
@@ -0,0 +1,303 @@
+"""
+File: substrates.py
+-------------------
+
+Substrate-trajectory cache for modelv5. The N2O production fluxes (nM/day)
+barely draw down the µM NH4+, NO2- and NO3- pools of the tracer experiments,
+so the substrate and atom fraction trajectories can be integrated once per
+set of BioGeoChemistry parameters, without the N2O pathways, and reused by
+every objective evaluation. N2O is then driven from the cached trajectories,
+which leaves one linear recurrence per isotopocule. If the pathways would
+draw down any pool by more than a set fraction, the fully coupled model is
+run instead.
+"""
+
+import numpy as np
+from scipy.signal import lfilter
+
+from .. import modelv5
+from .expo import substrate_generators
+from .network import ALPHAS, RATES, NETWORKS
+from .observe import observe, N2O
+
+# substrate state variables, in the order of the rows of substrate_generators
+SUBSTRATES = ("nh4_14", "no2_14", "no3_14", "nh4_15", "no2_15", "no3_15")
+
+
+def _fractions(pathway):
+    # values of f with a response of their own: f = 1 and f = 0 for a pathway
+    # whose 45N2O split depends on an entry of x, to which N2O is linear
+    return (1.0, 0.0) if isinstance(pathway.f, tuple) else (None,)
+
+
+# linear responses of N2O to the rate constants of the modelv5 pathways (see
+# SubstrateCache.responses); the hybrid pathway has one response for f = 1
+# and one for f = 0
+BASIS = tuple(
+    p.name if f is None else f"{p.name} f={f:g}"
+    for p in NETWORKS["modelv5"].pathways
+    for f in _fractions(p)
+)
+
+
+class SubstrateCache:
+    """
+    Cached substrate trajectories and N2O observations driven from them.
+
+    Inputs:
+    tol = largest fraction of any substrate pool that the N2O pathways may
+    consume before observe() falls back to the fully coupled model
+    maxsize = number of substrate trajectories to keep, e.g. one per
+    Monte Carlo iteration
+
+    Counters:
+    builds = substrate trajectories integrated
+    hits = evaluations served from a cached trajectory
+    fallbacks = evaluations that ran the fully coupled model instead
+    """
+
+    def __init__(self, tol=1e-3, maxsize=16):
+        self.tol = tol
+        self.maxsize = maxsize
+        self._entries = {}
+
+        ### COUNTERS ###
+        self.builds = 0
+        self.hits = 0
+        self.fallbacks = 0
+
+    def _entry(self, bgc, isos, tracers, modelparams):
+        # cache entry for one set of initial values, rate constants, isotope
+        # effects and model params
+        (dt, T, times) = modelparams
+        N = tracers.n2o_44.shape[1]
+
+        y0 = np.array([getattr(tracers, name)[0] for name in SUBSTRATES + N2O])
+        rates = [
+            np.broadcast_to(np.asarray(getattr(bgc, k), dtype="float64"), (N,))
+            for k in RATES
+        ]
+        alphas = [getattr(isos, a) for a in ALPHAS]
+        key = np.concatenate([y0.ravel(), *rates, alphas, [dt, T]]).tobytes()
+
+        if key not in self._entries:
+            if len(self._entries) >= self.maxsize:
+                # forget the oldest entry
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = {"responses": {}}
+
+        return self._entries[key]
+
+    def trajectories(self, bgc, isos, tracers, modelparams):
+        """
+        Substrate trajectories without N2O production, integrated once for
+        each distinct set of initial values, rate constants and isotope effects.
+
+        Inputs:
+        bgc = BioGeoChemistry or BioGeoChemistryEnsemble object
+        isos = IsotopeEffects object
+        tracers = Tracers object holding the initial state in row 0
+        modelparams = model params from modelparams.py
+
+        Outputs:
+        y = dictionary of numpy arrays with dimensions (T, N) for each name in
+        SUBSTRATES and for the atom fractions afnh4, afno2 and afno3
+        """
+
+        entry = self._entry(bgc, isos, tracers, modelparams)
+        if "y" in entry:
+            return entry["y"]
+
+        (dt, T, times) = modelparams
+        N = tracers.n2o_44.shape[1]
+
+        ### TIME STEPPING ###
+        # forward Euler of the linear exchange terms only, as in modelv5
+        L14, L15 = substrate_generators(bgc, isos)
+        M14 = np.eye(3) + dt * L14
+        M15 = np.eye(3) + dt * L15
+
+        Y = np.zeros((T, 6, N))
+        Y[0] = [getattr(tracers, name)[0] for name in SUBSTRATES]
+        for iT in range(T - 1):
+            Y[iT + 1, :3] = np.einsum("nij,jn->in", M14, Y[iT, :3])
+            Y[iT + 1, 3:] = np.einsum("nij,jn->in", M15, Y[iT, 3:])
+
+        y = dict(zip(SUBSTRATES, Y.transpose(1, 0, 2)))
+        y["afnh4"] = y["nh4_15"] / (y["nh4_14"] + y["nh4_15"])
+        y["afno2"] = y["no2_15"] / (y["no2_14"] + y["no2_15"])
+        y["afno3"] = y["no3_15"] / (y["no3_14"] + y["no3_15"])
+
+        self.builds += 1
+        entry["y"] = y
+
+        return y
+
+    def responses(self, bgc, isos, tracers, modelparams, indices):
+        """
+        Response of the N2O isotopocules at a set of timepoints to each rate
+        constant, with the substrates fixed to their cached trajectories.
+
+        With fixed substrates, N2O is linear in the rate constants:
+        n2o = offset + sum over BASIS of rate * basis, where the khybrid2 rate
+        multiplies f * basis[3] + (1 - f) * basis[4].
+
+        Inputs:
+        bgc, isos, tracers, modelparams = same as for trajectories()
+        indices = integer timepoints at which to evaluate N2O
+
+        Outputs:
+        offset = numpy array with dimensions (4, len(indices), N): N2O without
+        any production, in costfxn order
+        basis = numpy array with dimensions (5, 4, len(indices), N): N2O
+        produced by a unit rate constant of each pathway in BASIS
+        drawdown = numpy array with dimensions (4, 3, last index, N): nitrogen
+        removed from the NH4+, NO2- and NO3- pools by a unit knitrification,
+        kdenitno2, kdenitno3 and khybrid2, relative to the cached pools
+        """
+
+        (dt, T, times) = modelparams
+
+        indices = np.asarray(indices, dtype="int64")
+        entry = self._entry(bgc, isos, tracers, modelparams)
+        if indices.tobytes() in entry["responses"]:
+            return entry["responses"][indices.tobytes()]
+
+        y = self.trajectories(bgc, isos, tracers, modelparams)
+
+        last = int(indices.max()) if indices.size else 0
+        N = tracers.n2o_44.shape[1]
+
+        network = NETWORKS["modelv5"]
+        pools = np.array(
+            [y[f"{pool}_14"][:last] + y[f"{pool}_15"][:last] for pool in network.pools]
+        )
+        af = {pool: y[f"af{pool}"][:last] for pool in network.pools}
+
+        # fluxes of a unit rate constant, in nmol N/L/day
+        fluxes = [
+            pools[network.pools.index(p.pools[0])]
+            * pools[network.pools.index(p.pools[1])]
+            for p in network.pathways
+        ]
+
+        ### ERROR BOUND ###
+        # nitrogen that each pathway removes from each pool by each timepoint
+        zero = np.zeros_like(pools[0])
+        drawdown = (
+            dt
+            * np.cumsum(
+                [
+                    [J if pool in p.substrates else zero for pool in network.pools]
+                    for p, J in zip(network.pathways, fluxes)
+                ],
+                axis=2,
+            )
+            / pools
+        )
+
+        ### N2O PRODUCTION ###
+        # probabilities in binomial order (46, 45a, 45b, 44), reordered to N2O
+        order = [3, 1, 2, 0]
+        production = np.array(
+            [
+                J
+                * np.array(p.isotopocules(af, {} if f is None else {p.f[1]: f}))[order]
+                for p, J in zip(network.pathways, fluxes)
+                for f in _fractions(p)
+            ]
+        )  # dimensions (5, 4, last, N)
+
+        kN2OCONS = np.broadcast_to(np.asarray(bgc.kN2OCONS, dtype="float64"), (N,))
+        kcons = [
+            kN2OCONS,
+            kN2OCONS / isos.alpha15N2OatoN2,
+            kN2OCONS / isos.alpha15N2ObtoN2,
+            kN2OCONS / isos.alpha46N2OtoN2,
+        ]
+
+        ### N2O CONSUMPTION ###
+        # n2o[iT + 1] = (1 - dt * kcons) * n2o[iT] + dt * production[iT] / 2,
+        # evaluated for each column as a first-order recursive filter
+        offset = np.zeros((len(N2O), len(indices), N))
+        basis = np.zeros((len(BASIS), len(N2O), len(indices), N))
+        steps = np.arange(last + 1)[indices]
+        for s, name in enumerate(N2O):
+            decay = 1 - dt * kcons[s]
+            offset[s] = decay ** steps[:, None] * getattr(tracers, name)[0]
+            for j in range(N):
+                u = np.zeros((last + 1, len(BASIS)))
+                u[1:] = dt * production[:, s, :, j].T / 2
+                n2o = lfilter([1.0], [1.0, -decay[j]], u, axis=0)
+                basis[:, s, :, j] = n2o[indices].T
+
+        entry["responses"][indices.tobytes()] = (offset, basis, drawdown)
+
+        return offset, basis, drawdown
+
+    def observe(
+        self,
+        x,
+        bgc,
+        isos,
+        tracers,
+        modelparams,
+        indices,
+        backend="numpy",
+        monitor=None,
+    ):
+        """
+        Counterpart of observe(modelv5, ...) for the N2O isotopocules.
+
+        Inputs:
+        x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+        bgc, isos, tracers, modelparams, indices = same as for observe()
+        backend, monitor = passed on to observe() if the fully coupled model
+        has to be run
+
+        Outputs:
+        obs = numpy array with dimensions (4, len(indices), N), with the N2O
+        isotopocules in costfxn order
+        """
+
+        offset, basis, drawdown = self.responses(
+            bgc, isos, tracers, modelparams, indices
+        )
+
+        ### ERROR BOUND ###
+        pathways = NETWORKS["modelv5"].pathways
+        rates = np.array([x[p.k] for p in pathways])
+        if not np.all(np.tensordot(rates, drawdown, axes=1) <= self.tol):
+            self.fallbacks += 1
+            return observe(
+                modelv5,
+                x,
+                bgc,
+                isos,
+                tracers,
+                modelparams,
+                indices,
+                backend=backend,
+                monitor=monitor,
+            )
+
+        self.hits += 1
+        coefficients = np.array(
+            [
+                x[p.k] if f is None else x[p.k] * (x[p.f[1]] if f else 1 - x[p.f[1]])
+                for p in pathways
+                for f in _fractions(p)
+            ]
+        )
+        obs = offset + np.tensordot(coefficients, basis, axes=1)
+
+        if monitor is not None:
+            monitor.record()
+
+        return obs
+
+    def __repr__(self):
+        return (
+            f"{self.builds} substrate trajectories, {self.hits} cached and "
+            f"{self.fallbacks} fully coupled evaluations"
+        )
@@ -10,14 +10,23 @@ number of parameters.
 import numpy as np
 from numpy.random import rand
 
+from .streams import iteration_rng
 
-def genmontecarlo(bgc, iters):
+
+def genmontecarlo(bgc, iters, seed=None, key="", iterations=None):
     """
     Generate Numpy array of randomly sampled model params.
 
     Inputs:
     bgc = "BioGeoChemistry" object from bgc.py
     iters = desired number of rows in output array
+    seed = optional integer seed (see streams.py); if given, row i is drawn
+    from its own stream of seed, key and iteration i, so it does not depend
+    on which rows are generated together. Without a seed, the global numpy
+    random state is used.
+    key = name of the stream, e.g. station + feature + tracer
+    iterations = optional iteration numbers of the rows (with seed only),
+    which then replace iters; default is range(iters)
 
     Outputs:
     nxm Numpy array of model parameters randomly sampled from a range of values
@@ -45,13 +54,23 @@ def genmontecarlo(bgc, iters):
     mins = means * 0.75  # create 1xm Numpy array of minimum values
     maxs = means * 1.25  # create 1xm Numpy array of maximum values
 
+    if seed is not None and iterations is None:
+        iterations = range(iters)
+    if iterations is not None:
+        iters = len(iterations)
+
     # create nxm array of ones to multiply by means
     arr = np.ones((iters, len(means)))
     # create nxm array of mean model params to add variability on top of
     arr = arr * means
 
     # create nxm array of random values sampled between 0 and 1
-    randvals = rand(iters, len(means))
+    if seed is None:
+        randvals = rand(iters, len(means))
+    else:
+        randvals = np.array(
+            [iteration_rng(seed, key, i).random(len(means)) for i in iterations]
+        ).reshape(-1, len(means))
 
     # create nxm array of mean values + variability
     output = arr + randvals * (maxs - mins)
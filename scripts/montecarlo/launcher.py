@@ -0,0 +1,350 @@
+"""
+File: launcher.py
+--------------------
+
+Fan out the Monte Carlo simulations of all station/feature keys as one SLURM
+job array. The keys, their tracer weights and iterations are read from one
+table (Data/00_montecarlokeys.csv); the iterations of each key are split
+into chunks, one per array task, which all draw from the streams of one seed
+(see streams.py). The seed is recorded with the shards of each key when the
+array is written, and the tasks refuse to add rows to shards of another
+seed. A merge step combines the shards of each key into its CSV once the
+array has finished. Instead of fixed chunks, the array tasks can also be
+workers that pull iterations from a shared work queue (see workqueue.py),
+which balances iterations of very different cost.
+
+Usage (from the repository root):
+python3 montecarlo_array.py write --chunk 10   # writes montecarlo_array.sh
+                                                # (--fresh discards earlier runs)
+sbatch montecarlo_array.sh                      # one task per chunk
+python3 montecarlo_array.py merge               # after the array has finished
+
+or, with a work queue and 20 worker tasks:
+python3 montecarlo_array.py write --queue scripts/Data/00_montecarloqueue.sqlite --workers 20
+python3 montecarlo_array.py merge --queue scripts/Data/00_montecarloqueue.sqlite   # also lists failed tasks
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from .runmontecarlo import runmontecarlo
+from .sink import ResultSink
+from .streams import root_seed
+from .workqueue import WorkQueue
+from ..runscripts.datapath import datapath
+
+# environment modules of the cluster, as in the PS*.sh scripts
+MODULES = (
+    "ml reset",
+    "module load python/3.9.0",
+    "module load py-numpy/1.20.3_py39",
+    "module load py-pandas/1.3.1_py39",
+    "module load viz py-matplotlib/3.4.2_py39",
+)
+
+
+def read_keys(filename=None):
+    """
+    Read the table of station/feature keys.
+
+    Inputs:
+    filename = CSV with columns Station, Feature, weightNH4, weightNO2,
+    weightNO3 and iters; default is Data/00_montecarlokeys.csv
+
+    Outputs:
+    keys = Pandas DataFrame with one row per key
+    """
+
+    if filename is None:
+        filename = f"{datapath()}00_montecarlokeys.csv"
+
+    return pd.read_csv(filename)
+
+
+def tasks(keys, chunk):
+    """
+    Split the iterations of every key into chunks.
+
+    Inputs:
+    keys = Pandas DataFrame from read_keys()
+    chunk = number of iterations per task
+
+    Outputs:
+    tasks = list of (station, feature, iters, weights, iterations) tuples,
+    one per array task, in a fixed order
+    """
+
+    out = []
+    for key in keys.itertuples(index=False):
+        weights = np.array([key.weightNH4, key.weightNO2, key.weightNO3])
+        for start in range(0, int(key.iters), chunk):
+            iterations = list(range(start, min(start + chunk, int(key.iters))))
+            out.append((key.Station, key.Feature, int(key.iters), weights, iterations))
+
+    return out
+
+
+def write_array_job(
+    filename="montecarlo_array.sh",
+    keys=None,
+    chunk=10,
+    seed=None,
+    cores=4,
+    mem="2G",
+    walltime="1:00:00",
+    table=None,
+    method="nelder-mead",
+    queue=None,
+    workers=20,
+    lease=600,
+    fresh=False,
+):
+    """
+    Write a SLURM script that runs every chunk of every key as one array task,
+    and record the seed with the shards of every key.
+
+    Inputs:
+    filename = path of the SLURM script
+    keys = Pandas DataFrame from read_keys(); default is read_keys(table)
+    chunk = number of iterations per task
+    seed = integer seed of the whole run (see streams.py); default is fresh
+    entropy, which is written into the script
+    cores, mem, walltime = resources of each task
+    table = table of keys passed on to the tasks; default is
+    Data/00_montecarlokeys.csv
+    method = fitting method of runmontecarlo
+    queue = optional path of a WorkQueue database; the array tasks are then
+    workers that pull iterations of any key from it (see work())
+    workers = number of array tasks with a queue
+    lease = seconds that a worker reserves a task of the queue for; the
+    workers renew it while the task runs, so it only needs to be well below
+    the walltime for the tasks of killed workers to be handed out again
+    fresh = if True, delete the shards of every key (and its tasks in the
+    queue) first; otherwise the shards of an earlier array are continued,
+    which raises ValueError if they were drawn from another seed (see
+    ResultSink.check_seed)
+
+    Outputs:
+    ntasks = number of array tasks
+    """
+
+    if keys is None:
+        keys = read_keys(table)
+    seed = root_seed(seed)
+
+    ### SHARDS ###
+    for key in keys.itertuples(index=False):
+        sink = ResultSink(f"{datapath()}/{key.Station}{key.Feature}.csv")
+        if fresh:
+            sink.clear()
+            if queue is not None:
+                WorkQueue(queue).clear(key.Station + key.Feature)
+        sink.check_seed(seed)
+
+    if queue is None:
+        ntasks = len(tasks(keys, chunk))
+        command = (
+            f"python3 montecarlo_array.py run $SLURM_ARRAY_TASK_ID"
+            f" --chunk {chunk} --seed {seed} --method {method}"
+        )
+    else:
+        ntasks = workers
+        command = (
+            f'python3 montecarlo_array.py work --queue "{queue}"'
+            f" --seed {seed} --method {method} --lease {lease}"
+        )
+    if table is not None:
+        command += f' --table "{table}"'
+
+    lines = [
+        "#!/bin/bash",
+        "#",
+        "#SBATCH --job-name=montecarlo_array",
+        "#SBATCH --error=sherlock_output/montecarlo_array-%A_%a.err",
+        "#SBATCH --out=sherlock_output/montecarlo_array-%A_%a.out",
+        f"#SBATCH --array=0-{ntasks - 1}",
+        f"#SBATCH -N 1 -n 1 -c {cores}",
+        f"#SBATCH --mem={mem}",
+        f"#SBATCH --time={walltime}",
+        "#",
+        "",
+        *MODULES,
+        "",
+        command,
+        "",
+    ]
+    with open(filename, "w") as file:
+        file.write("\n".join(lines))
+
+    return ntasks
+
+
+def run_task(task, chunk=10, seed=None, table=None, n_jobs=None, **kwargs):
+    """
+    Run one array task: one chunk of the iterations of one key.
+
+    Inputs:
+    task = index of the task, e.g. $SLURM_ARRAY_TASK_ID
+    chunk, table = same as for write_array_job()
+    seed = integer seed of the whole run
+    n_jobs = joblib workers; default is $SLURM_CPUS_PER_TASK, or 1
+    kwargs = passed on to runmontecarlo, e.g. method or coarse
+
+    Outputs:
+    output = Pandas DataFrame from runmontecarlo
+    """
+
+    station, feature, iters, weights, iterations = tasks(read_keys(table), chunk)[task]
+    if n_jobs is None:
+        n_jobs = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+
+    return runmontecarlo(
+        station,
+        feature,
+        iters,
+        weights=weights,
+        seed=seed,
+        iterations=iterations,
+        n_jobs=n_jobs,
+        **kwargs,
+    )
+
+
+def work(queue, seed, table=None, n_jobs=None, lease=600, **kwargs):
+    """
+    Run a worker of a work queue: pull iterations of every key in the table,
+    one key after the other, until none is left.
+
+    Inputs:
+    queue = WorkQueue, or the path of its database
+    seed = integer seed of the whole run
+    table = same as for write_array_job()
+    n_jobs = joblib workers; default is $SLURM_CPUS_PER_TASK, or 1
+    lease = same as for write_array_job(), if queue is a path
+    kwargs = passed on to runmontecarlo, e.g. method or coarse
+    """
+
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue, lease=lease)
+    if n_jobs is None:
+        n_jobs = int(os.environ.get("SLURM_CPUS_PER_TASK", 1))
+
+    for key in read_keys(table).itertuples(index=False):
+        runmontecarlo(
+            key.Station,
+            key.Feature,
+            int(key.iters),
+            weights=np.array([key.weightNH4, key.weightNO2, key.weightNO3]),
+            seed=seed,
+            n_jobs=n_jobs,
+            queue=queue,
+            **kwargs,
+        )
+
+
+def merge(keys=None, table=None, queue=None):
+    """
+    Merge the shards of every key into its CSV, once all tasks have finished.
+
+    Inputs:
+    keys = Pandas DataFrame from read_keys(); default is read_keys(table)
+    queue = optional WorkQueue, or the path of its database, whose failed
+    tasks are reported for each key
+
+    Outputs:
+    missing = dictionary of the iterations without a row, by key; rerun the
+    tasks of these keys (they skip the iterations that are done) and merge
+    again. Keys without shards and without a recorded seed were not part of
+    the array; they are skipped and their CSV is left as it is.
+    """
+
+    if keys is None:
+        keys = read_keys(table)
+    if queue is not None and not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue)
+
+    missing = {}
+    for key in keys.itertuples(index=False):
+        stn, ft = key.Station, key.Feature
+        sink = ResultSink(f"{datapath()}/{stn}{ft}.csv")
+        rows = sink.merge()
+        if rows.empty and sink.load_seed() is None:
+            print(f"{stn} {ft}: no shards, skipped")
+            continue
+        left = sorted(set(range(int(key.iters))) - set(rows["iteration"]))
+        if left:
+            missing[stn + ft] = left
+        print(f"{stn} {ft}: {len(rows)} of {key.iters} iterations")
+        if queue is not None:
+            failed = [i for _, i in queue.failed(stn + ft)]
+            if failed:
+                print(f"{stn} {ft}: failed in the queue {failed}")
+
+    return missing
+
+
+def main(argv=None):
+    """
+    Command line interface; see the module docstring.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("command", choices=("write", "run", "work", "merge"))
+    parser.add_argument("task", nargs="?", type=int, help="array task (run)")
+    parser.add_argument("--chunk", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--table", default=None)
+    parser.add_argument("--cores", type=int, default=4)
+    parser.add_argument("--mem", default="2G")
+    parser.add_argument("--time", default="1:00:00")
+    parser.add_argument("--method", default="nelder-mead")
+    parser.add_argument("--queue", default=None, help="work queue database")
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--lease", type=int, default=600, help="seconds")
+    parser.add_argument(
+        "--fresh", action="store_true", help="discard earlier runs (write)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "write":
+        ntasks = write_array_job(
+            chunk=args.chunk,
+            seed=args.seed,
+            cores=args.cores,
+            mem=args.mem,
+            walltime=args.time,
+            table=args.table,
+            method=args.method,
+            queue=args.queue,
+            workers=args.workers,
+            lease=args.lease,
+            fresh=args.fresh,
+        )
+        print(f"montecarlo_array.sh: {ntasks} array tasks")
+    elif args.command == "run":
+        if args.task is None or args.seed is None:
+            parser.error("run needs a task and the --seed of the array")
+        run_task(
+            args.task,
+            chunk=args.chunk,
+            seed=args.seed,
+            table=args.table,
+            method=args.method,
+        )
+    elif args.command == "work":
+        if args.queue is None or args.seed is None:
+            parser.error("work needs the --queue and --seed of the array")
+        work(
+            args.queue,
+            args.seed,
+            table=args.table,
+            lease=args.lease,
+            method=args.method,
+        )
+    else:
+        missing = merge(table=args.table, queue=args.queue)
+        for key, left in missing.items():
+            print(f"{key}: missing iterations {left}")
@@ -6,18 +6,37 @@ Run Monte Carlo simulation, running the model n times
 and varying key model parameters randomly by up to 25%
 for each iteration.
 """
+
 import pandas as pd
 import numpy as np
 import time  # for calculating execution time
+from functools import partial
 from scipy.optimize import minimize
 from joblib import Parallel, delayed  # parallel processing for multiple simulations
 
 from .genmontecarlo import genmontecarlo
+from .sink import ResultSink
+from .streams import root_seed
 
 from .. import *
 
 
-def runmontecarlo(station, feature, iters, weights=None):
+def runmontecarlo(
+    station,
+    feature,
+    iters,
+    weights=None,
+    monitor=None,
+    substrates=None,
+    method="nelder-mead",
+    reparameterize=False,
+    coarse=None,
+    resume=False,
+    seed=None,
+    iterations=None,
+    n_jobs=20,
+    queue=None,
+):
     """
     Run Monte Carlo simulation to estimate rate error.
 
@@ -25,14 +44,58 @@ def runmontecarlo(station, feature, iters, weights=None):
     station: "PS1", etc.
     feature: "SCM", etc.
     iters: number of model iterations
+    monitor: optional HealthMonitor (see model/health.py) that stops objective
+    evaluations with negative, non-finite or growing nitrogen pools early
+    substrates: optional SubstrateCache (see model/substrates.py) that
+    integrates the substrate pools once per iteration and reuses them in
+    every objective evaluation
+    method: "nelder-mead", "least_squares" to fit the weighted residual
+    vector with scipy.optimize.least_squares (see optimization/residuals.py),
+    or "speculative-nelder-mead" to evaluate the candidate moves of each
+    nelder-mead iteration in one batched model run (see
+    optimization/speculative.py; monitor and substrates must be None)
+    reparameterize: if True, search log rate constants scaled by x0() and
+    logit f instead of x (see optimization/transform.py)
+    coarse: optional integer factor; if given, each iteration is first fitted
+    with dt larger by this factor and then refined at full resolution (see
+    optimization/multifidelity.py)
+    resume: if True, continue an interrupted run of the same station, feature
+    and iters: its sampled parameters are reloaded and only the iterations
+    without a saved row are executed (see sink.py)
+    seed: integer seed of the sampled parameters; each iteration and tracer
+    experiment draws from its own stream of it (see streams.py). Default is
+    fresh entropy, which is printed so that the run can be reproduced.
+    iterations: optional chunk of range(iters) to run, e.g. from one task of
+    a SLURM job array (see launcher.py). Requires the seed of the whole run,
+    which must match the seed recorded with the shards (see sink.py); the
+    shards of other chunks are kept, iterations that already have a row are
+    skipped, and the shards are not merged into the CSV.
+    n_jobs: number of joblib workers
+    queue: optional WorkQueue (see workqueue.py) shared by any number of
+    runs of the same station, feature, iters and seed, e.g. from different
+    jobs: the iterations (or the chunk above) are added to it, and every
+    joblib worker claims iterations from it until none is left. As for a
+    chunk, it requires the seed recorded with the shards, and the shards
+    are not merged into the CSV.
 
     Outputs:
-    output: Pandas DataFrame with one row per iteration (model solution)
+    output: Pandas DataFrame with one row per iteration (model solution); for
+    a chunk or a queue, the rows saved so far by all runs
     """
 
     st = time.time()
     print(f"{station} {feature} monte carlo simulation initiated")
 
+    if (iterations is not None or queue is not None) and seed is None:
+        raise ValueError("a chunk or queue of iterations needs the seed of the run")
+    check_options(
+        method,
+        monitor=monitor,
+        substrates=substrates,
+        reparameterize=reparameterize,
+        coarse=coarse,
+    )
+
     ### KEYWORDS ###
     stn = station
     ft = feature
@@ -45,24 +108,41 @@ def runmontecarlo(station, feature, iters, weights=None):
 
     ### SET UP AN EMPTY CSV FILE TO SAVE SIMULATIONS TO ###
 
-    pd.DataFrame(
-        [],
-        columns={
-            "Key",
-            "Nitrification (nM/day)",
-            "Denit fromNO2- (nM/day)",
-            "Denit from NO3- (nM/day)",
-            "Hybrid2 (nM/day)",
-            "Station",
-            "Feature",
-            "iteration",
-            "cost",
-            "f",
-            "weightNH4",
-            "weightNO2",
-            "weightNO3",
-        },
-    ).set_index("Key").to_csv(f"{datapath()}/{stn}{ft}.csv")
+    # every worker appends its rows to its own shard, and the shards are
+    # merged into the CSV below once all iterations are done (see sink.py)
+    sink = ResultSink(f"{datapath()}/{stn}{ft}.csv")
+    shared = iterations is not None or queue is not None
+    samples = sink.load_samples() if resume and not shared else None
+
+    # chunks and queue workers only add rows to shards of the same seed
+    if shared:
+        sink.check_seed(seed)
+
+    if resume and not shared and samples is None:
+        print(f"no saved samples for {stn} {ft}, starting a new run")
+
+    # chunks and queue workers of one run share its shards, so only a whole
+    # run starts afresh
+    if samples is None and not shared:
+        sink.clear()
+        pd.DataFrame(
+            [],
+            columns={
+                "Key",
+                "Nitrification (nM/day)",
+                "Denit fromNO2- (nM/day)",
+                "Denit from NO3- (nM/day)",
+                "Hybrid2 (nM/day)",
+                "Station",
+                "Feature",
+                "iteration",
+                "cost",
+                "f",
+                "weightNH4",
+                "weightNO2",
+                "weightNO3",
+            },
+        ).set_index("Key").to_csv(f"{datapath()}/{stn}{ft}.csv")
 
     ### INITIALIZE MEAN STATES FOR EACH TRACER EXPERIMENT ###
 
@@ -75,7 +155,7 @@ def runmontecarlo(station, feature, iters, weights=None):
     gridded_dataNO3, bgcNO3, isos, trNO3, params = initialize(
         station=stn, feature=ft, tracer="NO3-"
     )
-    (dt, nT, times) = params
+    dt, nT, times = params
 
     ### INITIAL GUESS FOR OPTIMIZATION ###
     guess = x0(station=stn, feature=ft, key=bgckey)
@@ -97,12 +177,33 @@ def runmontecarlo(station, feature, iters, weights=None):
 
     x = [kestimateNH4, kestimateNO2, kestimateNO3, kestimate_hybrid2, fguess]
 
+    transform = LogTransform(x) if reparameterize else None
+
     ### INITIALIZE MONTE CARLO ARRAYS ###
     # each row in each array contains model parameters that have been varied by up to 25%
     # pre-calculating these values (instead of calculating at each iteration) saves memory
-    montecarloNH4 = genmontecarlo(bgcNH4, iters)
-    montecarloNO2 = genmontecarlo(bgcNO2, iters)
-    montecarloNO3 = genmontecarlo(bgcNO3, iters)
+    # they are saved with the results, so that a resumed run uses the same ones
+    if samples is None:
+        # row i only depends on the seed, key and i, not on how the
+        # iterations are split across workers or jobs
+        seed = root_seed(seed)
+        print(f"{station} {feature} monte carlo seed: {seed}")
+        montecarloNH4 = genmontecarlo(bgcNH4, iters, seed=seed, key=bgckey + "NH4+")
+        montecarloNO2 = genmontecarlo(bgcNO2, iters, seed=seed, key=bgckey + "NO2-")
+        montecarloNO3 = genmontecarlo(bgcNO3, iters, seed=seed, key=bgckey + "NO3-")
+        if not shared:
+            sink.save_samples(NH4=montecarloNH4, NO2=montecarloNO2, NO3=montecarloNO3)
+            sink.save_seed(seed)
+    else:
+        montecarloNH4, montecarloNO2, montecarloNO3 = (
+            samples["NH4"],
+            samples["NO2"],
+            samples["NO3"],
+        )
+        if len(montecarloNH4) != iters:
+            raise ValueError(
+                f"the saved run of {stn} {ft} has {len(montecarloNH4)} iterations, not {iters}"
+            )
 
     ### OPTIMIZATION PARAMETERS ###
     # define bounds: no negative rate constants, f between 0 and 1
@@ -130,10 +231,11 @@ def runmontecarlo(station, feature, iters, weights=None):
         (can be tuned for a better fit)
 
         Outputs:
-        output: save simulation results to "montecarlo.csv"
+        evaluation: cost of the solution; the simulation results are written
+        to the shard of this worker in sink
         """
 
-        (dt, nT, times) = params
+        dt, nT, times = params
 
         # reset model parameters to the values in row "i" of precalculated randomly varied values
         [
@@ -176,59 +278,72 @@ def runmontecarlo(station, feature, iters, weights=None):
         ] = montecarloNO3[i, :]
 
         # re-calculate initial tracer concentrations & atom fractions;
-        # re-initialize tracer arrays
-        trNH4 = Tracers(nT, bgcNH4, gridded_dataNH4)
-        trNO2 = Tracers(nT, bgcNO2, gridded_dataNO2)
-        trNO3 = Tracers(nT, bgcNO3, gridded_dataNO3)
-
-        # input args: "bgc" and "tr" values are specific to this iteration
-        args = (
-            bgcNH4,
-            trNH4,
-            gridded_dataNH4,
-            bgcNO2,
-            trNO2,
-            gridded_dataNO2,
-            bgcNO3,
-            trNO3,
-            gridded_dataNO3,
-            isos,
-            params,
-            weights,
+        # the tracer arrays from initialize() are reused, since the model
+        # overwrites every row after the first
+        trNH4.reset(bgcNH4, gridded_dataNH4)
+        trNO2.reset(bgcNO2, gridded_dataNO2)
+        trNO3.reset(bgcNO3, gridded_dataNO3)
+
+        # stack the three tracer experiments so that each objective evaluation
+        # integrates all of them in a single model run
+        bgcs = BioGeoChemistryEnsemble([bgcNH4, bgcNO2, bgcNO3])
+        gridded_data = [gridded_dataNH4, gridded_dataNO2, gridded_dataNO3]
+        # the objective only reads the N2O isotopocules at the data timepoints,
+        # so its state arrays only need two rows and the modelv5 species
+        # (see model/observe.py)
+        trs = Tracers(2, bgcs, gridded_data, N=3, species="modelv5")
+        objective = partial(
+            fusedobjective, observed=True, monitor=monitor, substrates=substrates
         )
 
+        # input args: "bgcs" and "trs" values are specific to this iteration
+        args = (bgcs, trs, gridded_data, isos, params, weights)
+
         # perform the search with intelligently selected x0
         # increasing option "fatol" from factory setting of 0.0001 to 0.1 reduces the amount of time to solve
-        result = minimize(
-            modelv5objective,
-            x,
-            args=args,
-            method="nelder-mead",
-            bounds=bnds,
-            options={"fatol": 0.01},
-        )  # , options={'maxfev' : 500, 'fatol': 0.1})
+        if coarse is not None:
+            result = multifidelity(
+                x,
+                *args,
+                factor=coarse,
+                method=method,
+                transform=transform,
+                monitor=monitor,
+                substrates=substrates,
+                coarse_options={"fatol": 0.01},
+                options={"fatol": 0.01},
+            )
+        elif method == "least_squares":
+            result = residualfit(
+                x, *args, monitor=monitor, substrates=substrates, transform=transform
+            )
+        elif method == SPECULATIVE:
+            result = fit(
+                x, *args, method=method, transform=transform, options={"fatol": 0.01}
+            )
+        elif transform is not None:
+            result = transform.minimize(
+                objective, x, args=args, method=method, options={"fatol": 0.01}
+            )
+        else:
+            result = minimize(
+                objective,
+                x,
+                args=args,
+                method=method,
+                bounds=bnds,
+                options={"fatol": 0.01},
+            )  # , options={'maxfev' : 500, 'fatol': 0.1})
 
         # evaluate solution
         solution = result["x"]
-        evaluation = modelv5objective(
-            solution,
-            bgcNH4,
-            trNH4,
-            gridded_dataNH4,
-            bgcNO2,
-            trNO2,
-            gridded_dataNO2,
-            bgcNO3,
-            trNO3,
-            gridded_dataNO3,
-            isos,
-            params,
-            weights,
-        )
+        evaluation = objective(solution, *args)
 
         # summarize the result - probably want to take out some of these print statements
         print(f"simulation {i+1}/{iters} complete.")
         print("Status : %s" % result["message"])
+        if monitor is not None:
+            print(f"Health monitor: {monitor}")
         # print("Total Evaluations: %d" % result["nfev"])
         # print(f"Execution time:", (et - st), "seconds")  # get the execution time
         # print("Solution: f(%s) = %.5f" % (solution, evaluation))
@@ -272,18 +387,43 @@ def runmontecarlo(station, feature, iters, weights=None):
         saveout["weightNO2"] = weights[1]
         saveout["weightNO3"] = weights[2]
 
-        # add saveout to output df
-        saveout = saveout.set_index("Key")
-        output = pd.read_csv(f"{datapath()}/{stn}{ft}.csv", index_col="Key")
-        output = pd.concat([output, saveout])
-        output.to_csv(f"{datapath()}/{stn}{ft}.csv")
+        # append saveout to the shard of this worker
+        sink.write(saveout.set_index("Key"))
 
         return evaluation
 
     ### START ITERATING ###
-    Parallel(n_jobs=20)(delayed(simulation)(i) for i in range(iters))
+    # skip the iterations that a previous run of a resumed simulation (or of
+    # a chunk or queue) completed
+    if iterations is None:
+        iterations = range(iters)
+    done = sink.completed() if resume or shared else set()
+    remaining = [i for i in iterations if i not in done]
+    if done:
+        print(f"resuming: {len(done)} iterations done, {len(remaining)} to go")
+
+    if queue is None:
+        Parallel(n_jobs=n_jobs)(delayed(simulation)(i) for i in remaining)
+    else:
+        # every worker pulls iterations until the queue of this key is empty,
+        # together with the workers of any other run sharing the queue
+        queue.add(bgckey, remaining)
+
+        def task(key, i):
+            return simulation(i)
+
+        Parallel(n_jobs=n_jobs)(
+            delayed(queue.drain)(task, key=bgckey) for _ in range(n_jobs)
+        )
+        print(f"{station} {feature} queue: {queue.counts(bgckey)}")
+
+    # one row per iteration, sorted by iteration; the chunks of a job array
+    # are merged once all of them are done (see launcher.py)
+    output = sink.read() if shared else sink.merge()
 
     et = time.time()
 
     # outputdf.to_csv(f"{datapath()}montecarlo.csv")  # save results from this simulation
     print(f"monte carlo simulation terminated. Execution time:{et - st}")
+
+    return output
@@ -0,0 +1,228 @@
+"""
+File: sink.py
+--------------------
+
+Append-only result sink for Monte Carlo simulations. Every worker process
+appends its rows to its own shard file next to the output CSV, so writes
+are cheap and concurrent workers never overwrite each other's rows. The
+shards are merged into the output CSV in one atomic replace at the end,
+with one row per iteration. Together with the sampled parameters, which are
+saved next to the shards, they are also the checkpoint of a run: a resumed
+run only executes the iterations that have no row yet. The seed of the run
+is recorded with them, so that the chunks of a job array never mix in rows
+of an earlier run drawn from another seed.
+"""
+
+import glob
+import os
+import socket
+import threading
+
+import numpy as np
+import pandas as pd
+
+# column written last in every row of a shard; a row whose line was cut off
+# by a killed worker lacks it, even if the fields before it parse
+SENTINEL = "complete"
+
+
+class ResultSink:
+    """
+    Collect one row per Monte Carlo iteration from any number of workers.
+
+    Inputs:
+    path = output CSV, e.g. f"{datapath()}/{stn}{ft}.csv"; the shards are
+    kept in the directory path + ".shards"
+    index = name of the index column of the rows, e.g. "Key"
+    """
+
+    def __init__(self, path, index="Key"):
+        self.path = path
+        self.index = index
+        self.shards = path + ".shards"
+        self.samples = os.path.join(self.shards, "samples.npz")
+        self.seed = os.path.join(self.shards, "seed.txt")
+
+    def _shard(self):
+        # one shard per host, process and thread, so that no two writers
+        # ever append to the same file
+        name = f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}.csv"
+        return os.path.join(self.shards, name)
+
+    def clear(self):
+        """
+        Delete the shards, samples and seed of a previous run.
+        """
+
+        for shard in glob.glob(os.path.join(self.shards, "*.csv")):
+            os.remove(shard)
+        for path in (self.samples, self.seed):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def save_seed(self, seed):
+        """
+        Record the seed that the rows of the shards are drawn from.
+
+        Inputs:
+        seed = integer seed of the run (see streams.py)
+        """
+
+        os.makedirs(self.shards, exist_ok=True)
+        temporary = f"{self.seed}.{socket.gethostname()}-{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            file.write(f"{int(seed)}\n")
+        os.replace(temporary, self.seed)
+
+    def load_seed(self):
+        """
+        Outputs:
+        seed = integer seed given to save_seed(), or None if none was recorded
+        """
+
+        if not os.path.exists(self.seed):
+            return None
+        with open(self.seed) as file:
+            return int(file.read())
+
+    def check_seed(self, seed):
+        """
+        Make sure that the shards belong to a run of this seed before adding
+        rows to them, e.g. from one chunk of a job array, and record the seed
+        if the shards are still empty.
+
+        Inputs:
+        seed = integer seed of the run
+
+        Raises ValueError if the shards hold rows of another seed, or rows
+        without a recorded seed; clear() them to start afresh.
+        """
+
+        recorded = self.load_seed()
+        if recorded is None:
+            if self.completed():
+                raise ValueError(
+                    f"{self.shards} holds rows of a run without a recorded seed"
+                )
+            self.save_seed(seed)
+        elif recorded != int(seed):
+            raise ValueError(
+                f"{self.shards} holds rows of a run with seed {recorded}, not {seed}"
+            )
+
+    def save_samples(self, **arrays):
+        """
+        Save the sampled parameters of a run, e.g. the genmontecarlo arrays of
+        each tracer experiment, so that a resumed run uses the same samples.
+
+        Inputs:
+        arrays = numpy arrays by name
+        """
+
+        os.makedirs(self.shards, exist_ok=True)
+        temporary = f"{self.samples}.{socket.gethostname()}-{os.getpid()}.tmp.npz"
+        np.savez(temporary, **arrays)
+        os.replace(temporary, self.samples)
+
+    def load_samples(self):
+        """
+        Outputs:
+        arrays = dictionary of the numpy arrays given to save_samples(), or
+        None if no samples have been saved
+        """
+
+        if not os.path.exists(self.samples):
+            return None
+        with np.load(self.samples) as samples:
+            return dict(samples)
+
+    def completed(self):
+        """
+        Outputs:
+        iterations = set of the iterations that have a row in the shards
+        """
+
+        return set(self.read()["iteration"])
+
+    def write(self, rows):
+        """
+        Append rows to the shard of this worker.
+
+        Inputs:
+        rows = Pandas DataFrame with an "iteration" column, indexed by
+        self.index
+        """
+
+        os.makedirs(self.shards, exist_ok=True)
+        shard = self._shard()
+        rows = rows.assign(**{SENTINEL: 1})
+        text = rows.to_csv(header=not os.path.exists(shard))
+
+        # start on a new line if an earlier writer of this shard (e.g. with
+        # a reused process id) was killed mid-line
+        if os.path.exists(shard) and os.path.getsize(shard):
+            with open(shard, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read() != b"\n":
+                    text = "\n" + text
+
+        # a single write per call, flushed to disk before returning, so that
+        # a killed worker leaves at most a partial last line behind
+        with open(shard, "a") as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def read(self):
+        """
+        Rows of all shards, one per iteration (the first one written wins).
+        Rows that were not written completely are dropped.
+
+        Outputs:
+        rows = Pandas DataFrame indexed by self.index, sorted by iteration
+        """
+
+        frames = []
+        for shard in sorted(glob.glob(os.path.join(self.shards, "*.csv"))):
+            frame = pd.read_csv(shard, on_bad_lines="skip")
+            # drop a partial last line of a worker that was killed mid-write
+            if SENTINEL in frame:
+                frame = frame[frame[SENTINEL] == 1].drop(columns=SENTINEL)
+            else:
+                # shards written before the sentinel column
+                frame = frame.dropna()
+            frames.append(frame)
+
+        if not frames:
+            return pd.DataFrame([], columns=[self.index, "iteration"]).set_index(
+                self.index
+            )
+
+        rows = pd.concat(frames, ignore_index=True)
+        rows["iteration"] = rows["iteration"].astype(int)
+        rows = rows.drop_duplicates(subset="iteration").sort_values("iteration")
+
+        return rows.set_index(self.index)
+
+    def merge(self):
+        """
+        Merge the shards into the output CSV in one atomic replace. If the
+        shards hold no rows, e.g. for a key that was not part of a run, the
+        output CSV is left as it is.
+
+        Outputs:
+        rows = Pandas DataFrame that was written, as for read()
+        """
+
+        rows = self.read()
+        if rows.empty:
+            # never replace results, e.g. a committed CSV, with an empty frame
+            return rows
+
+        # write next to the output and rename over it, so that readers see
+        # either the old or the complete new file
+        temporary = f"{self.path}.{socket.gethostname()}-{os.getpid()}.tmp"
+        rows.to_csv(temporary)
+        os.replace(temporary, self.path)
+
+        return rows
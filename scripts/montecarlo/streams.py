@@ -0,0 +1,53 @@
+"""
+File: streams.py
+--------------------
+
+Deterministic random streams for Monte Carlo simulations and random starts.
+Each (seed, key, iteration) gets its own independent stream, spawned from
+one numpy SeedSequence, so that sample i of a key is the same no matter
+which worker, job or shard draws it, and runs split across processes or
+nodes merge into exactly the samples of a single run.
+"""
+
+import zlib
+
+import numpy as np
+
+
+def root_seed(seed=None):
+    """
+    Entropy of the root SeedSequence of a run.
+
+    Inputs:
+    seed = integer seed, or None for fresh entropy from the operating system
+
+    Outputs:
+    seed = integer seed; pass it to later calls (or print it) to reproduce
+    the run
+    """
+
+    return np.random.SeedSequence(seed).entropy
+
+
+def iteration_rng(seed, key, iteration):
+    """
+    Random number generator of one iteration of one key.
+
+    Inputs:
+    seed = integer seed of the run, e.g. from root_seed()
+    key = string that names the stream, e.g. "PS2SCMNH4+" for the samples of
+    one tracer experiment
+    iteration = integer iteration (or start) number
+
+    Outputs:
+    rng = numpy.random.Generator, independent of the ones of all other keys
+    and iterations of the same seed
+    """
+
+    # the same spawn key as SeedSequence(seed).spawn() would give the
+    # children of the key's child, without spawning all iterations before it
+    stream = np.random.SeedSequence(
+        seed, spawn_key=(zlib.crc32(key.encode()), int(iteration))
+    )
+
+    return np.random.default_rng(stream)
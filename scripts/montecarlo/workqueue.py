@@ -0,0 +1,270 @@
+"""
+File: workqueue.py
+--------------------
+
+Work queue on the shared filesystem for Monte Carlo iterations and batch
+fits. The tasks, one per (key, iteration), live in an SQLite database that
+any number of worker processes and jobs open at the same time; a worker
+claims a task under a time-limited lease, renews it while the task runs and
+marks it done. Leases of workers that were killed expire and their tasks
+are handed out again, so
+the work is balanced dynamically across nodes without an external broker.
+The database needs a filesystem with working POSIX locks.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class WorkQueue:
+    """
+    Lock-protected queue of (key, iteration) tasks.
+
+    Inputs:
+    path = SQLite database, e.g. f"{datapath()}00_montecarloqueue.sqlite";
+    created if it does not exist
+    lease = seconds that a claimed task is reserved for its worker; drain()
+    renews it every lease / 3 seconds while the task runs, so it only bounds
+    how long the task of a killed worker waits before it is handed out again
+    attempts = number of times a task is handed out before it is marked as
+    failed instead
+    """
+
+    def __init__(self, path, lease=600, attempts=3):
+        self.path = path
+        self.lease = lease
+        self.attempts = attempts
+
+        with self._transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " key TEXT NOT NULL,"
+                " iteration INTEGER NOT NULL,"
+                " status TEXT NOT NULL DEFAULT 'pending',"
+                " worker TEXT,"
+                " expires REAL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (key, iteration))"
+            )
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so that two workers
+        # can never claim the same task
+        db = sqlite3.connect(self.path, timeout=600, isolation_level=None)
+        return _Transaction(db)
+
+    @staticmethod
+    def worker():
+        """
+        Name of the calling worker: host and process id.
+        """
+
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def add(self, key, iterations):
+        """
+        Add tasks; tasks that are already in the queue are left as they are.
+
+        Inputs:
+        key = e.g. station + feature
+        iterations = iteration numbers
+        """
+
+        with self._transaction() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO tasks (key, iteration) VALUES (?, ?)",
+                [(key, int(i)) for i in iterations],
+            )
+
+    def clear(self, key=None):
+        """
+        Remove the tasks of one key, or of all of them, e.g. before a new run.
+        """
+
+        query = "DELETE FROM tasks"
+        params = ()
+        if key is not None:
+            query += " WHERE key = ?"
+            params = (key,)
+        with self._transaction() as db:
+            db.execute(query, params)
+
+    def claim(self, key=None):
+        """
+        Lease the next pending task, after re-queueing expired leases.
+
+        Inputs:
+        key = optional key to claim tasks of; default is any key
+
+        Outputs:
+        task = (key, iteration), or None if no task is pending
+        """
+
+        now = time.time()
+        with self._transaction() as db:
+            # tasks of killed workers: hand out again, or give up on them
+            db.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts < ? THEN 'pending'"
+                " ELSE 'failed' END WHERE status = 'leased' AND expires < ?",
+                (self.attempts, now),
+            )
+            query = "SELECT key, iteration FROM tasks WHERE status = 'pending'"
+            params = ()
+            if key is not None:
+                query += " AND key = ?"
+                params = (key,)
+            task = db.execute(query + " ORDER BY rowid LIMIT 1", params).fetchone()
+            if task is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, expires = ?,"
+                " attempts = attempts + 1 WHERE key = ? AND iteration = ?",
+                (self.worker(), now + self.lease, *task),
+            )
+
+        return task
+
+    def renew(self, key, iteration):
+        """
+        Extend the lease of a task claimed by this worker.
+        """
+
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET expires = ? WHERE key = ? AND iteration = ?"
+                " AND status = 'leased' AND worker = ?",
+                (time.time() + self.lease, key, int(iteration), self.worker()),
+            )
+
+    def complete(self, key, iteration):
+        """
+        Mark a task as done.
+        """
+
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET status = 'done', expires = NULL"
+                " WHERE key = ? AND iteration = ?",
+                (key, int(iteration)),
+            )
+
+    def release(self, key, iteration):
+        """
+        Return a task that this worker could not finish to the queue, or mark
+        it as failed once it has been handed out self.attempts times.
+        """
+
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts < ? THEN 'pending'"
+                " ELSE 'failed' END, expires = NULL"
+                " WHERE key = ? AND iteration = ? AND status = 'leased'",
+                (self.attempts, key, int(iteration)),
+            )
+
+    def counts(self, key=None):
+        """
+        Outputs:
+        counts = dictionary of the number of tasks by status ("pending",
+        "leased", "done" or "failed"), of one key or of all of them
+        """
+
+        query = "SELECT status, COUNT(*) FROM tasks"
+        params = ()
+        if key is not None:
+            query += " WHERE key = ?"
+            params = (key,)
+        with self._transaction() as db:
+            return dict(db.execute(query + " GROUP BY status", params).fetchall())
+
+    def failed(self, key=None):
+        """
+        Outputs:
+        tasks = list of the (key, iteration) tasks marked as failed, of one key
+        or of all of them
+        """
+
+        query = "SELECT key, iteration FROM tasks WHERE status = 'failed'"
+        params = ()
+        if key is not None:
+            query += " AND key = ?"
+            params = (key,)
+        with self._transaction() as db:
+            return db.execute(query + " ORDER BY key, iteration", params).fetchall()
+
+    def drain(self, function, key=None):
+        """
+        Claim and run tasks until none is pending, renewing the lease of the
+        running task from a background thread.
+
+        Inputs:
+        function = function of (key, iteration) that runs one task, e.g. one
+        Monte Carlo iteration or one fit; a task whose function raises is
+        released (see release()), the error is printed and the worker goes on
+        with the next task. Only KeyboardInterrupt and SystemExit stop it.
+        key = optional key to run tasks of; default is any key
+
+        Outputs:
+        done = number of tasks this worker completed
+        """
+
+        ### HEARTBEAT ###
+        # keep the lease of the running task from expiring, however long the
+        # task takes; renew() leaves tasks that are no longer leased alone
+        running = {}
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease / 3):
+                task = running.get("task")
+                if task is not None:
+                    self.renew(*task)
+
+        thread = threading.Thread(target=heartbeat, daemon=True)
+        thread.start()
+
+        done = 0
+        try:
+            while True:
+                task = self.claim(key)
+                if task is None:
+                    return done
+                running["task"] = task
+                try:
+                    function(*task)
+                except Exception as error:
+                    # a failing iteration must not take down the other tasks
+                    # of this worker, or of the job array it runs in
+                    self.release(*task)
+                    print(f"task {task[0]} {task[1]} failed: {error!r}")
+                    continue
+                except BaseException:
+                    self.release(*task)
+                    raise
+                finally:
+                    running.pop("task", None)
+                self.complete(*task)
+                done += 1
+        finally:
+            stop.set()
+            thread.join()
+
+
+class _Transaction:
+    # one write transaction on its own connection
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, kind, value, traceback):
+        try:
+            self.db.execute("COMMIT" if kind is None else "ROLLBACK")
+        finally:
+            self.db.close()
@@ -18,6 +18,61 @@ def rmse(array):
     return np.sqrt(np.sum(array ** 2) / len(array))
 
 
+def timepoint_indices(trainingdata):
+    """
+    Model timepoints at which incubation data are available.
+
+    Inputs:
+    trainingdata = Pandas Dataframe output from read_data.grid_data
+
+    Outputs:
+    indices = list of the 2-3 integer adjusted_timepoints of the data
+    """
+
+    t0 = trainingdata.iloc[0]  # get adjusted_timepoint at timepoint 0
+    t1 = trainingdata.iloc[1]  # get adjusted_timepoint at timepoint 1
+
+    try:  # IF a timepoint 2 exists, get adjusted timepoint
+        t2 = trainingdata.iloc[2]
+        indices = [
+            int(t0["adjusted_timepoint"]),
+            int(t1["adjusted_timepoint"]),
+            int(t2["adjusted_timepoint"]),
+        ]  # we'll use the indices array to slice the model output numpy arrays
+
+    except IndexError:  # if a timepoint 2 does not exist, indices are just timepoints 0 & 1
+        # print("No t2 available from incubation data") # this print statement might be helpful but gets annoying
+        indices = [int(t0["adjusted_timepoint"]), int(t1["adjusted_timepoint"])]
+
+    return indices
+
+
+def horizon(trainingdata, modelparams):
+    """
+    Shorten a model run to the last timepoint that the data are compared at.
+
+    Model output after the last adjusted_timepoint never enters the cost, so
+    objective functions only need to integrate up to it; the full T steps
+    are only needed for postprocess and scatter_plot.
+
+    Inputs:
+    trainingdata = Pandas Dataframe output from read_data.grid_data, or a list
+    of them for experiments that are run side by side (the longest one wins)
+    modelparams = model params from modelparams.py
+
+    Outputs:
+    modelparams = (dt, T, times), with T reduced to the last data timepoint + 1
+    """
+
+    (dt, T, times) = modelparams
+
+    if not isinstance(trainingdata, (list, tuple)):
+        trainingdata = [trainingdata]
+    last = max(max(timepoint_indices(data)) for data in trainingdata)
+
+    return (dt, min(T, last + 1), times)
+
+
 def costfxn(
     trainingdata=None,
     modeled_44=None,
@@ -25,6 +80,7 @@ def costfxn(
     modeled_45b=None,
     modeled_46=None,
     weights=None,
+    indices=None,
 ):
     """
     Compute differences between measured and modeled data at each incubation
@@ -40,26 +96,17 @@ def costfxn(
     modeled_46 = modeled 46N2O
     weights = numpy array with dimensions (4,) containing weights for model
     error associated with 44N2O, 45N2Oa, 45N2Ob, and 46N2O, in that order.
+    indices = optional rows of the modeled arrays that line up with each
+    timepoint in trainingdata; default is timepoint_indices(trainingdata).
+    Pass these when the modeled arrays only hold snapshots from observe.py.
 
     Outputs:
     cost = numpy.float64 object containing sum of weights*errors
 
     """
 
-    t0 = trainingdata.iloc[0]  # get adjusted_timepoint at timepoint 0
-    t1 = trainingdata.iloc[1]  # get adjusted_timepoint at timepoint 1
-
-    try:  # IF a timepoint 2 exists, get adjusted timepoint
-        t2 = trainingdata.iloc[2]
-        indices = [
-            int(t0["adjusted_timepoint"]),
-            int(t1["adjusted_timepoint"]),
-            int(t2["adjusted_timepoint"]),
-        ]  # we'll use the indices array to slice the model output numpy arrays
-
-    except IndexError:  # if a timepoint 2 does not exist, indices are just timepoints 0 & 1
-        # print("No t2 available from incubation data") # this print statement might be helpful but gets annoying
-        indices = [int(t0["adjusted_timepoint"]), int(t1["adjusted_timepoint"])]
+    if indices is None:  # rows of the model output that line up with the data
+        indices = timepoint_indices(trainingdata)
 
     # compute difference of modeled and measured isotopomers at each timepoint
     # multiply 1000 since concentrations of isotopocules are ~1,000x smaller
@@ -0,0 +1,154 @@
+"""
+File: fusedobjective.py
+-----------------------
+
+Objective function that simulates the 15NH4+, 15NO2- and 15NO3- experiments
+side by side in a single modelv5 run and calculates the cost of a model
+solution across all three tracer experiments.
+"""
+
+import numpy as np
+
+from .costfxn import costfxn, timepoint_indices, horizon
+
+from .. import modelv5
+from ..model.observe import observe, N2O
+from ..model.modelv5 import INTEGRATORS
+from ..model.ivp import incubation_times
+from ..model.health import HealthError, PENALTY, integrate
+
+
+def fusedobjective(
+    x,
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    full_output=False,
+    backend="numpy",
+    observed=False,
+    monitor=None,
+    substrates=None,
+):
+    """
+    Calculate the cost of a modelv5 solution for three stacked tracer experiments.
+
+    Inputs:
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgcs = BioGeoChemistryEnsemble of the NH4+, NO2- and NO3- experiments
+    trs = Tracers object with N=3 columns, initialized from bgcs and gridded_data
+    gridded_data = list of the three gridded DataFrames from read_data.grid_data
+    isos = IsotopeEffects object
+    params = model params from modelparams.py
+    weights = numpy array with dimensions (3,) containing weights for each
+    tracer experiment
+    isoweights = optional numpy array with dimensions (3, 4) containing the
+    costfxn weights for each isotopocule in each tracer experiment; default
+    is that all weights are equal to 1
+    full_output = if True, also return the unweighted cost of each experiment
+    backend = "numpy", "jit", "ivp" or "expo", passed on to modelv5
+    observed = if True, only keep the N2O isotopocules at the data timepoints
+    (see observe.py); trs then only needs two rows, e.g. Tracers(2, ...).
+    With backend="ivp" or "expo", N2O is evaluated at the incubation times
+    of the data.
+    monitor = optional HealthMonitor (see health.py), used with observed=True:
+    runs that fail a health check are stopped early and cost monitor.penalty;
+    failed "ivp" integrations cost the same, or health.PENALTY without one
+    substrates = optional SubstrateCache (see substrates.py), used with
+    observed=True and backend="numpy" or "jit": N2O is driven from cached
+    substrate trajectories while the N2O pathways leave the pools unchanged
+
+    Outputs:
+    cost = numpy.float64 object containing sum of weights*costs
+    costs = (only if full_output) numpy array with dimensions (3,)
+    """
+
+    if isoweights is None:
+        isoweights = np.ones((3, 4))
+
+    try:
+        if observed and backend in INTEGRATORS:
+            # one integrator run for all three tracers, evaluated at the
+            # incubation times of the data rather than the gridded timepoints
+            times = [incubation_times(data) for data in gridded_data]
+            t_eval = np.unique(np.concatenate(times))
+            states = integrate(
+                INTEGRATORS[backend], monitor, x, bgcs, isos, trs, t_eval
+            )
+            obs = np.array([states[name] for name in N2O])
+            modeled = [obs[:, :, j : j + 1] for j in range(3)]
+            rows = [list(np.searchsorted(t_eval, time)) for time in times]
+
+        elif observed:
+            # one observation-only run for all three tracers, recorded at the
+            # union of their data timepoints
+            indices = [timepoint_indices(data) for data in gridded_data]
+            rows = np.unique(np.concatenate(indices))
+            if substrates is None:
+                obs = observe(
+                    modelv5,
+                    x,
+                    bgcs,
+                    isos,
+                    trs,
+                    params,
+                    rows,
+                    backend=backend,
+                    monitor=monitor,
+                )
+            else:
+                obs = substrates.observe(
+                    x, bgcs, isos, trs, params, rows, backend=backend, monitor=monitor
+                )
+            modeled = [obs[:, :, j : j + 1] for j in range(3)]
+            rows = [list(np.searchsorted(rows, index)) for index in indices]
+
+        else:
+            # one run for all three tracers, up to the last data timepoint
+            tracers = modelv5(
+                x, bgcs, isos, trs, horizon(gridded_data, params), backend=backend
+            )
+            modeled = [
+                [
+                    tracers.n2o_44[:, j : j + 1],
+                    tracers.n2o_45a[:, j : j + 1],
+                    tracers.n2o_45b[:, j : j + 1],
+                    tracers.n2o_46[:, j : j + 1],
+                ]
+                for j in range(3)
+            ]
+            rows = [None] * 3
+
+    except HealthError:
+        # the run failed a health check and was stopped early, or solve_ivp
+        # failed (see health.py)
+        penalty = PENALTY if monitor is None else monitor.penalty
+        costs = np.full(3, float(penalty))
+        if full_output:
+            return penalty, costs
+        return penalty
+
+    costs = np.array(
+        [
+            costfxn(
+                trainingdata=gridded_data[j],
+                modeled_44=modeled[j][0],
+                modeled_45a=modeled[j][1],
+                modeled_45b=modeled[j][2],
+                modeled_46=modeled[j][3],
+                weights=isoweights[j],
+                indices=rows[j],
+            )
+            for j in range(3)
+        ]
+    )
+
+    cost = np.sum(costs * weights)
+
+    if full_output:
+        return cost, costs
+
+    return cost
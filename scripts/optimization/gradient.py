@@ -0,0 +1,200 @@
+"""
+File: gradient.py
+-----------------
+
+Gradient of the stacked-tracer objective from one forward-sensitivity run of
+modelv5 (see model/sensitivity.py). The costfxn residuals of each tracer
+experiment and their Jacobian with respect to x are exposed separately, so
+that gradient-based optimizers (e.g. L-BFGS-B) can use the exact derivative
+of the cost instead of finite differences.
+"""
+
+import numpy as np
+from scipy.optimize import minimize
+
+from .costfxn import timepoint_indices
+from .linearfit import COLUMNS, SCALE
+from .transform import rate_scale
+from ..model.sensitivity import modelv5_sensitivity
+
+# bounded scipy.optimize.minimize methods that take a gradient
+METHODS = ("l-bfgs-b", "tnc", "slsqp", "trust-constr")
+
+
+def residual_jacobian(trainingdata, obs, sens=None):
+    """
+    costfxn residuals of one tracer experiment and their Jacobian.
+
+    Inputs:
+    trainingdata = Pandas Dataframe output from read_data.grid_data
+    obs = numpy array with dimensions (4, n) containing modeled 44N2O, 45N2Oa,
+    45N2Ob and 46N2O at the n timepoints of trainingdata
+    sens = numpy array with dimensions (5, 4, n) containing the derivatives of
+    obs with respect to x, e.g. from modelv5_sensitivity; if None, only the
+    residuals are computed
+
+    Outputs:
+    residuals = numpy array with dimensions (4, n) containing the errors that
+    costfxn takes the RMSE of (45N2Oa, 45N2Ob and 46N2O multiplied by 1000)
+    jacobian = numpy array with dimensions (4, n, 5) containing the
+    derivatives of residuals with respect to x, or None
+    """
+
+    measured = np.array(trainingdata[list(COLUMNS)], dtype="float64").T
+
+    residuals = (obs - measured) * SCALE[:, None]
+    if sens is None:
+        return residuals, None
+    jacobian = np.moveaxis(sens, 0, -1) * SCALE[:, None, None]
+
+    return residuals, jacobian
+
+
+def fusedgradient(
+    x,
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    full_output=False,
+):
+    """
+    Cost of a modelv5 solution for three stacked tracer experiments and its
+    gradient with respect to x, from a single forward-sensitivity run.
+
+    The cost is the same as fusedobjective(x, ..., observed=True). Pass this
+    function to scipy.optimize.minimize with jac=True.
+
+    Inputs:
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgcs, trs, gridded_data, isos, params, weights, isoweights = same as for
+    fusedobjective; trs may be allocated with T=2
+    full_output = if True, also return the unweighted cost of each experiment
+
+    Outputs:
+    cost = numpy.float64 object containing sum of weights*costs
+    gradient = numpy array with dimensions (5,) containing d(cost)/dx
+    costs = (only if full_output) numpy array with dimensions (3,)
+    """
+
+    if isoweights is None:
+        isoweights = np.ones((3, 4))
+
+    # one sensitivity run for all three tracers, recorded at the union of
+    # their data timepoints
+    indices = [timepoint_indices(data) for data in gridded_data]
+    rows = np.unique(np.concatenate(indices))
+    obs, sens = modelv5_sensitivity(x, bgcs, isos, trs, params, rows)
+
+    costs = np.zeros(3)
+    gradient = np.zeros(len(x))
+    for j, data in enumerate(gridded_data):
+        positions = np.searchsorted(rows, indices[j])
+        residuals, jacobian = residual_jacobian(
+            data, obs[:, positions, j], sens[:, :, positions, j]
+        )
+
+        ### COST ###
+        # d(RMSE)/dx = sum(residual * d(residual)/dx) / (n * RMSE)
+        rmse = np.sqrt(np.sum(residuals**2, axis=1) / residuals.shape[1])
+        costs[j] = np.sum(isoweights[j] * rmse)
+
+        ### GRADIENT ###
+        drmse = np.einsum("sn,snp->sp", residuals, jacobian) / residuals.shape[1]
+        drmse = np.divide(
+            drmse, rmse[:, None], out=np.zeros_like(drmse), where=rmse[:, None] > 0
+        )
+        gradient += weights[j] * (isoweights[j] @ drmse)
+
+    cost = np.sum(costs * weights)
+
+    if full_output:
+        return cost, gradient, costs
+
+    return cost, gradient
+
+
+def gradientfit(
+    x,
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    method="L-BFGS-B",
+    transform=None,
+):
+    """
+    Fit modelv5 to three stacked tracer experiments with a bounded
+    gradient-based optimizer and the exact gradient from fusedgradient.
+
+    The rate constants are of order 1e-9 to 1e-7 while f is of order 1, so
+    each rate constant is divided by its initial guess (or, if the guess is
+    0, by the largest rate constant of the guess, see transform.rate_scale)
+    before it is handed to the optimizer, and the result is mapped back.
+
+    Inputs:
+    x = initial guess [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgcs, trs, gridded_data, isos, params, weights, isoweights = same as for
+    fusedgradient
+    method = one of METHODS (case-insensitive); with a transform, any
+    scipy.optimize.minimize method that uses a gradient (e.g. "BFGS")
+    transform = optional LogTransform (see transform.py); the search then runs
+    on the log rate constants and logit f instead
+
+    Outputs:
+    result = scipy OptimizeResult with x = [knitrification, kdenitno2,
+    kdenitno3, khybrid2, f], fun = cost of x, nfev = number of sensitivity
+    runs, and message
+    """
+
+    x = np.asarray(x, dtype="float64")
+
+    if transform is not None:
+
+        def objective(z):
+            cost, gradient = fusedgradient(
+                transform.inverse(z),
+                bgcs,
+                trs,
+                gridded_data,
+                isos,
+                params,
+                weights,
+                isoweights,
+            )
+            return cost, gradient * transform.derivative(z)
+
+        bounds = transform.bounds if method.lower() in METHODS else None
+        result = minimize(
+            objective, transform.forward(x), jac=True, method=method, bounds=bounds
+        )
+        # report the solution in the original units
+        result.z = result.x
+        result.x = transform.inverse(result.z)
+
+        return result
+
+    if method.lower() not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not {method!r}")
+
+    scale = np.append(rate_scale(x), 1.0)
+
+    def objective(z):
+        cost, gradient = fusedgradient(
+            z * scale, bgcs, trs, gridded_data, isos, params, weights, isoweights
+        )
+        return cost, gradient * scale
+
+    # define bounds: no negative rate constants, f between 0 and 1
+    bnds = ((0, None), (0, None), (0, None), (0, None), (0, 1))
+    result = minimize(objective, x / scale, jac=True, method=method, bounds=bnds)
+    # report the solution in the original units
+    result.x = result.x * scale
+
+    return result
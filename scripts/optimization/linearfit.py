@@ -0,0 +1,133 @@
+"""
+File: linearfit.py
+------------------
+
+Fast modelv5 fit by variable projection. With the substrate pools fixed to
+their cached trajectories (see model/substrates.py), the modeled N2O
+isotopocules are linear in knitrification, kdenitno2, kdenitno3 and khybrid2
+for any f, so the rate constants are solved by non-negative least squares
+and only f is searched. The result can be polished with the fully coupled
+model.
+"""
+
+import numpy as np
+from scipy.optimize import OptimizeResult, minimize, minimize_scalar, nnls
+
+from .costfxn import timepoint_indices
+from .fusedobjective import fusedobjective
+from ..model.substrates import SubstrateCache
+
+# data columns in costfxn order, and the factor costfxn multiplies errors by
+COLUMNS = ("44N2O", "45N2Oa", "45N2Ob", "46N2O")
+SCALE = np.array([1.0, 1000.0, 1000.0, 1000.0])
+
+
+def linearfit(
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    substrates=None,
+    fgrid=21,
+    polish=False,
+    backend="numpy",
+    transform=None,
+    monitor=None,
+):
+    """
+    Fit modelv5 to three stacked tracer experiments by variable projection.
+
+    For each f, the rate constants minimize the sum over experiments and
+    isotopocules of weights * isoweights * mean squared (scaled) error, the
+    least-squares counterpart of the RMSE sum in costfxn; f is then chosen
+    on a grid of fgrid values and refined with a bounded scalar search.
+
+    Inputs:
+    bgcs, trs, gridded_data, isos, params, weights, isoweights = same as for
+    fusedobjective; trs may be allocated with T=2
+    substrates = SubstrateCache to take the substrate trajectories from; a
+    new one is made if None
+    fgrid = number of values of f between 0 and 1 to start the search from
+    polish = if True, refine the solution with Nelder-Mead on the fully
+    coupled model (fusedobjective with observed=True)
+    backend = passed on to fusedobjective for the final cost and the polish
+    transform = optional LogTransform (see transform.py) for the polish
+    monitor = optional HealthMonitor (see model/health.py) for the polish
+
+    Outputs:
+    result = scipy OptimizeResult with x = [knitrification, kdenitno2,
+    kdenitno3, khybrid2, f], fun = cost of x from fusedobjective, nfev =
+    number of least-squares solves (plus objective evaluations of the
+    polish), and message
+    """
+
+    if isoweights is None:
+        isoweights = np.ones((3, 4))
+    if substrates is None:
+        substrates = SubstrateCache()
+
+    ### LINEAR RESPONSES AT THE DATA TIMEPOINTS ###
+    indices = [timepoint_indices(data) for data in gridded_data]
+    rows = np.unique(np.concatenate(indices))
+    offset, basis, drawdown = substrates.responses(bgcs, isos, trs, params, rows)
+
+    # stack the residuals of all experiments, isotopocules and timepoints,
+    # each scaled so that its square enters with the costfxn weights
+    A, b = [], []
+    for j, data in enumerate(gridded_data):
+        positions = np.searchsorted(rows, indices[j])
+        measured = np.array(data[list(COLUMNS)], dtype="float64")  # (n, 4)
+        scale = SCALE * np.sqrt(weights[j] * isoweights[j] / len(positions))
+        A.append((basis[:, :, positions, j] * scale[:, None]).reshape(len(basis), -1))
+        b.append(((measured.T - offset[:, positions, j]) * scale[:, None]).ravel())
+    A = np.concatenate(A, axis=1).T  # (n_residuals, 5)
+    b = np.concatenate(b)
+
+    nfev = 0
+
+    def project(f):
+        # best non-negative rate constants for this f, and their residual
+        nonlocal nfev
+        nfev += 1
+        design = np.column_stack([A[:, :3], f * A[:, 3] + (1 - f) * A[:, 4]])
+        rates, rnorm = nnls(design, b)
+        return rates, rnorm
+
+    ### SEARCH OVER F ###
+    grid = np.linspace(0, 1, fgrid)
+    residuals = [project(f)[1] for f in grid]
+    best = int(np.argmin(residuals))
+    bracket = (grid[max(best - 1, 0)], grid[min(best + 1, fgrid - 1)])
+    search = minimize_scalar(lambda f: project(f)[1], bounds=bracket, method="bounded")
+    f = search.x if search.fun <= residuals[best] else grid[best]
+    rates, rnorm = project(f)
+
+    x = np.append(rates, f)
+    args = (bgcs, trs, gridded_data, isos, params, weights, isoweights)
+    cost = fusedobjective(
+        x, *args, backend=backend, observed=True, substrates=substrates
+    )
+    message = "variable projection converged"
+
+    ### POLISH WITH THE FULLY COUPLED MODEL ###
+    if polish:
+        polished = args + (False, backend, True, monitor)
+        if transform is not None:
+            result = transform.minimize(fusedobjective, x, args=polished)
+        else:
+            bnds = ((0, None), (0, None), (0, None), (0, None), (0, 1))
+            result = minimize(
+                fusedobjective,
+                x,
+                args=polished,
+                method="nelder-mead",
+                bounds=bnds,
+            )
+        x, cost = result.x, result.fun
+        nfev += result.nfev
+        message = f"variable projection, polished: {result.message}"
+
+    return OptimizeResult(x=x, fun=cost, nfev=nfev, success=True, message=message)
@@ -8,7 +8,7 @@ across all three tracer experiments.
 
 import numpy as np
 
-from .costfxn import costfxn
+from .costfxn import costfxn, horizon
 
 from .. import modelv5
 
@@ -29,7 +29,8 @@ def modelv5objective(
     weights,
 ):
 
-    tracersNH4 = modelv5(x, bgcNH4, isos, trNH4, params)  # run model with this solution
+    # run model with this solution, up to the last timepoint of each experiment
+    tracersNH4 = modelv5(x, bgcNH4, isos, trNH4, horizon(gridded_dataNH4, params))
 
     costNH4 = costfxn(
         trainingdata=gridded_dataNH4,  # calculate cost for this solution from model run
@@ -42,7 +43,7 @@ def modelv5objective(
         ),  # these are the weights for each individual isotopocule
     )
 
-    tracersNO2 = modelv5(x, bgcNO2, isos, trNO2, params)
+    tracersNO2 = modelv5(x, bgcNO2, isos, trNO2, horizon(gridded_dataNO2, params))
 
     costNO2 = costfxn(
         trainingdata=gridded_dataNO2,
@@ -53,7 +54,7 @@ def modelv5objective(
         weights=np.array([1, 1, 1, 1]),
     )
 
-    tracersNO3 = modelv5(x, bgcNO3, isos, trNO3, params)
+    tracersNO3 = modelv5(x, bgcNO3, isos, trNO3, horizon(gridded_dataNO3, params))
 
     costNO3 = costfxn(
         trainingdata=gridded_dataNO3,
@@ -0,0 +1,193 @@
+"""
+File: multifidelity.py
+----------------------
+
+Multi-fidelity fitting of modelv5. The early, exploratory iterations of an
+optimizer do not need the full time resolution, so the fit is first carried
+out on a coarse time grid (dt larger by an integer factor, with the data
+timepoints remapped onto it) and then refined at full resolution from the
+coarse optimum. A simplex refinement starts from a small simplex around the
+coarse optimum with a small budget of full-resolution runs, instead of
+searching again from scratch. The discrepancy between the two levels is
+reported.
+"""
+
+import numpy as np
+from scipy.optimize import OptimizeResult
+
+from .fusedobjective import fusedobjective
+from .multistart import fit
+from .speculative import SPECULATIVE
+from .transform import rate_scale
+
+
+def coarsen(gridded_data, params, factor):
+    """
+    Coarse time grid for modelv5 and the data timepoints on it.
+
+    Inputs:
+    gridded_data = gridded DataFrame from read_data.grid_data, or a list of them
+    params = model params from modelparams.py
+    factor = integer factor by which the time step is increased, e.g. 10 or
+    20 for dt = 0.01 or 0.02 d
+
+    Outputs:
+    gridded_data = copies of the gridded data whose adjusted_timepoints are
+    rounded to the nearest coarse timepoint
+    params = (dt * factor, T / factor rounded up, times) for the coarse grid
+    """
+
+    (dt, T, times) = params
+    factor = int(factor)
+    if factor < 1:
+        raise ValueError("factor must be a positive integer")
+
+    def remap(data):
+        data = data.copy()
+        data["adjusted_timepoint"] = np.round(data["adjusted_timepoint"] / factor)
+        return data
+
+    if isinstance(gridded_data, (list, tuple)):
+        coarse = [remap(data) for data in gridded_data]
+    else:
+        coarse = remap(gridded_data)
+
+    T = -(-T // factor)
+    return coarse, (dt * factor, T, np.arange(1, T + 1))
+
+
+def multifidelity(
+    x,
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    factor=10,
+    method="nelder-mead",
+    refine=None,
+    transform=None,
+    monitor=None,
+    substrates=None,
+    coarse_options=None,
+    options=None,
+    simplex=0.05,
+    maxfev=30,
+):
+    """
+    Fit modelv5 on a coarse time grid, then refine the fit at full resolution.
+
+    Inputs:
+    x = initial guess [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgcs, trs, gridded_data, isos, params, weights, isoweights, monitor,
+    substrates = same as for fusedobjective, at full resolution; trs must be
+    an observation-only Tracers object (e.g. Tracers(2, ...)), which serves
+    both grids
+    factor = integer factor by which dt is increased on the coarse grid
+    method = method of fit() (see multistart.py) on the coarse grid
+    refine = method of fit() for the refinement; default is method
+    transform = optional LogTransform (see transform.py), used on both grids
+    coarse_options, options = options of fit() on the coarse grid and for
+    the refinement, e.g. a looser fatol for the coarse fit
+    simplex = for a refinement with nelder-mead or speculative-nelder-mead,
+    size of the initial simplex around the coarse optimum, relative to each
+    rate constant (scaled as in transform.rate_scale) and absolute for f, or
+    along each entry of z with a transform; unless options contains an
+    initial_simplex
+    maxfev = for the same refinements, largest number of full-resolution
+    evaluations, unless options contains maxfev; None for no limit
+
+    Outputs:
+    result = scipy OptimizeResult of the refinement, with fun = cost of x at
+    full resolution, and
+    coarse = OptimizeResult of the coarse fit
+    discrepancy = cost of the coarse optimum at full resolution minus its
+    cost on the coarse grid
+    shift = numpy array with dimensions (5,) containing the change of each
+    entry of x from the coarse to the refined optimum, relative to the
+    refined optimum (absolute for entries that are 0)
+    nfev = objective evaluations on both grids
+    work = cost of the fit in full-resolution model runs, counting each
+    coarse evaluation as 1 / factor of a run
+    """
+
+    if refine is None:
+        refine = method
+
+    ### COARSE FIT ###
+    coarse_data, coarse_params = coarsen(gridded_data, params, factor)
+    coarse = fit(
+        x,
+        bgcs,
+        trs,
+        coarse_data,
+        isos,
+        coarse_params,
+        weights,
+        isoweights=isoweights,
+        method=method,
+        transform=transform,
+        monitor=monitor,
+        substrates=substrates,
+        options=coarse_options,
+    )
+
+    ### REFINEMENT AT FULL RESOLUTION ###
+    # the coarse optimum is close to the fine one, so a simplex refinement
+    # starts small around it with a small budget, instead of from scratch
+    options = dict(options or {})
+    if str(refine).lower() in ("nelder-mead", SPECULATIVE):
+        if transform is None:
+            start = np.asarray(coarse.x, dtype="float64")
+            step = simplex * np.append(rate_scale(start), 1.0)
+            # step f towards the middle of [0, 1]
+            step[4] = -step[4] if start[4] > 0.5 else step[4]
+        else:
+            start = transform.forward(coarse.x)
+            step = simplex * np.ones(len(start))
+        options.setdefault("initial_simplex", np.vstack([start, start + np.diag(step)]))
+        options.setdefault("maxfev", maxfev)
+
+    result = fit(
+        coarse.x,
+        bgcs,
+        trs,
+        gridded_data,
+        isos,
+        params,
+        weights,
+        isoweights=isoweights,
+        method=refine,
+        transform=transform,
+        monitor=monitor,
+        substrates=substrates,
+        options=options,
+    )
+
+    ### DISCREPANCY BETWEEN LEVELS ###
+    fine = fusedobjective(
+        coarse.x,
+        bgcs,
+        trs,
+        gridded_data,
+        isos,
+        params,
+        weights,
+        isoweights,
+        observed=True,
+        monitor=monitor,
+        substrates=substrates,
+    )
+    scale = np.where(result.x != 0, np.abs(result.x), 1.0)
+
+    nfev = int(result.nfev)
+    result.coarse = coarse
+    result.discrepancy = float(fine - coarse.fun)
+    result.shift = (np.asarray(coarse.x) - result.x) / scale
+    result.nfev = int(coarse.nfev) + nfev
+    result.work = coarse.nfev / factor + nfev + 1
+    result.message = f"coarse: {coarse.message}, refined: {result.message}"
+
+    return result
@@ -0,0 +1,330 @@
+"""
+File: multistart.py
+-------------------
+
+Multi-start fitting of modelv5. K starting points are drawn around the x0()
+estimates and fitted concurrently on a pool of processes; each worker
+initializes the three tracer experiments once and then fits any number of
+starts. All local optima are returned together with the best one.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.optimize import OptimizeResult, minimize
+
+from .fusedobjective import fusedobjective
+from .gradient import METHODS as GRADIENT_METHODS, gradientfit
+from .initialguess import x0
+from .residuals import residualfit
+from .speculative import SPECULATIVE, speculative_nelder_mead
+from .transform import LogTransform
+from ..montecarlo.streams import iteration_rng, root_seed
+from ..initialization.bgc_ensemble import BioGeoChemistryEnsemble
+from ..initialization.initialize import initialize
+from ..initialization.tracers import Tracers
+
+# tracer experiments of each station and feature, in the order of weights
+TRACERS = ("NH4+", "NO2-", "NO3-")
+
+# options that a fitting method cannot use: the batched population runs and
+# the forward sensitivities neither check the state (monitor) nor read cached
+# substrates, differential_evolution already searches log rate constants
+# (reparameterize), and neither it nor the linear fit has a coarse stage
+UNSUPPORTED = {
+    "linear": ("coarse",),
+    "differential_evolution": ("monitor", "substrates", "reparameterize", "coarse"),
+    SPECULATIVE: ("monitor", "substrates"),
+    **{method: ("monitor", "substrates") for method in GRADIENT_METHODS},
+}
+
+
+def experiments(station, feature):
+    """
+    Initialize the three tracer experiments of one station and feature,
+    stacked for fusedobjective.
+
+    Inputs:
+    station = "PS1", etc.
+    feature = "SCM", etc.
+
+    Outputs:
+    bgcs, trs, gridded_data, isos, params = BioGeoChemistryEnsemble, Tracers
+    object with two rows and N=3 columns, list of the three gridded
+    DataFrames, IsotopeEffects object and model params
+    """
+
+    gridded_data, bgc = [], []
+    for tracer in TRACERS:
+        data, b, isos, tr, params = initialize(
+            station=station, feature=feature, tracer=tracer
+        )
+        gridded_data.append(data)
+        bgc.append(b)
+
+    bgcs = BioGeoChemistryEnsemble(bgc)
+    trs = Tracers(2, bgcs, gridded_data, N=3, species="modelv5")
+
+    return bgcs, trs, gridded_data, isos, params
+
+
+def guess(station, feature, f=0.5):
+    """
+    Initial guess for modelv5 from the x0() estimates.
+
+    Outputs:
+    x = numpy array [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    """
+
+    estimates = x0(station=station, feature=feature, key=station + feature)
+    kNH4, kNO, kNO2, kNO3, khybrid1, khybrid2 = estimates[:6]
+
+    return np.array([kNH4, kNO2, kNO3, khybrid2, f])
+
+
+def check_options(method, **options):
+    """
+    Reject options that a fitting method would otherwise silently drop.
+
+    Inputs:
+    method = fitting method, as for fit() or runmodelv5
+    options = e.g. monitor, substrates, reparameterize or coarse; an option
+    that is None or False is not used
+
+    Raises ValueError for an option that is used but does not apply to method.
+    """
+
+    for name in UNSUPPORTED.get(method.lower(), ()):
+        if options.get(name) not in (None, False):
+            raise ValueError(f"{name} does not apply to method='{method}'")
+
+
+def fit(
+    x,
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    method="nelder-mead",
+    transform=None,
+    monitor=None,
+    substrates=None,
+    options=None,
+):
+    """
+    Fit modelv5 to three stacked tracer experiments from one starting point.
+
+    Inputs:
+    x = starting point [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    bgcs, trs, gridded_data, isos, params, weights, isoweights, monitor,
+    substrates = same as for fusedobjective
+    method = "least_squares" (residualfit), a gradient-based method in
+    gradient.METHODS (gradientfit), "speculative-nelder-mead" (nelder-mead
+    with the candidate moves of each iteration evaluated in one batched run
+    of PopulationObjective, see speculative.py), or any other scipy.optimize.minimize method, which minimizes
+    fusedobjective with observed=True
+    transform = optional LogTransform (see transform.py)
+    options = options for scipy.optimize.minimize
+
+    Options that method does not use raise ValueError (see check_options).
+
+    Outputs:
+    result = scipy OptimizeResult with x and fun = cost of x
+    """
+
+    check_options(method, monitor=monitor, substrates=substrates)
+
+    if method == "least_squares":
+        return residualfit(
+            x,
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            isoweights=isoweights,
+            monitor=monitor,
+            substrates=substrates,
+            transform=transform,
+        )
+
+    if method.lower() in GRADIENT_METHODS:
+        return gradientfit(
+            x,
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            isoweights=isoweights,
+            method=method,
+            transform=transform,
+        )
+
+    if method == SPECULATIVE:
+        # population.py imports fit() from this module
+        from .population import PopulationObjective
+
+        batch = PopulationObjective(
+            bgcs, gridded_data, isos, params, weights, isoweights
+        )
+        if transform is not None:
+            batch = transform.objective(batch)
+        options = dict(options or {}, batch=batch)
+        method = speculative_nelder_mead
+
+    args = (bgcs, trs, gridded_data, isos, params, weights, isoweights)
+    # full_output, backend, observed, monitor, substrates
+    args = args + (False, "numpy", True, monitor, substrates)
+
+    if transform is not None:
+        return transform.minimize(
+            fusedobjective, x, args=args, method=method, options=options
+        )
+
+    # define bounds: no negative rate constants, f between 0 and 1
+    bnds = ((0, None), (0, None), (0, None), (0, None), (0, 1))
+    return minimize(
+        fusedobjective, x, args=args, method=method, bounds=bnds, options=options
+    )
+
+
+### WORKER STATE ###
+# each process of the pool keeps its own copy of the experiments
+_worker = {}
+
+
+def _setup(station, feature, substrates):
+    _worker["experiments"] = experiments(station, feature)
+    _worker["substrates"] = substrates
+
+
+def _fit(start, weights, isoweights, method, center, reparameterize, options):
+    transform = LogTransform(center) if reparameterize else None
+    result = fit(
+        start,
+        *_worker["experiments"],
+        weights,
+        isoweights=isoweights,
+        method=method,
+        transform=transform,
+        substrates=_worker["substrates"],
+        options=options,
+    )
+    return result.x, float(result.fun), int(result.nfev), str(result.message)
+
+
+def multistart(
+    station,
+    feature,
+    starts=8,
+    weights=None,
+    isoweights=None,
+    method="nelder-mead",
+    reparameterize=False,
+    spread=0.25,
+    seed=None,
+    n_jobs=None,
+    substrates=None,
+    options=None,
+):
+    """
+    Fit modelv5 from several random starting points around the x0() estimates
+    concurrently.
+
+    Inputs:
+    station = "PS1", etc.
+    feature = "SCM", etc.
+    starts = number of starting points K, or a numpy array with dimensions
+    (K, 5) containing the starting points themselves
+    weights = numpy array with dimensions (3,) containing weights for each
+    tracer experiment; default is 1/3 each
+    isoweights = same as for fusedobjective
+    method, options = same as for fit()
+    reparameterize = if True, search log rate constants and logit f (see
+    transform.py), scaled by the x0() estimates
+    spread = starting points are drawn uniformly between (1 - spread) and
+    (1 + spread) times the initial guess, as in errors.py
+    seed = integer seed for the random starting points; default is fresh
+    entropy, returned as result.seed
+    n_jobs = number of worker processes; default is one per start, up to the
+    number of CPUs. With n_jobs=1 the starts are fitted in this process.
+    substrates = optional SubstrateCache; each worker gets its own copy
+
+    Outputs:
+    result = scipy OptimizeResult with x and fun of the best start, and
+    starts = numpy array with dimensions (K, 5) containing the starting points
+    xs = numpy array with dimensions (K, 5) containing the local optima
+    funs = numpy array with dimensions (K,) containing their costs
+    nfevs, messages = objective evaluations and status of each start
+    best = index of the best start
+    nfev = total objective evaluations
+    seed = seed of the starting points
+    """
+
+    if weights is None:
+        weights = np.array([1.0 / 3, 1.0 / 3, 1.0 / 3])
+
+    center = guess(station, feature)
+
+    ### STARTING POINTS ###
+    if np.ndim(starts) == 0:
+        # one stream per start (see montecarlo/streams.py), so that start k
+        # is the same for any number of starts
+        seed = root_seed(seed)
+        factors = np.array(
+            [
+                iteration_rng(seed, station + feature, k).uniform(
+                    1 - spread, 1 + spread, size=len(center)
+                )
+                for k in range(int(starts))
+            ]
+        )
+        points = center * factors
+        points[:, 4] = np.clip(points[:, 4], 0, 1)
+    else:
+        points = np.asarray(starts, dtype="float64")
+
+    if n_jobs is None:
+        n_jobs = min(len(points), os.cpu_count() or 1)
+
+    ### FIT ###
+    tasks = [
+        (start, weights, isoweights, method, center, reparameterize, options)
+        for start in points
+    ]
+    if n_jobs == 1:
+        _setup(station, feature, substrates)
+        fits = [_fit(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_setup,
+            initargs=(station, feature, substrates),
+        ) as pool:
+            fits = list(pool.map(_fit, *zip(*tasks)))
+
+    xs, funs, nfevs, messages = zip(*fits)
+    funs = np.array(funs)
+    best = int(np.argmin(funs))
+
+    return OptimizeResult(
+        x=xs[best],
+        fun=funs[best],
+        nfev=int(np.sum(nfevs)),
+        success=bool(np.isfinite(funs[best])),
+        message=messages[best],
+        starts=points,
+        xs=np.array(xs),
+        funs=funs,
+        nfevs=np.array(nfevs),
+        messages=list(messages),
+        best=best,
+        seed=seed,
+    )
@@ -0,0 +1,241 @@
+"""
+File: population.py
+-------------------
+
+Global search for modelv5 with a population optimizer. The objective takes
+a whole population of candidate x at once and runs all of them, for all
+three tracer experiments, side by side in one observation-only modelv5 run
+(one column per candidate and experiment), so that a generation of
+differential evolution costs about as much as a single forward run.
+"""
+
+import numpy as np
+from scipy.optimize import OptimizeResult, differential_evolution
+
+from .costfxn import timepoint_indices
+from .linearfit import COLUMNS, SCALE
+from .multistart import fit
+from .transform import rate_scale
+from .. import modelv5
+from ..initialization.tracers import Tracers
+from ..model.observe import observe
+
+
+class PopulationObjective:
+    """
+    Cost of many modelv5 solutions for three stacked tracer experiments,
+    evaluated in one batched run; each cost is the same as
+    fusedobjective(x, ..., observed=True).
+
+    Inputs:
+    bgcs, gridded_data, isos, params, weights, isoweights, backend = same as
+    for fusedobjective
+    penalty = cost of candidates whose run produced non-finite values
+
+    Counters:
+    evaluations = candidates evaluated
+    runs = batched model runs
+    """
+
+    def __init__(
+        self,
+        bgcs,
+        gridded_data,
+        isos,
+        params,
+        weights,
+        isoweights=None,
+        backend="numpy",
+        penalty=1e6,
+    ):
+
+        if isoweights is None:
+            isoweights = np.ones((3, 4))
+
+        self.bgcs = bgcs
+        self.gridded_data = list(gridded_data)
+        self.isos = isos
+        self.params = params
+        self.weights = np.asarray(weights)
+        self.isoweights = np.asarray(isoweights)
+        self.backend = backend
+        self.penalty = penalty
+
+        ### OBSERVATIONS ###
+        indices = [timepoint_indices(data) for data in gridded_data]
+        self.rows = np.unique(np.concatenate(indices))
+        self.positions = [np.searchsorted(self.rows, index) for index in indices]
+        self.measured = [
+            np.array(data[list(COLUMNS)], dtype="float64").T for data in gridded_data
+        ]
+
+        # tiled ensembles and state arrays, by population size
+        self._batches = {}
+
+        ### COUNTERS ###
+        self.evaluations = 0
+        self.runs = 0
+
+    def _batch(self, size):
+        # the three experiments repeated once per candidate
+        if size not in self._batches:
+            bgcs = self.bgcs.tile(size)
+            trs = Tracers(
+                2, bgcs, self.gridded_data * size, N=3 * size, species="modelv5"
+            )
+            self._batches[size] = (bgcs, trs)
+        return self._batches[size]
+
+    def __call__(self, X):
+        """
+        Inputs:
+        X = numpy array with dimensions (5, S) containing one candidate
+        [knitrification, kdenitno2, kdenitno3, khybrid2, f] per column, or
+        (5,) for a single candidate
+
+        Outputs:
+        costs = numpy array with dimensions (S,) containing sum of
+        weights*costs for each candidate (a float for a single candidate)
+        """
+
+        X = np.asarray(X, dtype="float64")
+        single = X.ndim == 1
+        X = np.atleast_2d(X.T).T
+        size = X.shape[1]
+
+        bgcs, trs = self._batch(size)
+
+        # column 3 * c + j holds candidate c in tracer experiment j
+        obs = observe(
+            modelv5,
+            np.repeat(X, 3, axis=1),
+            bgcs,
+            self.isos,
+            trs,
+            self.params,
+            self.rows,
+            backend=self.backend,
+        )
+        self.runs += 1
+        self.evaluations += size
+
+        ### COST ###
+        costs = np.zeros(size)
+        for j in range(3):
+            modeled = obs[:, self.positions[j], j::3]  # (4, n, S)
+            errors = (modeled - self.measured[j][:, :, None]) * SCALE[:, None, None]
+            rmse = np.sqrt(np.sum(errors**2, axis=1) / errors.shape[1])  # (4, S)
+            costs += self.weights[j] * (self.isoweights[j] @ rmse)
+
+        costs = np.where(np.isfinite(costs), costs, self.penalty)
+
+        return costs[0] if single else costs
+
+    def __repr__(self):
+        return f"{self.evaluations} candidates in {self.runs} batched model runs"
+
+
+def populationfit(
+    x,
+    bgcs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    decades=2,
+    popsize=15,
+    maxiter=100,
+    tol=0.01,
+    seed=None,
+    polish=None,
+    backend="numpy",
+):
+    """
+    Global fit of modelv5 to three stacked tracer experiments with
+    differential evolution, evaluating each generation in one batched run.
+
+    The rate constants are searched on a log scale within decades orders of
+    magnitude of the initial guess (see transform.rate_scale for the scaling
+    of rate constants that x0() estimates as 0), and f between 0 and 1. One
+    more decade below that range stands for a rate constant of exactly 0,
+    so that pathways can be switched off as with the other methods; rate
+    constants that are 0 in the guess start there.
+
+    Inputs:
+    x = initial guess [knitrification, kdenitno2, kdenitno3, khybrid2, f],
+    which also joins the initial population
+    bgcs, gridded_data, isos, params, weights, isoweights, backend = same as
+    for fusedobjective
+    decades = half-width of the search range of each rate constant, in
+    orders of magnitude
+    popsize, maxiter, tol, seed = passed on to differential_evolution;
+    the population has popsize * 5 candidates
+    polish = optional method to refine the best candidate with fit() (see
+    multistart.py), e.g. "least_squares" or "nelder-mead"
+
+    Outputs:
+    result = scipy OptimizeResult with x = [knitrification, kdenitno2,
+    kdenitno3, khybrid2, f], fun = cost of x, nfev = candidates evaluated
+    (plus evaluations of the polish), nit = generations, and message
+    """
+
+    x = np.asarray(x, dtype="float64")
+    scale = rate_scale(x)
+    objective = PopulationObjective(
+        bgcs, gridded_data, isos, params, weights, isoweights, backend=backend
+    )
+
+    ### SEARCH SPACE ###
+    # u = [log10(k / scale) for each rate constant, f]; u below -decades
+    # snaps the rate constant to 0
+    def inverse(U):
+        U = np.asarray(U, dtype="float64")
+        rates = np.where(U[:4] < -decades, 0.0, scale[:, None] * 10 ** U[:4])
+        return np.concatenate([rates, U[4:]])
+
+    bounds = [(-decades - 1, decades)] * 4 + [(0, 1)]
+    u0 = np.append(
+        np.where(
+            x[:4] > 0,
+            np.log10(np.maximum(x[:4] / scale, 10.0**-decades)),
+            -decades - 0.5,
+        ),
+        x[4],
+    )
+
+    result = differential_evolution(
+        lambda U: objective(inverse(U)),
+        bounds,
+        popsize=popsize,
+        maxiter=maxiter,
+        tol=tol,
+        seed=seed,
+        x0=u0,
+        polish=False,
+        updating="deferred",
+        vectorized=True,
+    )
+
+    x = inverse(result.x[:, None])[:, 0]
+    out = OptimizeResult(
+        x=x,
+        fun=result.fun,
+        nfev=objective.evaluations,
+        nit=result.nit,
+        success=result.success,
+        message=f"differential evolution: {result.message}",
+    )
+
+    ### POLISH ###
+    if polish is not None:
+        trs = Tracers(2, bgcs, list(gridded_data), N=3, species="modelv5")
+        local = fit(
+            x, bgcs, trs, gridded_data, isos, params, weights, isoweights, polish
+        )
+        if local.fun < out.fun:
+            out.x, out.fun = local.x, local.fun
+        out.nfev += local.nfev
+        out.message += f", polished: {local.message}"
+
+    return out
@@ -0,0 +1,235 @@
+"""
+File: residuals.py
+------------------
+
+Residual-vector objective for the stacked tracer experiments. Instead of
+collapsing the errors into a sum of RMSEs, every scaled error of every
+isotopocule, timepoint and tracer experiment is returned, weighted so that
+the sum of squares is the least-squares counterpart of the fusedobjective
+cost. scipy.optimize.least_squares can then exploit the structure of the
+problem, with the Jacobian taken from a forward-sensitivity run
+(see model/sensitivity.py).
+"""
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from .costfxn import timepoint_indices
+from .fusedobjective import fusedobjective
+from .gradient import residual_jacobian
+from .transform import rate_scale
+from .. import modelv5
+from ..model.health import HealthError, PENALTY
+from ..model.observe import observe
+from ..model.sensitivity import modelv5_sensitivity
+
+
+def _layout(gridded_data, weights, isoweights):
+    # model rows to record, the rows of each experiment among them, and the
+    # factor each experiment's (4, n) errors are multiplied by
+    indices = [timepoint_indices(data) for data in gridded_data]
+    rows = np.unique(np.concatenate(indices))
+    positions = [np.searchsorted(rows, index) for index in indices]
+    factors = [
+        np.sqrt(weights[j] * np.asarray(isoweights[j]) / len(indices[j]))[:, None]
+        for j in range(len(gridded_data))
+    ]
+    return rows, positions, factors
+
+
+def fusedresiduals(
+    x,
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    backend="numpy",
+    monitor=None,
+    substrates=None,
+):
+    """
+    Weighted residuals of a modelv5 solution for three stacked tracer experiments.
+
+    Each error is scaled as in costfxn (45N2Oa, 45N2Ob and 46N2O multiplied by
+    1000) and multiplied by sqrt(weights * isoweights / n), where n is the
+    number of timepoints of the experiment, so that the sum of squares is the
+    weighted sum of mean squared errors.
+
+    Inputs:
+    x, bgcs, trs, gridded_data, isos, params, weights, isoweights, backend,
+    monitor, substrates = same as for fusedobjective with observed=True;
+    backend must be "numpy" or "jit"
+
+    Outputs:
+    residuals = numpy array with dimensions (sum over experiments of 4 * n,)
+    ordered by experiment, then isotopocule (costfxn order), then timepoint.
+    A run stopped by the monitor, or a failed "ivp" integration, returns equal
+    residuals whose sum of squares is the penalty cost.
+    """
+
+    if isoweights is None:
+        isoweights = np.ones((3, 4))
+
+    rows, positions, factors = _layout(gridded_data, weights, isoweights)
+
+    try:
+        if substrates is None:
+            obs = observe(
+                modelv5,
+                x,
+                bgcs,
+                isos,
+                trs,
+                params,
+                rows,
+                backend=backend,
+                monitor=monitor,
+            )
+        else:
+            obs = substrates.observe(
+                x, bgcs, isos, trs, params, rows, backend=backend, monitor=monitor
+            )
+    except HealthError:
+        # the run failed a health check and was stopped early, or solve_ivp
+        # failed (see health.py)
+        penalty = PENALTY if monitor is None else monitor.penalty
+        size = sum(4 * len(p) for p in positions)
+        return np.full(size, np.sqrt(penalty / size))
+
+    residuals = []
+    for j, data in enumerate(gridded_data):
+        errors, _ = residual_jacobian(data, obs[:, positions[j], j])
+        residuals.append((errors * factors[j]).ravel())
+
+    return np.concatenate(residuals)
+
+
+def fusedresiduals_jacobian(
+    x, bgcs, trs, gridded_data, isos, params, weights, isoweights=None, **kwargs
+):
+    """
+    Jacobian of fusedresiduals with respect to x, from one forward-sensitivity
+    run of modelv5.
+
+    Inputs:
+    x, bgcs, trs, gridded_data, isos, params, weights, isoweights = same as
+    for fusedresiduals; other keyword arguments are accepted and ignored, so
+    that least_squares can pass the same kwargs as to fusedresiduals
+
+    Outputs:
+    jacobian = numpy array with dimensions (len(residuals), 5)
+    """
+
+    if isoweights is None:
+        isoweights = np.ones((3, 4))
+
+    rows, positions, factors = _layout(gridded_data, weights, isoweights)
+    obs, sens = modelv5_sensitivity(x, bgcs, isos, trs, params, rows)
+
+    jacobian = []
+    for j, data in enumerate(gridded_data):
+        _, J = residual_jacobian(
+            data, obs[:, positions[j], j], sens[:, :, positions[j], j]
+        )
+        jacobian.append((J * factors[j][:, :, None]).reshape(-1, len(x)))
+
+    return np.concatenate(jacobian)
+
+
+def residualfit(
+    x,
+    bgcs,
+    trs,
+    gridded_data,
+    isos,
+    params,
+    weights,
+    isoweights=None,
+    backend="numpy",
+    monitor=None,
+    substrates=None,
+    jac="sensitivity",
+    transform=None,
+):
+    """
+    Fit modelv5 to three stacked tracer experiments with
+    scipy.optimize.least_squares (trust region reflective, with bounds).
+
+    Inputs:
+    x = initial guess [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+    with non-negative rate constants and f between 0 and 1; rate constants
+    that are 0 are scaled by the largest one (see transform.rate_scale)
+    bgcs, trs, gridded_data, isos, params, weights, isoweights, backend,
+    monitor, substrates = same as for fusedresiduals
+    jac = "sensitivity" to take the Jacobian from fusedresiduals_jacobian, or
+    "2-point"/"3-point" for finite differences
+    transform = optional LogTransform (see transform.py); the search then runs
+    on the log rate constants and logit f instead
+
+    Outputs:
+    result = scipy OptimizeResult from least_squares, with fun replaced by the
+    fusedobjective cost of the solution (so that it compares with the other
+    optimizers) and the residuals kept as result.residuals
+    """
+
+    if isoweights is None:
+        isoweights = np.ones((3, 4))
+
+    x = np.asarray(x, dtype="float64")
+    args = (bgcs, trs, gridded_data, isos, params, weights, isoweights)
+    kwargs = {"backend": backend, "monitor": monitor, "substrates": substrates}
+
+    if transform is not None:
+        lower, upper = np.array(transform.bounds, dtype="float64").T
+        bnds = (lower, np.nan_to_num(upper, nan=np.inf))
+        fun = transform.objective(fusedresiduals)
+        if jac == "sensitivity":
+
+            def jac(z, *args, **kwargs):
+                J = fusedresiduals_jacobian(transform.inverse(z), *args)
+                return J * transform.derivative(z)
+
+        result = least_squares(
+            fun,
+            transform.forward(x),
+            jac=jac,
+            bounds=bnds,
+            method="trf",
+            args=args,
+            kwargs=kwargs,
+        )
+        result.z = result.x
+        result.x = transform.inverse(result.z)
+
+    else:
+        # rate constants are of order 1e-9 to 1e-7 and f of order 1
+        x_scale = np.append(rate_scale(x), 1.0)
+
+        # define bounds: no negative rate constants, f between 0 and 1
+        bnds = ([0, 0, 0, 0, 0], [np.inf, np.inf, np.inf, np.inf, 1])
+
+        result = least_squares(
+            fusedresiduals,
+            x,
+            jac=fusedresiduals_jacobian if jac == "sensitivity" else jac,
+            bounds=bnds,
+            method="trf",
+            x_scale=x_scale,
+            args=args,
+            kwargs=kwargs,
+        )
+
+    result.residuals = result.fun
+    result.fun = fusedobjective(
+        result.x,
+        *args,
+        backend=backend,
+        observed=True,
+        monitor=monitor,
+        substrates=substrates,
+    )
+
+    return result
@@ -0,0 +1,220 @@
+"""
+File: speculative.py
+--------------------
+
+Speculative Nelder-Mead. Every candidate move of an iteration (reflection,
+expansion, outside and inside contraction, and optionally the shrink
+vertices) depends only on the current simplex, so all of them are evaluated
+in one round, either as one batched model run (e.g. PopulationObjective) or
+concurrently on an executor. The move that the standard algorithm would
+have chosen is then applied, so the search follows the same path as
+scipy's Nelder-Mead in fewer sequential rounds of model runs.
+"""
+
+import numpy as np
+from scipy.optimize import Bounds, OptimizeResult
+
+# method name accepted by fit() and the run scripts
+SPECULATIVE = "speculative-nelder-mead"
+
+
+def _bounds(bounds, n):
+    # lower and upper bounds as arrays, from a Bounds object or (min, max) pairs
+    if bounds is None:
+        return None
+    if isinstance(bounds, Bounds):
+        lower, upper = bounds.lb, bounds.ub
+    else:
+        lower = [-np.inf if b[0] is None else b[0] for b in bounds]
+        upper = [np.inf if b[1] is None else b[1] for b in bounds]
+    return (
+        np.broadcast_to(np.asarray(lower, dtype="float64"), (n,)),
+        np.broadcast_to(np.asarray(upper, dtype="float64"), (n,)),
+    )
+
+
+def speculative_nelder_mead(
+    fun,
+    x0,
+    args=(),
+    bounds=None,
+    callback=None,
+    maxiter=None,
+    maxfev=None,
+    initial_simplex=None,
+    xatol=1e-4,
+    fatol=1e-4,
+    adaptive=False,
+    batch=None,
+    executor=None,
+    speculate_shrink=False,
+    **unknown_options,
+):
+    """
+    Nelder-Mead with all candidate moves of an iteration evaluated in one round.
+
+    Pass this function as the method of scipy.optimize.minimize, with the
+    options below in options={...}; the other options are the same as for
+    method="nelder-mead", and the search visits the same points.
+
+    Inputs:
+    fun, x0, args, bounds, callback = as passed on by scipy.optimize.minimize
+    maxiter, maxfev, initial_simplex, xatol, fatol, adaptive = same as for
+    method="nelder-mead"; maxfev counts the evaluations that the standard
+    algorithm would have made
+    batch = optional function that takes a numpy array with dimensions (N, S)
+    containing S points (one per column) and returns their S costs, e.g.
+    PopulationObjective; it replaces fun for all evaluations
+    executor = optional concurrent.futures executor whose map() evaluates the
+    points of a round concurrently, if batch is None
+    speculate_shrink = if True, also evaluate the shrink vertices in every
+    round, so that each iteration takes a single round
+
+    Outputs:
+    result = scipy OptimizeResult as for method="nelder-mead", with
+    nfev = points evaluated, nfev_serial = evaluations of the standard
+    algorithm, and nrounds = sequential rounds of evaluations
+    """
+
+    x0 = np.asarray(x0, dtype="float64").ravel()
+    N = len(x0)
+
+    if adaptive:
+        rho, chi, psi, sigma = 1, 1 + 2 / N, 0.75 - 1 / (2 * N), 1 - 1 / N
+    else:
+        rho, chi, psi, sigma = 1, 2, 0.5, 0.5
+
+    limits = _bounds(bounds, N)
+
+    def clip(x):
+        return x if limits is None else np.clip(x, *limits)
+
+    counts = {"nfev": 0, "nrounds": 0}
+
+    def evaluate(points):
+        # one round of evaluations
+        points = np.atleast_2d(points)
+        counts["nfev"] += len(points)
+        counts["nrounds"] += 1
+        if batch is not None:
+            return np.asarray(batch(points.T), dtype="float64")
+        if executor is not None:
+            return np.array(
+                list(executor.map(fun, points, *[[a] * len(points) for a in args]))
+            )
+        return np.array([fun(point, *args) for point in points])
+
+    ### INITIAL SIMPLEX ###
+    x0 = clip(x0)
+    if initial_simplex is None:
+        sim = np.tile(x0, (N + 1, 1))
+        for k in range(N):
+            sim[k + 1, k] = 1.05 * x0[k] if x0[k] != 0 else 0.00025
+    else:
+        sim = np.array(initial_simplex, dtype="float64")
+        if sim.shape != (N + 1, N):
+            raise ValueError("`initial_simplex` should be an array of shape (N+1,N)")
+
+    if maxiter is None and maxfev is None:
+        maxiter = maxfev = N * 200
+    elif maxiter is None:
+        maxiter = N * 200 if maxfev == np.inf else np.inf
+    elif maxfev is None:
+        maxfev = N * 200 if maxiter == np.inf else np.inf
+
+    if limits is not None:
+        # reflect vertices beyond the upper bounds into the interior
+        sim = np.where(sim > limits[1], 2 * limits[1] - sim, sim)
+        sim = clip(sim)
+
+    fsim = evaluate(sim)
+    serial = N + 1
+    order = np.argsort(fsim)
+    sim, fsim = sim[order], fsim[order]
+
+    iterations = 1
+
+    ### ITERATIONS ###
+    while serial < maxfev and iterations < maxiter:
+
+        if (
+            np.max(np.abs(sim[1:] - sim[0])) <= xatol
+            and np.max(np.abs(fsim[0] - fsim[1:])) <= fatol
+        ):
+            break
+
+        xbar = np.sum(sim[:-1], axis=0) / N
+        moves = np.array(
+            [
+                (1 + rho) * xbar - rho * sim[-1],  # reflection
+                (1 + rho * chi) * xbar - rho * chi * sim[-1],  # expansion
+                (1 + psi * rho) * xbar - psi * rho * sim[-1],  # outside contraction
+                (1 - psi) * xbar + psi * sim[-1],  # inside contraction
+            ]
+        )
+        moves = clip(moves)
+        shrunk = clip(sim[0] + sigma * (sim[1:] - sim[0]))
+
+        if speculate_shrink:
+            values = evaluate(np.vstack([moves, shrunk]))
+            fmoves, fshrunk = values[:4], values[4:]
+        else:
+            fmoves, fshrunk = evaluate(moves), None
+        fxr, fxe, fxc, fxcc = fmoves
+
+        ### PICK THE MOVE OF THE STANDARD ALGORITHM ###
+        doshrink = False
+        if fxr < fsim[0]:
+            serial += 2
+            if fxe < fxr:
+                sim[-1], fsim[-1] = moves[1], fxe
+            else:
+                sim[-1], fsim[-1] = moves[0], fxr
+        elif fxr < fsim[-2]:
+            serial += 1
+            sim[-1], fsim[-1] = moves[0], fxr
+        elif fxr < fsim[-1]:
+            serial += 2
+            if fxc <= fxr:
+                sim[-1], fsim[-1] = moves[2], fxc
+            else:
+                doshrink = True
+        else:
+            serial += 2
+            if fxcc < fsim[-1]:
+                sim[-1], fsim[-1] = moves[3], fxcc
+            else:
+                doshrink = True
+
+        if doshrink:
+            serial += N
+            if fshrunk is None:
+                fshrunk = evaluate(shrunk)
+            sim[1:], fsim[1:] = shrunk, fshrunk
+
+        iterations += 1
+
+        order = np.argsort(fsim)
+        sim, fsim = sim[order], fsim[order]
+        if callback is not None:
+            callback(sim[0])
+
+    if serial >= maxfev:
+        status, message = 1, "Maximum number of function evaluations has been exceeded."
+    elif iterations >= maxiter:
+        status, message = 2, "Maximum number of iterations has been exceeded."
+    else:
+        status, message = 0, "Optimization terminated successfully."
+
+    return OptimizeResult(
+        x=sim[0],
+        fun=fsim[0],
+        nit=iterations,
+        nfev=counts["nfev"],
+        nfev_serial=serial,
+        nrounds=counts["nrounds"],
+        status=status,
+        success=status == 0,
+        message=message,
+        final_simplex=(sim, fsim),
+    )
@@ -0,0 +1,167 @@
+"""
+File: transform.py
+------------------
+
+Reparameterization of the modelv5 x for the optimizers. The rate constants
+span several orders of magnitude while f lies in [0, 1], so the optimizers
+work on z = [log(k / k0) for each rate constant, logit(f)] instead, where k0
+are the x0() estimates. Every entry of z is of order 1 near the initial
+guess, and results are mapped back to x. z is only bounded far from the
+guess, so that optima on the bounds of x (e.g. f = 0) are reached at a
+finite z instead of being chased towards infinity.
+"""
+
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import expit, logit
+
+from .speculative import speculative_nelder_mead
+
+# scipy.optimize.minimize methods that accept bounds
+BOUNDED = ("nelder-mead", "powell", "l-bfgs-b", "tnc", "slsqp", "trust-constr")
+
+
+def rate_scale(x):
+    """
+    Scale of each rate constant of x for the optimizers.
+
+    A rate constant that x0() estimates as 0 has no scale of its own; scaling
+    it by 1 would leave it ~1e-8 on the scale of the optimizer, which then
+    never moves it. It is scaled by the largest rate constant instead.
+
+    Inputs:
+    x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+
+    Outputs:
+    scale = numpy array with dimensions (4,): each positive rate constant of x,
+    or the largest one for rate constants that are 0 (1 if all of them are)
+    """
+
+    rates = np.asarray(x, dtype="float64")[:4]
+    fallback = rates.max() if (rates > 0).any() else 1.0
+
+    return np.where(rates > 0, rates, fallback)
+
+
+class LogTransform:
+    """
+    Map between x = [knitrification, kdenitno2, kdenitno3, khybrid2, f] and
+    the unbounded internal parameters z.
+
+    Inputs:
+    guess = initial guess for x, e.g. built from x0(); its rate constants set
+    the scale of the log transform (rate constants equal to the guess map to
+    z = 0). Rate constants that x0() estimates as 0 are scaled by the largest
+    estimate instead, and start on the lower bound of z.
+    eps = smallest rate constant (relative to the guess) and smallest distance
+    of f from 0 and 1 that can be represented; x on or beyond the bounds of x
+    is clipped to this
+
+    Attributes:
+    bounds = bounds of z for the optimizers, one (min, max) pair per entry
+    """
+
+    def __init__(self, guess, eps=1e-6):
+        self.scale = rate_scale(guess)
+        self.eps = eps
+        self.bounds = [(np.log(eps), None)] * 4 + [(logit(eps), logit(1 - eps))]
+
+    def forward(self, x):
+        """
+        Inputs:
+        x = [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+
+        Outputs:
+        z = numpy array with dimensions (5,)
+        """
+
+        x = np.asarray(x, dtype="float64")
+        rates = np.maximum(x[:4] / self.scale, self.eps)
+        f = np.clip(x[4], self.eps, 1 - self.eps)
+        return np.append(np.log(rates), logit(f))
+
+    def inverse(self, z):
+        """
+        Inputs:
+        z = internal parameters, or a numpy array with dimensions (5, S)
+        containing one set of internal parameters per column
+
+        Outputs:
+        x = numpy array [knitrification, kdenitno2, kdenitno3, khybrid2, f]
+        (one per column for (5, S) input); rate constants are positive and f
+        lies in [0, 1] for any z
+        """
+
+        z = np.asarray(z, dtype="float64")
+        rates = (self.scale * np.exp(z[:4]).T).T
+        return np.concatenate([rates, expit(z[4:])])
+
+    def derivative(self, z):
+        """
+        Inputs:
+        z = internal parameters
+
+        Outputs:
+        dxdz = numpy array with dimensions (5,) containing dx/dz for each
+        entry, to convert gradients and Jacobians with respect to x into ones
+        with respect to z by the chain rule
+        """
+
+        x = self.inverse(z)
+        return np.append(x[:4], x[4] * (1 - x[4]))
+
+    def objective(self, fun):
+        """
+        Wrap an objective function of x, e.g. fusedobjective, as a function of z.
+        """
+
+        def wrapped(z, *args, **kwargs):
+            return fun(self.inverse(z), *args, **kwargs)
+
+        return wrapped
+
+    def minimize(self, fun, x, args=(), method="nelder-mead", simplex=0.5, **kwargs):
+        """
+        scipy.optimize.minimize of an objective function of x, carried out in z.
+
+        Inputs:
+        fun = objective function of x, e.g. fusedobjective
+        x = initial guess
+        args = extra arguments of fun
+        method = any scipy.optimize.minimize method, or speculative_nelder_mead
+        (see speculative.py); methods that take bounds are given self.bounds
+        simplex = for nelder-mead and speculative_nelder_mead, size of the initial simplex along each
+        entry of z (0.5 changes a rate constant by a factor of ~1.6), unless
+        options={"initial_simplex": ...} is given; xatol defaults to 1e-3
+        kwargs = passed on to minimize; a jac given as a function of x is not
+        converted, so use gradient-based methods through gradientfit instead
+
+        Outputs:
+        result = scipy OptimizeResult with result.x mapped back to x
+        """
+
+        z0 = self.forward(x)
+
+        options = dict(kwargs.pop("options", None) or {})
+        simplex_method = (
+            method is speculative_nelder_mead or str(method).lower() == "nelder-mead"
+        )
+        if simplex_method:
+            # the default simplex perturbs each entry by 5% of its value, which
+            # is next to nothing for the entries that are 0 at the guess
+            options.setdefault(
+                "initial_simplex", np.vstack([z0, z0 + simplex * np.eye(len(z0))])
+            )
+            # stop once the simplex spans less than 0.1% of each rate constant
+            options.setdefault("xatol", 1e-3)
+
+        if simplex_method or str(method).lower() in BOUNDED:
+            kwargs.setdefault("bounds", self.bounds)
+
+        result = minimize(
+            self.objective(fun), z0, args=args, method=method, options=options, **kwargs
+        )
+        result.z = result.x
+        result.x = self.inverse(result.z)
+
+        return result
@@ -1,16 +1,20 @@
 import pandas as pd
 import numpy as np
 
-# use for nelder-mead optimization of a convex function
-from scipy.optimize import minimize
-from numpy.random import rand
-
 from .datapath import datapath
 
 from .. import *
 
 
-def errors(station, feature, weights=None):
+def errors(
+    station,
+    feature,
+    weights=None,
+    method="nelder-mead",
+    reparameterize=False,
+    n_jobs=None,
+    seed=None,
+):
 
     ### KEYWORDS ###
     stn = station
@@ -34,113 +38,45 @@ def errors(station, feature, weights=None):
         station=stn, feature=ft, tracer="NO3-"
     )
 
-    ### INITIAL GUESS FOR OPTIMIZATION ###
-    guess = x0(station=stn, feature=ft, key=bgckey)
-
-    [
-        kestimateNH4,
-        kestimateNO,
-        kestimateNO2,
-        kestimateNO3,
-        kestimate_hybrid1,
-        kestimate_hybrid2,
-        kestimate_hybrid3,
-        kestimate_hybrid4,
-        kestimate_hybrid5,
-        kestimate_hybrid6,
-    ] = guess
-
-    def objective(x):  # , bgc, isos, tracers, modelparams):
-
-        tracersNH4 = modelv5(x, bgcNH4, isos, trNH4, params)
-
-        costNH4 = costfxn(
-            trainingdata=gridded_dataNH4,
-            modeled_44=tracersNH4.n2o_44,
-            modeled_45a=tracersNH4.n2o_45a,
-            modeled_45b=tracersNH4.n2o_45b,
-            modeled_46=tracersNH4.n2o_46,
-            weights=np.array([1, 1, 1, 1]),
-        )
-
-        tracersNO2 = modelv5(x, bgcNO2, isos, trNO2, params)
-
-        costNO2 = costfxn(
-            trainingdata=gridded_dataNO2,
-            modeled_44=tracersNO2.n2o_44,
-            modeled_45a=tracersNO2.n2o_45a,
-            modeled_45b=tracersNO2.n2o_45b,
-            modeled_46=tracersNO2.n2o_46,
-            weights=np.array([1, 1, 1, 1]),
-        )
-
-        tracersNO3 = modelv5(x, bgcNO3, isos, trNO3, params)
-
-        costNO3 = costfxn(
-            trainingdata=gridded_dataNO3,
-            modeled_44=tracersNO3.n2o_44,
-            modeled_45a=tracersNO3.n2o_45a,
-            modeled_45b=tracersNO3.n2o_45b,
-            modeled_46=tracersNO3.n2o_46,
-            weights=np.array([0, 0, 0, 4]),
-        )
-
-        cost = np.array([costNH4, costNO2, costNO3])
-
-        print(cost * weights)
-
-        cost = np.sum(cost * weights)
-
-        return cost
-
-    # x = [kestimateNH4, kestimateNO2, kestimateNO3, kestimate_hybrid1, kestimate_hybrid2] # for modelv1
-
-    # x = [kestimateNH4, kestimateNO2, kestimateNO3, kestimate_hybrid3, kestimate_hybrid4] # for modelv2
-
-    # x = [kestimateNH4, kestimateNO, kestimateNO3, kestimate_hybrid3, kestimate_hybrid4] # for modelv3
-
-    # x = [kestimateNH4, kestimateNO2, kestimateNO3, kestimate_hybrid5, kestimate_hybrid6] # for modelv4
-
-    f = 0.5
-
-    x = [kestimateNH4, kestimateNO2, kestimateNO3, kestimate_hybrid2, f]  # for modelv5
-
-    for i in range(3):
-
-        ### OPTIMIZE WITH RANDOMLY SELECTED X0 ###
-
-        # define range for input
-        r_min = np.array(x) * 0.75
-        r_max = np.array(x) * 1.25
-        # define the starting point as a random sample from the domain
-        pt = r_min + rand(5) * (r_max - r_min)
-
-        print(f"objective(x0) = {objective(pt)}")
+    # weights for each isotopocule in each tracer experiment
+    isoweights = np.array([[1, 1, 1, 1], [1, 1, 1, 1], [0, 0, 0, 4]])
+
+    ### OPTIMIZE WITH THREE RANDOMLY SELECTED X0 ###
+    # starting points are drawn from 75% to 125% of the x0() estimates (f = 0.5)
+    # and fitted concurrently, each worker process initializing the
+    # experiments once (see optimization/multistart.py)
+    fits = multistart(
+        stn,
+        ft,
+        starts=3,
+        weights=weights,
+        isoweights=isoweights,
+        method=method,
+        reparameterize=reparameterize,
+        seed=seed,
+        n_jobs=n_jobs,
+    )
+    # the starts are reproduced by passing this seed (see montecarlo/streams.py)
+    print("Seed of the starting points: %d" % fits.seed)
 
-        # define bounds: no negative rate constants
-        # bnds = ((0, None), (0, None), (0, None), (0, None), (0, None)) # for models 1-4
-        bnds = ((0, None), (0, None), (0, None), (0, None), (0, 1))  # for model v5
+    saveouts = []
+    for i, solution in enumerate(fits.xs):
 
-        # perform the search with intelligently selected x0
-        # result = minimize(objective, x, args = (bgc, isos, tr, modelparams), method='nelder-mead', bounds=bnds)
-        result = minimize(
-            objective, pt, method="nelder-mead", bounds=bnds
-        )  # , options={'maxfev' : 500, 'fatol': 0.1})
         # summarize the result
-        print("Status : %s" % result["message"])
-        print("Total Evaluations: %d" % result["nfev"])
-        # evaluate solution
-        solution = result["x"]
-        evaluation = objective(solution)  # , bgc, isos, tr, params)
-        print("Solution: f(%s) = %.5f" % (solution, evaluation))
+        print("Status : %s" % fits.messages[i])
+        print("Total Evaluations: %d" % fits.nfevs[i])
+        print("Solution: f(%s) = %.5f" % (solution, fits.funs[i]))
+
+        tracersNH4 = modelv5(solution, bgcNH4, isos, trNH4, params)
+        tracersNO2 = modelv5(solution, bgcNO2, isos, trNO2, params)
+        tracersNO3 = modelv5(solution, bgcNO3, isos, trNO3, params)
 
-        tracersNH4 = modelv5(result.x, bgcNH4, isos, trNH4, params)
-        tracersNO2 = modelv5(result.x, bgcNO2, isos, trNO2, params)
-        tracersNO3 = modelv5(result.x, bgcNO3, isos, trNO3, params)
+        outputNH4 = postprocess(bgcNH4, isos, tracersNH4, solution, model="modelv5")
+        outputNO2 = postprocess(bgcNO2, isos, tracersNO2, solution, model="modelv5")
+        outputNO3 = postprocess(bgcNO3, isos, tracersNO3, solution, model="modelv5")
 
-        outputNH4 = postprocess(bgcNH4, isos, tracersNH4, result.x, model="modelv5")
-        outputNO2 = postprocess(bgcNO2, isos, tracersNO2, result.x, model="modelv5")
-        outputNO3 = postprocess(bgcNO3, isos, tracersNO3, result.x, model="modelv5")
+        if i == fits.best:  # plot the best of the three solutions
+            outputs = [outputNH4, outputNO2, outputNO3]
 
         saveout = np.array(
             [
@@ -165,43 +101,26 @@ def errors(station, feature, weights=None):
         saveout["Station"] = stn
         saveout["Feature"] = ft
         saveout["Key"] = bgckey
-        saveout["cost"] = objective(result.x)
-        saveout["f"] = result.x[4]  # only include for modelv5
+        saveout["cost"] = fits.funs[i]
+        saveout["f"] = solution[4]  # only include for modelv5
         saveout["weightNH4"] = weights[0]
         saveout["weightNO2"] = weights[1]
         saveout["weightNO3"] = weights[2]
-        saveout = saveout.set_index("Key")
-        modeloutput = pd.read_csv(f"{datapath()}00_modelv5error.csv", index_col="Key")
-        modeloutput = pd.concat([modeloutput, saveout])  # modeloutput.append(saveout)
-        modeloutput.to_csv(f"{datapath()}00_modelv5error.csv")
-
-        if i == 2:
-
-            inputdata = pd.read_csv(f"{datapath()}00_incubationdata.csv")
-
-            scatter_plot(
-                data=inputdata,
-                station=stn,
-                feature=ft,
-                tracer="NH4+",
-                modeloutput=outputNH4,
-                filename=f"{datapath()}figures/modelv5errors/{stn}{ft}NH4+modelv5.pdf",
-            )
-
-            scatter_plot(
-                data=inputdata,
-                station=stn,
-                feature=ft,
-                tracer="NO2-",
-                modeloutput=outputNO2,
-                filename=f"{datapath()}figures/modelv5errors/{stn}{ft}NO2-modelv5.pdf",
-            )
-
-            scatter_plot(
-                data=inputdata,
-                station=stn,
-                feature=ft,
-                tracer="NO3-",
-                modeloutput=outputNO3,
-                filename=f"{datapath()}figures/modelv5errors/{stn}{ft}NO3-modelv5.pdf",
-            )
+        saveouts.append(saveout.set_index("Key"))
+
+    # read and write the error table once for all three solutions
+    modeloutput = pd.read_csv(f"{datapath()}00_modelv5error.csv", index_col="Key")
+    modeloutput = pd.concat([modeloutput] + saveouts)  # modeloutput.append(saveout)
+    modeloutput.to_csv(f"{datapath()}00_modelv5error.csv")
+
+    inputdata = pd.read_csv(f"{datapath()}00_incubationdata.csv")
+
+    for tracer, output in zip(["NH4+", "NO2-", "NO3-"], outputs):
+        scatter_plot(
+            data=inputdata,
+            station=stn,
+            feature=ft,
+            tracer=tracer,
+            modeloutput=output,
+            filename=f"{datapath()}figures/modelv5errors/{stn}{ft}{tracer}modelv5.pdf",
+        )
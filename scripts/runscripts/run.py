@@ -46,9 +46,15 @@ def run(station, feature):
         kestimate_hybrid6,
     ] = guess
 
+    # the objective only integrates up to the last data timepoint of each
+    # experiment; the full run is kept for postprocess and plotting
+    paramsNH4 = horizon(gridded_dataNH4, params)
+    paramsNO2 = horizon(gridded_dataNO2, params)
+    paramsNO3 = horizon(gridded_dataNO3, params)
+
     def objective(x):  # , bgc, isos, tracers, modelparams):
 
-        tracersNH4 = modelv1(x, bgcNH4, isos, trNH4, params)
+        tracersNH4 = modelv1(x, bgcNH4, isos, trNH4, paramsNH4)
 
         costNH4 = costfxn(
             trainingdata=gridded_dataNH4,
@@ -59,7 +65,7 @@ def run(station, feature):
             weights=np.array([0, 1000, 1000, 1000]),
         )
 
-        tracersNO2 = modelv1(x, bgcNO2, isos, trNO2, params)
+        tracersNO2 = modelv1(x, bgcNO2, isos, trNO2, paramsNO2)
 
         costNO2 = costfxn(
             trainingdata=gridded_dataNO2,
@@ -70,7 +76,7 @@ def run(station, feature):
             weights=np.array([0, 1000, 1000, 1000]),
         )
 
-        tracersNO3 = modelv1(x, bgcNO3, isos, trNO3, params)
+        tracersNO3 = modelv1(x, bgcNO3, isos, trNO3, paramsNO3)
 
         costNO3 = costfxn(
             trainingdata=gridded_dataNO3,
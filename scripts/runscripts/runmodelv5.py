@@ -7,11 +7,30 @@ from numpy.random import rand
 import time  # for calculating execution time
 
 from .datapath import datapath
+from ..optimization.gradient import METHODS as GRADIENT_METHODS
+from ..optimization.speculative import SPECULATIVE
 
 from .. import *
 
 
-def runmodelv5(station, feature, weights=None):
+def runmodelv5(
+    station,
+    feature,
+    weights=None,
+    monitor=None,
+    substrates=None,
+    method="nelder-mead",
+    reparameterize=False,
+    coarse=None,
+):
+
+    check_options(
+        method,
+        monitor=monitor,
+        substrates=substrates,
+        reparameterize=reparameterize,
+        coarse=coarse,
+    )
 
     ### KEYWORDS ###
     stn = station
@@ -51,84 +70,163 @@ def runmodelv5(station, feature, weights=None):
         kestimate_hybrid6,
     ] = guess
 
-    def objective(
-        x, bgcNH4, trNH4, bgcNO2, trNO2, bgcNO3, trNO3
-    ):  # , bgc, isos, tracers, modelparams):
-
-        tracersNH4 = modelv5(x, bgcNH4, isos, trNH4, params)
-
-        costNH4 = costfxn(
-            trainingdata=gridded_dataNH4,
-            modeled_44=tracersNH4.n2o_44,
-            modeled_45a=tracersNH4.n2o_45a,
-            modeled_45b=tracersNH4.n2o_45b,
-            modeled_46=tracersNH4.n2o_46,
-            weights=np.array([1, 1, 1, 1]),
-        )
-
-        tracersNO2 = modelv5(x, bgcNO2, isos, trNO2, params)
-
-        costNO2 = costfxn(
-            trainingdata=gridded_dataNO2,
-            modeled_44=tracersNO2.n2o_44,
-            modeled_45a=tracersNO2.n2o_45a,
-            modeled_45b=tracersNO2.n2o_45b,
-            modeled_46=tracersNO2.n2o_46,
-            weights=np.array([1, 1, 1, 1]),
+    ### STACK THE THREE TRACER EXPERIMENTS FOR THE FUSED OBJECTIVE ###
+    bgcs = BioGeoChemistryEnsemble([bgcNH4, bgcNO2, bgcNO3])
+    gridded_data = [gridded_dataNH4, gridded_dataNO2, gridded_dataNO3]
+    # the objective only reads the N2O isotopocules at the data timepoints,
+    # so its state arrays only need two rows and the modelv5 species
+    # (see model/observe.py)
+    trs = Tracers(2, bgcs, gridded_data, N=3, species="modelv5")
+
+    def objective(x, bgcs, trs):
+
+        cost, costs = fusedobjective(
+            x,
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            full_output=True,
+            observed=True,
+            monitor=monitor,
+            substrates=substrates,
         )
 
-        tracersNO3 = modelv5(x, bgcNO3, isos, trNO3, params)
-
-        costNO3 = costfxn(
-            trainingdata=gridded_dataNO3,
-            modeled_44=tracersNO3.n2o_44,
-            modeled_45a=tracersNO3.n2o_45a,
-            modeled_45b=tracersNO3.n2o_45b,
-            modeled_46=tracersNO3.n2o_46,
-            weights=np.array([1, 1, 1, 1]),  # np.array([0,0,0,4])
-        )
-
-        cost = np.array([costNH4, costNO2, costNO3])
-
-        print(cost * weights)
-
-        cost = np.sum(cost * weights)
+        print(costs * weights)
 
         return cost
 
     f = 0.5
 
-    args = (bgcNH4, trNH4, bgcNO2, trNO2, bgcNO3, trNO3)
+    args = (bgcs, trs)
 
     x = [kestimateNH4, kestimateNO2, kestimateNO3, kestimate_hybrid2, f]  # for modelv5
 
-    print(
-        f"objective(x0) = {objective(x, bgcNH4, trNH4, bgcNO2, trNO2, bgcNO3, trNO3)}"
-    )
+    print(f"objective(x0) = {objective(x, bgcs, trs)}")
 
     # xguess = x
 
     # define bounds: no negative rate constants, f between 0 and 1
     bnds = ((0, None), (0, None), (0, None), (0, None), (0, 1))  # for model v5
 
+    # optionally search log rate constants scaled by x0() and logit f instead
+    # (see optimization/transform.py); results are mapped back to x
+    transform = LogTransform(x) if reparameterize else None
+
     # perform the search with intelligently selected x0
     # result = minimize(objective, x, args = (bgc, isos, tr, modelparams), method='nelder-mead', bounds=bnds)
     # increasing option "fatol" from factory setting of 0.0001 to 0.1 reduces the amount of time to solve
     st = time.time()
-    result = minimize(
-        objective, x, args=args, method="nelder-mead", bounds=bnds
-    )  # , options={'maxfev' : 500, 'fatol': 0.1})
+    if method == "linear":
+        # variable projection over f (see optimization/linearfit.py),
+        # polished with nelder-mead on the fully coupled model
+        result = linearfit(
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            substrates=substrates,
+            polish=True,
+            transform=transform,
+            monitor=monitor,
+        )
+    elif method == "differential_evolution":
+        # global search, each generation evaluated in one batched model run
+        # (see optimization/population.py), polished with least squares
+        result = populationfit(
+            x,
+            bgcs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            polish="least_squares",
+        )
+    elif coarse is not None:
+        # fit on a time grid coarsened by this factor first, then refine at
+        # full resolution (see optimization/multifidelity.py)
+        result = multifidelity(
+            x,
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            factor=coarse,
+            method=method,
+            transform=transform,
+            monitor=monitor,
+            substrates=substrates,
+        )
+        print(f"Coarse grid discrepancy: {result.discrepancy:.5f}")
+        print(f"Coarse to refined shift: {result.shift}")
+    elif method == "least_squares":
+        # trust region reflective least squares on the weighted residual
+        # vector (see optimization/residuals.py)
+        result = residualfit(
+            x,
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            monitor=monitor,
+            substrates=substrates,
+            transform=transform,
+        )
+    elif method == SPECULATIVE:
+        # nelder-mead with the candidate moves of each iteration evaluated
+        # in one batched model run (see optimization/speculative.py)
+        result = fit(
+            x,
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            method=method,
+            transform=transform,
+        )
+    elif method.lower() in GRADIENT_METHODS:
+        # bounded gradient-based search with the exact gradient from forward
+        # sensitivities (see optimization/gradient.py)
+        result = gradientfit(
+            x,
+            bgcs,
+            trs,
+            gridded_data,
+            isos,
+            params,
+            weights,
+            method=method,
+            transform=transform,
+        )
+    elif transform is not None:
+        result = transform.minimize(objective, x, args=args, method=method)
+    else:
+        result = minimize(
+            objective, x, args=args, method=method, bounds=bnds
+        )  # , options={'maxfev' : 500, 'fatol': 0.1})
     et = time.time()
     # summarize the result
     print("Status : %s" % result["message"])
     print("Total Evaluations: %d" % result["nfev"])
     # get the execution time
     print("Execution time:", (et - st), "seconds")
+    if monitor is not None:  # optional HealthMonitor, see model/health.py
+        print(f"Health monitor: {monitor}")
+    if substrates is not None:  # optional SubstrateCache, see model/substrates.py
+        print(f"Substrate cache: {substrates}")
     # evaluate solution
     solution = result["x"]
-    evaluation = objective(
-        solution, bgcNH4, trNH4, bgcNO2, trNO2, bgcNO3, trNO3
-    )  # , bgc, isos, tr, params)
+    evaluation = objective(solution, bgcs, trs)  # , bgc, isos, tr, params)
     print("Solution: f(%s) = %.5f" % (solution, evaluation))
 
     tracersNH4 = modelv5(result.x, bgcNH4, isos, trNH4, params)
@@ -165,7 +263,7 @@ def runmodelv5(station, feature, weights=None):
     saveout["Station"] = stn
     saveout["Feature"] = ft
     saveout["Key"] = bgckey
-    saveout["cost"] = objective(result.x, bgcNH4, trNH4, bgcNO2, trNO2, bgcNO3, trNO3)
+    saveout["cost"] = objective(result.x, bgcs, trs)
     saveout["f"] = result.x[4]
     saveout["weightNH4"] = weights[0]
     saveout["weightNO2"] = weights[1]
@@ -0,0 +1,31 @@
+"""
+File: test_gradient.py
+----------------------
+
+Tests of the gradient-based fit of modelv5 (scripts/optimization/gradient.py).
+"""
+
+import numpy as np
+
+from scripts.optimization.gradient import gradientfit
+from scripts.optimization.multistart import experiments, guess
+from scripts.optimization.transform import rate_scale
+
+
+def test_rate_scale_of_zero_rates():
+    # rate constants that are 0 are scaled by the largest rate constant
+    scale = rate_scale([0.0, 2e-9, 3e-10, 1e-8, 0.5])
+    assert np.array_equal(scale, [1e-8, 2e-9, 3e-10, 1e-8])
+    assert np.array_equal(rate_scale([0.0, 0.0, 0.0, 0.0, 0.5]), np.ones(4))
+
+
+def test_gradientfit_moves_zero_rates():
+    # x0() estimates knitrification at PS2 SCM as 0
+    x = guess("PS2", "SCM")
+    assert x[0] == 0
+
+    weights = np.array([1.0 / 3, 1.0 / 3, 1.0 / 3])
+    result = gradientfit(x, *experiments("PS2", "SCM"), weights, method="L-BFGS-B")
+
+    assert result.x[0] > 0
+    assert not np.allclose(result.x[1:4], x[1:4])
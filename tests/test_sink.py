@@ -0,0 +1,44 @@
+"""
+File: test_sink.py
+------------------
+
+Tests of the Monte Carlo result sink (scripts/montecarlo/sink.py).
+"""
+
+import glob
+import os
+
+import pandas as pd
+
+from scripts.montecarlo.sink import ResultSink
+
+
+def rows(iterations):
+    return pd.DataFrame(
+        {
+            "Key": [f"PS1SCM{i}" for i in iterations],
+            "iteration": iterations,
+            "cost": [1.25 + i for i in iterations],
+            "f": [0.5] * len(iterations),
+            "weightNO3": [1.0 / 3] * len(iterations),
+        }
+    ).set_index("Key")
+
+
+def test_truncated_shard_line_is_dropped(tmp_path):
+    sink = ResultSink(str(tmp_path / "PS1SCM.csv"))
+    sink.write(rows([0, 1]))
+    (shard,) = glob.glob(os.path.join(sink.shards, "*.csv"))
+
+    # a worker killed mid-write: iteration 2 has a valid iteration and a
+    # truncated cost, and its weights and sentinel are missing
+    with open(shard, "a") as file:
+        file.write("PS1SCM2,2,3.2")
+
+    assert sink.completed() == {0, 1}
+    assert list(sink.read().columns) == list(rows([0]).columns)
+
+    # the iteration is written again by a resumed run
+    sink.write(rows([2]))
+    assert sink.completed() == {0, 1, 2}
+    assert sink.read().loc["PS1SCM2", "cost"] == 3.25